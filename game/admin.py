@@ -1,3 +1,33 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import FunnelCounter, PlaythroughEvent
+
+
+@admin.register(PlaythroughEvent)
+class PlaythroughEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'story_id', 'user', 'from_state', 'raw_input', 'tier', 'action', 'to_state')
+    list_filter = ('story_id', 'tier')
+    search_fields = ('raw_input', 'from_state', 'action', 'session_key')
+    date_hierarchy = 'created_at'
+    list_select_related = ('user',)
+
+    # Registro de solo inserción
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(FunnelCounter)
+class FunnelCounterAdmin(admin.ModelAdmin):
+    list_display = ('story_id', 'story_version', 'kind', 'source', 'action', 'target', 'count', 'updated_at')
+    list_filter = ('story_id', 'kind')
+    search_fields = ('source', 'action', 'target')
+
+    # Los contadores solo los actualiza game/funnel.py
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,153 @@
+# game/analysis.py
+
+# Análisis estático del grafo de una historia. Se ejecuta al compilar la
+# historia (el resultado se guarda en la caché junto a ella) y desde
+# `python manage.py analyze_story`.
+
+from collections import deque
+
+
+def reachable_from(states, initial_state):
+    """BFS desde `initial_state`: {estado: (estado_padre, acción)} con el camino más corto."""
+    parents = {initial_state: None}
+    queue = deque([initial_state])
+    while queue:
+        state = queue.popleft()
+        for action, target in states[state]['transitions'].items():
+            if target in states and target not in parents:
+                parents[target] = (state, action)
+                queue.append(target)
+    return parents
+
+
+def _path_to(parents, state):
+    actions, path = [], [state]
+    while parents[state] is not None:
+        state, action = parents[state]
+        actions.append(action)
+        path.append(state)
+    return list(reversed(path)), list(reversed(actions))
+
+
+def strongly_connected_components(states):
+    """Componentes fuertemente conexas (Tarjan iterativo), en orden topológico inverso."""
+    index_of, lowlink = {}, {}
+    stack, on_stack = [], set()
+    components = []
+    counter = 0
+
+    for root in states:
+        if root in index_of:
+            continue
+        # Pila de trabajo: (estado, iterador sobre sus sucesores)
+        work = [(root, iter([t for t in states[root]['transitions'].values() if t in states]))]
+        index_of[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            state, successors = work[-1]
+            advanced = False
+            for target in successors:
+                if target not in index_of:
+                    index_of[target] = lowlink[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack.add(target)
+                    work.append((target, iter([t for t in states[target]['transitions'].values() if t in states])))
+                    advanced = True
+                    break
+                if target in on_stack:
+                    lowlink[state] = min(lowlink[state], index_of[target])
+            if advanced:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[state])
+            if lowlink[state] == index_of[state]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == state:
+                        break
+                components.append(component)
+    return components
+
+
+def analyze_story(states, initial_state):
+    """
+    Valida el grafo y calcula métricas precomputadas. `states` es el diccionario
+    normalizado por `stories.compile_story`. La historia queda `verified` si
+    todos los destinos existen y todos los estados son alcanzables.
+    """
+    missing_targets = [
+        {'state': state, 'action': action, 'target': target}
+        for state, details in states.items()
+        for action, target in details['transitions'].items()
+        if target not in states
+    ]
+
+    parents = reachable_from(states, initial_state)
+    unreachable = [state for state in states if state not in parents]
+
+    # Estados no finales de los que no se puede salir (ninguna transición válida)
+    dead_ends = [
+        state for state, details in states.items()
+        if not details['isFinal'] and not any(t in states for t in details['transitions'].values())
+    ]
+
+    endings = {}
+    for state, details in states.items():
+        if not details['isFinal']:
+            continue
+        if state in parents:
+            path, actions = _path_to(parents, state)
+            endings[state] = {
+                'finalType': details['finalType'],
+                'reachable': True,
+                'length': len(actions),
+                'states': path,
+                'actions': actions,
+            }
+        else:
+            endings[state] = {'finalType': details['finalType'], 'reachable': False}
+
+    components = strongly_connected_components(states)
+    cycles = [
+        sorted(component) for component in components
+        if len(component) > 1 or component[0] in states[component[0]]['transitions'].values()
+    ]
+
+    return {
+        'verified': not missing_targets and not unreachable,
+        'total_states': len(states),
+        'total_transitions': sum(len(d['transitions']) for d in states.values()),
+        'final_states_count': sum(1 for d in states.values() if d['isFinal']),
+        'reachable_count': len(parents),
+        'missing_targets': missing_targets,
+        'unreachable': unreachable,
+        'dead_ends': dead_ends,
+        'endings': endings,
+        'scc_count': len(components),
+        'cycles': cycles,
+    }
+
+
+def problems(analysis):
+    """Lista legible de los problemas encontrados en un análisis."""
+    found = []
+    for item in analysis['missing_targets']:
+        found.append(f"{item['state']} --{item['action']}--> {item['target']}: el destino no existe")
+    for state in analysis['unreachable']:
+        found.append(f'{state}: no es alcanzable desde el estado inicial')
+    for state in analysis['dead_ends']:
+        found.append(f'{state}: no es final y no tiene transiciones válidas')
+    for state, ending in analysis['endings'].items():
+        if not ending['reachable']:
+            found.append(f'{state}: final inalcanzable')
+    return found
@@ -0,0 +1,135 @@
+# game/assets.py
+
+# Recursos estáticos con el hash del contenido en el nombre y precomprimidos.
+#
+# `collectstatic` con CompressedManifestStaticFilesStorage copia cada archivo
+# a STATIC_ROOT como `script.<hash>.js` (ManifestStaticFilesStorage de
+# Django; `{% static %}` ya devuelve ese nombre) y deja al lado las versiones
+# `.gz` y, si está instalado el paquete `brotli`, `.br`. Como el nombre
+# cambia con el contenido, se sirven con caché inmutable de un año: el
+# navegador no vuelve a pedirlos hasta que cambian y nunca usa uno viejo.
+#
+# Con GAME_SERVE_STATIC los sirve `serve_static` (p. ej. sin un nginx
+# delante); un servidor web con gzip_static/brotli_static puede servir
+# los mismos archivos sin pasar por Django.
+
+import gzip
+import mimetypes
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.static import serve
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se genera .gz
+    brotli = None
+
+
+# Solo se comprimen los formatos de texto y los archivos que merecen la pena
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.map', '.svg', '.txt', '.html', '.xml'}
+MIN_COMPRESS_SIZE = 256
+
+# Codificaciones precomprimidas, por orden de preferencia
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _compress(path):
+    """Escribe `path.gz` (y `path.br`) junto a `path` si comprimido ocupa menos."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    candidates = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        candidates.insert(0, ('.br', lambda data: brotli.compress(data, mode=brotli.MODE_TEXT)))
+    for suffix, compress in candidates:
+        # El nombre depende del contenido: si ya existe, está al día
+        if os.path.exists(path + suffix):
+            continue
+        compressed = compress(content)
+        if len(compressed) >= len(content):
+            continue
+        with open(path + suffix, 'wb') as f:
+            f.write(compressed)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage que además precomprime los archivos con hash."""
+
+    def stored_name(self, name):
+        # Sin collectstatic (desarrollo, pruebas) no hay manifiesto: se usa el
+        # nombre sin hash, que `serve_static` sirve sin caché inmutable
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for hashed_name in set(self.hashed_files.values()):
+            if os.path.splitext(hashed_name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = self.path(hashed_name)
+            if os.path.getsize(path) >= MIN_COMPRESS_SIZE:
+                _compress(path)
+
+
+@lru_cache(maxsize=1)
+def _hashed_names():
+    """Nombres con hash del manifiesto de collectstatic (vacío sin ManifestStaticFilesStorage)."""
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def _accepted_encodings(request):
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def serve_static(request, path):
+    """
+    Sirve un archivo de STATIC_ROOT. Los nombres con hash van con caché
+    inmutable y, si el cliente lo acepta, en su versión precomprimida.
+    """
+    if path not in _hashed_names():
+        # Sin hash (o fuera del manifiesto): hay que revalidar siempre
+        response = serve(request, path, document_root=settings.STATIC_ROOT)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    try:
+        full_path = staticfiles_storage.path(path)
+    except SuspiciousFileOperation:
+        raise Http404('Archivo no encontrado.')
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+        content_type += '; charset=utf-8'
+
+    # Content-Disposition con el nombre del recurso, no el del .gz/.br
+    filename = os.path.basename(path)
+    accepted = _accepted_encodings(request)
+    response = None
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.exists(full_path + suffix):
+            response = FileResponse(open(full_path + suffix, 'rb'), content_type=content_type, filename=filename)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        try:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type, filename=filename)
+        except FileNotFoundError:
+            raise Http404('Archivo no encontrado.')
+    patch_vary_headers(response, ('Accept-Encoding',))
+    patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    return response
@@ -0,0 +1,130 @@
+# game/async_views.py
+
+# Versiones asíncronas (ASGI) de los endpoints del juego. Comparten la lógica
+# con game/views.py; solo cambia el acceso al almacén de partidas, que aquí
+# se hace con await (sesión asíncrona, redis.asyncio...) en vez de bloquear
+# un hilo. Se activan con settings.GAME_ASYNC_VIEWS = True (ver game/urls.py).
+#
+# Cargar una historia lee y compila el archivo: eso nunca se hace en el bucle
+# de eventos (ver `_astory`).
+
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response, quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+
+from . import events
+from .responses import json_response
+from .engine import CursorAFD
+from .state_store import get_store
+from .stories import peek_story
+from .views import (
+    _afd_info_response, _apply_choice, _game_state_response, _parse_batch, _parse_choice,
+    _run_batch, _story, _suggest_response,
+)
+
+
+async def _astory(story_id=None):
+    """
+    Como `views._story`, sin bloquear el bucle de eventos: si la historia ya
+    está cargada se devuelve directamente; si hay que comprobar el archivo o
+    compilarla, se hace en un hilo.
+    """
+    story = peek_story(story_id)
+    if story is None:
+        story = await sync_to_async(_story, thread_sensitive=False)(story_id)
+    return story
+
+
+async def _aload_cursor(request, story):
+    """Construye el cursor de la partida del usuario desde el almacén de partidas."""
+    return await CursorAFD.aload(story.afd, get_store(), request)
+
+
+@csrf_exempt
+async def process_choice(request, story_id=None):
+    """Versión asíncrona de `views.process_choice`."""
+    if request.method == 'POST':
+        user_input, error_response = _parse_choice(request)
+        if error_response:
+            return error_response
+
+        story = await _astory(story_id)
+        cursor = await _aload_cursor(request, story)
+
+        error_message = _apply_choice(story, cursor, user_input, await events.aplayer_of(request))
+        if error_message:
+            return json_response({'success': False, 'message': error_message})
+
+        await cursor.apersist(get_store(), request)
+
+        return _game_state_response(request, story, cursor, {'success': True})
+    return json_response({'success': False, 'message': 'Método no permitido.'}, status=405)
+
+
+@csrf_exempt
+async def process_batch(request, story_id=None):
+    """Versión asíncrona de `views.process_batch`."""
+    if request.method == 'POST':
+        choices, options, error_response = _parse_batch(request)
+        if error_response:
+            return error_response
+
+        story = await _astory(story_id)
+        cursor = await _aload_cursor(request, story)
+        steps = _run_batch(story, cursor, choices, player=await events.aplayer_of(request), **options)
+        await cursor.apersist(get_store(), request)
+
+        response_data = {
+            'success': all(step['success'] for step in steps) and len(steps) == len(choices),
+            'steps': steps,
+        }
+        return _game_state_response(request, story, cursor, response_data)
+    return json_response({'success': False, 'message': 'Método no permitido.'}, status=405)
+
+
+@csrf_exempt
+async def reset_game_view(request, story_id=None):
+    if request.method == 'POST':
+        story = await _astory(story_id)
+        await story.afd.cursor().apersist(get_store(), request)
+        return json_response({'success': True, 'message': 'Juego reiniciado.'})
+    return json_response({'success': False, 'message': 'Método no permitido.'}, status=405)
+
+
+@cache_control(no_cache=True)
+async def get_afd_info(request, story_id=None):
+    """
+    Versión asíncrona de `views.get_afd_info` (no toca el almacén de partidas).
+    Hace lo mismo que el decorador `etag`, pero con la historia cargada fuera
+    del bucle de eventos.
+    """
+    story = await _astory(story_id)
+    etag = quote_etag(story.version)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = _afd_info_response(request, story)
+    if request.method in ('GET', 'HEAD'):
+        response.headers.setdefault('ETag', etag)
+    return response
+
+
+async def get_afd_current(request, story_id=None):
+    cursor = await _aload_cursor(request, await _astory(story_id))
+    return json_response({
+        'current_state': cursor.currentState,
+        'visited_states': cursor.visitedStates,
+    }, request=request)
+
+
+async def get_game_state(request, story_id=None):
+    """Vista que devuelve el estado actual del juego en formato JSON"""
+    story = await _astory(story_id)
+    cursor = await _aload_cursor(request, story)
+    return _game_state_response(request, story, cursor)
+
+
+async def suggest_actions(request, story_id=None):
+    """Versión asíncrona de `views.suggest_actions`."""
+    story = await _astory(story_id)
+    return _suggest_response(request, story, await _aload_cursor(request, story))
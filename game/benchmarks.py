@@ -0,0 +1,171 @@
+# game/benchmarks.py
+
+# Benchmarks reproducibles del motor del juego y de los endpoints.
+# Se ejecutan con `python manage.py bench_game` (ver game/management/commands).
+
+import json
+import random
+import statistics
+import time
+
+from django.urls import reverse
+
+
+def measure(func, number, repeat):
+    """
+    Ejecuta `func` `number` veces por ronda durante `repeat` rondas y devuelve
+    estadísticas por operación en microsegundos.
+    """
+    func()  # Calentamiento (cachés, imports perezosos...)
+    per_op = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        per_op.append((time.perf_counter() - start) / number * 1e6)
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min_us': min(per_op),
+        'median_us': statistics.median(per_op),
+        'mean_us': statistics.fmean(per_op),
+        'ops_per_sec': 1e6 / min(per_op),
+    }
+
+
+def _sample_inputs(story, rnd):
+    """Entradas realistas: por cada estado, un sinónimo de una de sus acciones."""
+    afd, gramatica = story.afd, story.gramatica
+    samples = []
+    for state in afd.get_all_states():
+        available = list(afd.get_transitions_from_state(state))
+        if not available:
+            continue
+        action = rnd.choice(available)
+        phrases = gramatica.action_equivalents.get(action) or [action.replace('_', ' ')]
+        samples.append((available, rnd.choice(phrases)))
+    return samples
+
+
+def engine_benchmarks(story, seed=0):
+    """Casos del motor: (nombre, función sin argumentos)."""
+    rnd = random.Random(seed)
+    afd, gramatica = story.afd, story.gramatica
+    samples = _sample_inputs(story, rnd)
+    vocabulary = sorted({w for phrases in gramatica.action_equivalents.values() for p in phrases for w in p.split()})
+
+    # Entradas adversarias
+    long_string = 'x' * 5000
+    many_words = ' '.join(rnd.choice(vocabulary) + 'zz' for _ in range(500))
+    # No coincide con ningún sinónimo y obliga a recorrer el fallback por palabras clave
+    keyword_miss = 'ejecutarr planificado conjuntamente mejoradoo ataquee masivoo'
+    worst_available = max((list(afd.get_transitions_from_state(s)) for s in afd.get_all_states()), key=len)
+
+    # Las mismas entradas realistas con dos letras contiguas intercambiadas
+    typo_samples = []
+    for available, text in samples:
+        positions = [i for i in range(len(text) - 1) if text[i].isalpha() and text[i + 1].isalpha()]
+        if positions:
+            i = rnd.choice(positions)
+            text = text[:i] + text[i + 1] + text[i] + text[i + 2:]
+        typo_samples.append((available, text))
+    typo_iter = iter(())
+
+    sample_iter = iter(())
+
+    def validate_typo():
+        nonlocal typo_iter
+        try:
+            available, text = next(typo_iter)
+        except StopIteration:
+            typo_iter = iter(typo_samples)
+            available, text = next(typo_iter)
+        gramatica.validate_input(text, available)
+
+    def validate_realistic():
+        nonlocal sample_iter
+        try:
+            available, text = next(sample_iter)
+        except StopIteration:
+            sample_iter = iter(samples)
+            available, text = next(sample_iter)
+        gramatica.validate_input(text, available)
+
+    walk = {'cursor': afd.cursor()}
+
+    def transition_walk():
+        cursor = walk['cursor']
+        available = cursor.get_available_transitions()
+        if not available:
+            cursor.reset()
+            return
+        cursor.transition(available[rnd.randrange(len(available))])
+
+    description = afd.get_state(afd.initial_state)['description']
+
+    return [
+        ('engine.transition', transition_walk),
+        ('engine.validate_input.realistic', validate_realistic),
+        ('engine.validate_input.typo', validate_typo),
+        ('engine.validate_input.long_string', lambda: gramatica.validate_input(long_string, worst_available)),
+        ('engine.validate_input.many_words', lambda: gramatica.validate_input(many_words, worst_available)),
+        ('engine.validate_input.keyword_fallback_miss', lambda: gramatica.validate_input(keyword_miss, worst_available)),
+        ('engine.generate_text', gramatica.generate_text),
+        ('engine.enhance_description', lambda: gramatica.enhance_description(description, afd.initial_state)),
+    ]
+
+
+def http_benchmarks(client, story):
+    """Casos del camino completo de Django (middleware, sesión, vista, JSON)."""
+    base = reverse('game_view', kwargs={'story_id': story.id})
+    # Recorrido que siempre tiene salida: inicio -> sala_control -> sector -> sala_control ...
+    route = {
+        'inicio': 'investigar nave',
+        'sala_control': 'laboratorio',
+        'sector_laboratorio': 'retroceder',
+    }
+    client.post(base + 'reset/')
+    position = {'state': story.afd.initial_state}
+
+    def process_choice():
+        choice = route.get(position['state'])
+        if choice is None:
+            # Otra historia: volver al inicio y medir solo las peticiones válidas
+            client.post(base + 'reset/')
+            position['state'] = story.afd.initial_state
+            return
+        response = client.post(base + 'process_choice/', json.dumps({'choice': choice}),
+                               content_type='application/json')
+        position['state'] = response.json()['current_state']
+
+    return [
+        ('http.process_choice', process_choice),
+        ('http.process_choice.invalid', lambda: client.post(
+            base + 'process_choice/', json.dumps({'choice': 'bailar salsa'}), content_type='application/json')),
+        ('http.get_game_state', lambda: client.get(base + 'state/')),
+        ('http.get_afd_info', lambda: client.get(base + 'afd_info/')),
+    ]
+
+
+def run(cases, number=1000, repeat=5, name_filter=None):
+    results = {}
+    for name, func in cases:
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = measure(func, number, repeat)
+    return results
+
+
+def compare(current, baseline, threshold):
+    """
+    Compara dos ejecuciones por `min_us`. Devuelve una lista de
+    `(nombre, ratio, es_regresion)` para los casos presentes en ambas.
+    """
+    rows = []
+    for name, result in current.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = result['min_us'] / previous['min_us']
+        rows.append((name, ratio, ratio > 1 + threshold))
+    return rows
@@ -0,0 +1,44 @@
+# game/codec.py
+
+# Codificación compacta de listas de ids de estado para el almacén de partidas.
+# Cada id se escribe como un VLQ en base64 (como en los source maps): cada
+# carácter lleva 5 bits del número y un bit de continuación. Los ids menores
+# de 32 ocupan un carácter, y concatenar dos cadenas codificadas equivale a
+# concatenar las listas, así que los almacenes pueden añadir el delta de
+# visitados sin decodificar lo que ya tienen.
+
+_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
+_VALUES = {char: value for value, char in enumerate(_ALPHABET)}
+_CONTINUE = 0b100000
+_MASK = 0b011111
+
+
+def encode_ids(ids):
+    """Codifica una secuencia de enteros no negativos como cadena."""
+    chars = []
+    for value in ids:
+        while value > _MASK:
+            chars.append(_ALPHABET[value & _MASK | _CONTINUE])
+            value >>= 5
+        chars.append(_ALPHABET[value])
+    return ''.join(chars)
+
+
+def decode_ids(text):
+    """Inversa de `encode_ids`. Lanza ValueError si la cadena no es válida."""
+    ids = []
+    value = shift = 0
+    for char in text:
+        try:
+            digit = _VALUES[char]
+        except KeyError:
+            raise ValueError(f'Carácter no válido en la lista codificada: {char!r}')
+        value |= (digit & _MASK) << shift
+        if digit & _CONTINUE:
+            shift += 5
+        else:
+            ids.append(value)
+            value = shift = 0
+    if shift:
+        raise ValueError('Lista codificada truncada')
+    return ids
@@ -0,0 +1,521 @@
+# game/engine.py
+
+import itertools
+import math
+import random
+from array import array
+from fractions import Fraction
+
+from .codec import decode_ids, encode_ids
+from .matching import IndiceDifuso, IndiceSinonimos, fold_accents
+
+
+# Valores especiales de la tabla de transiciones
+NO_TRANSITION = -1
+# El destino no existe en la historia: la partida vuelve al estado inicial
+DANGLING = -2
+
+
+# ============ CLASES DEL JUEGO (ADAPTADAS DE script.js) ============
+# NOTA: AFDNarrativo y GramaticaNarrativa son de solo lectura y se comparten
+# entre peticiones; sus datos se cargan desde un archivo de historia
+# (ver game/stories.py). El estado de cada jugador (estado actual y visitados)
+# vive en un CursorAFD que se construye por petición desde el almacén de partidas.
+
+def compile_transition_table(states):
+    """
+    Interna los nombres de estados y acciones a enteros y construye una tabla
+    de transiciones densa: table[estado * n_acciones + accion] = destino,
+    NO_TRANSITION o DANGLING.
+    """
+    state_names = list(states)
+    state_ids = {name: i for i, name in enumerate(state_names)}
+    action_ids = {}
+    for details in states.values():
+        for action in details.get('transitions', {}):
+            action_ids.setdefault(action, len(action_ids))
+
+    n_actions = len(action_ids)
+    table = array('i', [NO_TRANSITION]) * (len(state_names) * n_actions)
+    for name, details in states.items():
+        base = state_ids[name] * n_actions
+        for action, target in details.get('transitions', {}).items():
+            table[base + action_ids[action]] = state_ids.get(target, DANGLING)
+
+    return {
+        'state_names': state_names,
+        'action_names': list(action_ids),
+        'table': table,
+        'final': bytes(bool(states[name].get('isFinal', False)) for name in state_names),
+    }
+
+
+class AFDNarrativo:
+    """
+    Grafo de la historia. Internamente los estados y acciones son enteros y las
+    transiciones se resuelven con una tabla densa en O(1); los métodos que
+    reciben nombres (str) son una fachada sobre esa representación.
+
+    `analysis` es el análisis estático precalculado (ver game/analysis.py). Si
+    la historia está verificada no hay destinos colgantes y las transiciones
+    no necesitan comprobar si el estado destino existe. `story_id` elige la
+    partida del jugador en el almacén y `version` identifica el contenido de la
+    historia: los ids guardados solo son válidos para la misma versión.
+    """
+
+    def __init__(self, states, initial_state='inicio', table=None, analysis=None, version=None, story_id=None):
+        self.states = states
+        self.initial_state = initial_state
+        self.version = version
+        self.story_id = story_id
+        self.analysis = analysis
+        self.verified = bool(analysis and analysis['verified'])
+
+        table = table or compile_transition_table(states)
+        self.state_names = table['state_names']
+        self.action_names = table['action_names']
+        self.state_ids = {name: i for i, name in enumerate(self.state_names)}
+        self.action_ids = {name: i for i, name in enumerate(self.action_names)}
+        self.initial_id = self.state_ids[initial_state]
+        self._table = table['table']
+        self._final = table['final']
+        self._n_actions = len(self.action_names)
+        self._available = [list(states[name]['transitions']) for name in self.state_names]
+
+    # ---- API por identificador entero ----
+
+    def state_id(self, state):
+        return self.state_ids.get(state)
+
+    def next_state_id(self, state_id, action_id):
+        """Destino de la transición: un id de estado, NO_TRANSITION o DANGLING."""
+        return self._table[state_id * self._n_actions + action_id]
+
+    def is_accepting_id(self, state_id):
+        return bool(self._final[state_id])
+
+    def available_transitions_id(self, state_id):
+        return self._available[state_id]
+
+    # ---- Fachada por nombre ----
+
+    def has_state(self, state):
+        return state in self.state_ids
+
+    def get_state(self, state):
+        return self.states[state]
+
+    def next_state(self, state, input_choice):
+        """Devuelve el estado destino de `input_choice` desde `state`, o None si no existe."""
+        action_id = self.action_ids.get(input_choice)
+        if action_id is None:
+            return None
+        target = self.next_state_id(self.state_ids[state], action_id)
+        if target == NO_TRANSITION:
+            return None
+        if target == DANGLING and not self.verified:
+            return self.states[state]['transitions'][input_choice]
+        return self.state_names[target]
+
+    def is_accepting(self, state):
+        return self.is_accepting_id(self.state_ids[state])
+
+    def get_all_states(self):
+        return list(self.state_names)
+
+    def get_transitions_from_state(self, state):
+        return self.states.get(state, {}).get('transitions', {})
+
+    def cursor(self, current_state=None, visited_states=None):
+        """Crea un cursor de partida nuevo sobre este AFD."""
+        return CursorAFD(self, current_state, visited_states)
+
+
+class CursorAFD:
+    """
+    Estado mutable de una partida (estado actual + estados visitados).
+
+    El grafo de la historia (AFDNarrativo) es inmutable y se comparte entre
+    todas las peticiones; cada petición construye su propio cursor a partir
+    del almacén de partidas, de modo que jugadores concurrentes no se pisan el estado.
+    Los visitados se guardan como lista ordenada de ids más un bitset, así que
+    comprobar si un estado ya se visitó no depende de la longitud del recorrido.
+    En el almacén se guardan como ids codificados (ver game/codec.py) junto
+    con la versión de la historia.
+    """
+
+    def __init__(self, afd, current_state=None, visited_states=None):
+        self.afd = afd
+        self._checkpoint = None
+        state_id = afd.state_id(current_state or afd.initial_state)
+        # Si el estado no existe en la historia actual, empezar de nuevo
+        if state_id is None:
+            self.reset()
+            return
+
+        self.state_id = state_id
+        self.visited_ids = []
+        self.visited_mask = 0
+        self._full_save = True
+        self._new_visits = []
+        for name in visited_states or ():
+            visited_id = afd.state_id(name)
+            if visited_id is not None:
+                self._visit(visited_id)
+        self._visit(state_id)
+
+    @classmethod
+    def load(cls, afd, store, request):
+        """
+        Construye el cursor desde el almacén de partidas (ver game/state_store.py).
+        Si no hay estado guardado (o no es válido) se reinicia y se guarda.
+        """
+        cursor = cls._from_game_state(afd, store.load(request, afd.story_id))
+        if cursor._full_save:
+            cursor.persist(store, request)
+        return cursor
+
+    @classmethod
+    async def aload(cls, afd, store, request):
+        """Versión asíncrona de `load`."""
+        cursor = cls._from_game_state(afd, await store.aload(request, afd.story_id))
+        if cursor._full_save:
+            await cursor.apersist(store, request)
+        return cursor
+
+    @classmethod
+    def _from_game_state(cls, afd, game_state):
+        if game_state is None:
+            return cls(afd)
+        current_state, visited, story_version = game_state
+
+        if not isinstance(visited, str):
+            # Formato antiguo (lista de nombres): se convierte al guardar
+            return cls(afd, current_state, visited)
+
+        visited_ids = None
+        if story_version == afd.version:
+            try:
+                visited_ids = decode_ids(visited)
+            except ValueError:
+                pass
+        if visited_ids is None:
+            # Ids de otra versión de la historia: solo se conserva el estado actual
+            return cls(afd, current_state)
+
+        cursor = cls(afd, current_state)
+        if cursor.currentState != current_state:
+            return cursor
+        # Misma versión: los ids son de esta historia, pero dos peticiones a
+        # la vez pueden haber añadido el mismo delta (ids repetidos) y la
+        # lista puede estar dañada (ids fuera de rango): se descartan esos
+        cursor.visited_ids = []
+        cursor.visited_mask = 0
+        state_count = len(afd.state_names)
+        for visited_id in visited_ids:
+            bit = 1 << visited_id
+            if visited_id < state_count and not cursor.visited_mask & bit:
+                cursor.visited_ids.append(visited_id)
+                cursor.visited_mask |= bit
+        if len(cursor.visited_ids) == len(visited_ids):
+            cursor._mark_clean()
+        else:
+            # Se reescribe la lista limpia en el próximo guardado
+            cursor._full_save = True
+            cursor._new_visits = []
+        cursor.checkpoint()
+        # El estado actual siempre figura entre los visitados
+        cursor._visit(cursor.state_id)
+        return cursor
+
+    def persist(self, store, request):
+        """
+        Guarda los cambios desde la última carga. Si solo se avanzó de estado se
+        envía un delta (estado actual + visitados nuevos) en vez del estado completo.
+        """
+        story_id = self.afd.story_id
+        if self._full_save:
+            store.save(request, story_id, self.currentState, encode_ids(self.visited_ids), self.afd.version)
+        else:
+            store.update(request, story_id, self.currentState, encode_ids(self._new_visits))
+        self._mark_clean()
+
+    async def apersist(self, store, request):
+        """Versión asíncrona de `persist`."""
+        story_id = self.afd.story_id
+        if self._full_save:
+            await store.asave(request, story_id, self.currentState, encode_ids(self.visited_ids), self.afd.version)
+        else:
+            await store.aupdate(request, story_id, self.currentState, encode_ids(self._new_visits))
+        self._mark_clean()
+
+    def _mark_clean(self):
+        self._full_save = False
+        self._new_visits = []
+
+    def checkpoint(self):
+        """Marca el punto desde el que `visited_delta` cuenta los estados nuevos."""
+        self._checkpoint = len(self.visited_ids)
+
+    def visited_delta(self):
+        """
+        Estados visitados desde el último `checkpoint`, o None si el cliente
+        necesita la lista completa (partida nueva, reiniciada o recargada).
+        """
+        if self._checkpoint is None:
+            return None
+        names = self.afd.state_names
+        return [names[i] for i in self.visited_ids[self._checkpoint:]]
+
+    @property
+    def currentState(self):
+        return self.afd.state_names[self.state_id]
+
+    @property
+    def visitedStates(self):
+        names = self.afd.state_names
+        return [names[i] for i in self.visited_ids]
+
+    def has_visited(self, state):
+        state_id = self.afd.state_id(state)
+        return state_id is not None and bool(self.visited_mask >> state_id & 1)
+
+    def _visit(self, state_id):
+        bit = 1 << state_id
+        if not self.visited_mask & bit:
+            self.visited_mask |= bit
+            self.visited_ids.append(state_id)
+            self._new_visits.append(state_id)
+
+    def get_current_state(self):
+        return self.afd.get_state(self.currentState)
+
+    def get_available_transitions(self):
+        return list(self.afd.available_transitions_id(self.state_id))
+
+    def transition(self, input_choice):
+        action_id = self.afd.action_ids.get(input_choice)
+        if action_id is None:
+            return False
+        return self.transition_id(action_id)
+
+    def transition_id(self, action_id):
+        target = self.afd.next_state_id(self.state_id, action_id)
+        if target == NO_TRANSITION:
+            return False
+        if not self.afd.verified and target == DANGLING:
+            # El destino no existe en la historia actual: empezar de nuevo
+            self.reset()
+            return True
+        self.state_id = target
+        self._visit(target)
+        return True
+
+    def reset(self):
+        self.state_id = self.afd.initial_id
+        self.visited_ids = [self.state_id]
+        self.visited_mask = 1 << self.state_id
+        self._full_save = True
+        self._new_visits = []
+        self._checkpoint = None
+
+    def is_accepting_state(self):
+        return self.afd.is_accepting_id(self.state_id)
+
+
+class _GramaticaRecursiva(Exception):
+    """El símbolo se deriva a sí mismo: su lenguaje no se puede enumerar."""
+
+
+class GramaticaNarrativa:
+    # Tamaño máximo de un pool enumerado; por encima se usa un pool muestreado
+    POOL_LIMIT = 100000
+    # Frases del pool muestreado (gramáticas recursivas o demasiado grandes)
+    POOL_SAMPLE_SIZE = 4096
+
+    def __init__(self, rules, contextualEnhancements=None, action_equivalents=None, seed=None, actions=()):
+        self.rules = rules
+        self.contextualEnhancements = contextualEnhancements or {}
+        # Reglas de equivalencia (sinónimos) para cada acción
+        self.action_equivalents = action_equivalents or {}
+
+        # Índices precompilados: se construyen una sola vez por instancia.
+        # Los sinónimos se indexan sin tildes, igual que se normaliza la entrada.
+        folded_equivalents = {
+            transition: [fold_accents(equivalent.lower()) for equivalent in equivalents]
+            for transition, equivalents in self.action_equivalents.items()
+        }
+        self._indice_sinonimos = IndiceSinonimos(folded_equivalents)
+        self._keywords = {}
+        # Vocabulario del corrector de erratas: palabras de los sinónimos y de
+        # los nombres de las acciones (`actions`, p. ej. las del AFD)
+        vocabulary = {word for equivalents in folded_equivalents.values() for phrase in equivalents for word in phrase.split()}
+        for transition in itertools.chain(self.action_equivalents, actions):
+            vocabulary.update(self._keywords_for(transition))
+        self._indice_difuso = IndiceDifuso(vocabulary)
+        self.reseed(seed)
+
+    def reseed(self, seed=None):
+        """Reinicia el generador (con `seed` la secuencia de textos es reproducible)."""
+        self._rng = random.Random(seed)
+        self._pools = {}
+
+    def generate_text(self, start_symbol='S'):
+        """
+        Devuelve una frase del lenguaje de `start_symbol`. La gramática se compila
+        la primera vez en un pool barajado en el que cada frase aparece en
+        proporción a su probabilidad bajo la elección uniforme de producciones,
+        así que cada llamada es solo tomar el siguiente elemento del pool.
+        """
+        if start_symbol not in self.rules:
+            return start_symbol
+
+        entry = self._pools.get(start_symbol)
+        if entry is None:
+            entry = self._pools[start_symbol] = self._build_pool(start_symbol)
+        pool, counter = entry
+        return pool[next(counter) % len(pool)]
+
+    def _build_pool(self, start_symbol):
+        try:
+            weighted = self._enumerate(start_symbol, set(), {})
+        except _GramaticaRecursiva:
+            weighted = None
+
+        pool = None
+        if weighted is not None:
+            # Pesos enteros proporcionales a la probabilidad exacta de cada frase
+            denominator = math.lcm(*(w.denominator for w in weighted.values()))
+            counts = {text: int(w * denominator) for text, w in weighted.items()}
+            divisor = math.gcd(*counts.values())
+            if sum(counts.values()) // divisor <= self.POOL_LIMIT:
+                pool = [text for text, n in counts.items() for _ in range(n // divisor)]
+
+        if pool is None:
+            pool = [self._sample_text(start_symbol) for _ in range(self.POOL_SAMPLE_SIZE)]
+
+        self._rng.shuffle(pool)
+        # itertools.count es atómico en CPython: el pool se puede compartir entre hilos
+        return pool, itertools.count(self._rng.randrange(len(pool)))
+
+    def _enumerate(self, symbol, stack, memo):
+        """Todas las frases de `symbol` con su probabilidad exacta: {texto: Fraction}."""
+        if symbol in memo:
+            return memo[symbol]
+        if symbol in stack:
+            raise _GramaticaRecursiva(symbol)
+        stack.add(symbol)
+
+        productions = self.rules[symbol]
+        sentences = {}
+        size = 0
+        for production in productions:
+            options = [
+                self._enumerate(part, stack, memo) if part in self.rules else {part: Fraction(1)}
+                for part in production
+            ]
+            size += math.prod(len(o) for o in options)
+            if size > self.POOL_LIMIT:
+                raise _GramaticaRecursiva(symbol)
+            for combination in itertools.product(*(o.items() for o in options)):
+                text = ' '.join(part for part, _ in combination)
+                weight = math.prod((w for _, w in combination), start=Fraction(1, len(productions)))
+                sentences[text] = sentences.get(text, 0) + weight
+
+        stack.discard(symbol)
+        memo[symbol] = sentences
+        return sentences
+
+    def _sample_text(self, start_symbol):
+        """Derivación aleatoria directa (la forma original de generar texto)."""
+        if start_symbol not in self.rules:
+            return start_symbol
+
+        random_production = self._rng.choice(self.rules[start_symbol])
+
+        generated_parts = []
+        for symbol in random_production:
+            if symbol in self.rules:
+                generated_parts.append(self._sample_text(symbol))
+            else:
+                generated_parts.append(symbol)
+        return ' '.join(generated_parts)
+
+    def enhance_description(self, base_description, current_state):
+        return self.description_prefix(base_description, current_state) + self.generate_text()
+
+    def description_prefix(self, base_description, current_state):
+        """Parte determinista de `enhance_description` (todo salvo el texto generado)."""
+        enhancement = self.contextualEnhancements.get(current_state)
+
+        result = base_description
+
+        if enhancement:
+            result += f"\n\n{enhancement[0]}"
+
+        result += "\n\n💭 "
+
+        return result
+
+    def validate_input(self, user_input, available_transitions):
+        """
+        Valida la entrada del usuario usando reglas de GLC para reconocer acciones válidas.
+        """
+        tier, transition = self.match_input(user_input, available_transitions)
+        return tier is not None, transition
+
+    def match_input(self, user_input, available_transitions):
+        """
+        Igual que `validate_input`, pero devuelve `(nivel, transición)`, donde
+        el nivel es el criterio que reconoció la acción ('exact', 'synonym',
+        'keyword' o 'fuzzy') o None si ninguno lo hizo.
+        """
+        # Normalizar la entrada del usuario (sin tildes: "médico" == "medico")
+        normalized_input = fold_accents(user_input.strip().lower())
+        
+        # 1. Validación directa - verificar si coincide exactamente con una transición
+        if normalized_input in available_transitions:
+            return 'exact', normalized_input
+        
+        # 2. Validación por sinónimos y variaciones usando GLC
+        # Validación estricta: la frase sinónima debe aparecer como palabras completas
+        input_words = normalized_input.split()
+        transition = self._indice_sinonimos.match(input_words, available_transitions)
+        if transition is not None:
+            return 'synonym', transition
+
+        # 3. Validación por palabras clave (fallback mejorado)
+        transition = self._match_keywords(input_words, available_transitions)
+        if transition is not None:
+            return 'keyword', transition
+
+        # 4. Corrección de erratas ("labratorio" -> "laboratorio") y se repiten 2 y 3
+        # sobre las primeras palabras corregidas
+        corrected_words = self._indice_difuso.correct(input_words)
+        if corrected_words != input_words[:len(corrected_words)]:
+            transition = (self._indice_sinonimos.match(corrected_words, available_transitions)
+                          or self._match_keywords(corrected_words, available_transitions))
+            if transition is not None:
+                return 'fuzzy', transition
+
+        return None, None
+
+    def _match_keywords(self, input_words, available_transitions):
+        for transition in available_transitions:
+            keywords = self._keywords_for(transition)
+            if len(input_words) >= len(keywords):
+                # Verificar que las palabras clave estén en orden en la entrada
+                keyword_index = 0
+                for word in input_words:
+                    if keyword_index < len(keywords) and keywords[keyword_index] in word:
+                        keyword_index += 1
+                        if keyword_index == len(keywords):
+                            return transition
+        return None
+
+    def _keywords_for(self, transition):
+        """Palabras clave de una transición (`buscar_salida` -> ['buscar', 'salida'])."""
+        keywords = self._keywords.get(transition)
+        if keywords is None:
+            keywords = self._keywords[transition] = transition.replace('_', ' ').split()
+        return keywords
@@ -0,0 +1,190 @@
+# game/events.py
+
+# Registro persistente de las acciones de los jugadores (PlaythroughEvent)
+# con escritura diferida: la petición solo añade el evento a un búfer en
+# memoria y un hilo del proceso lo vuelca a la base de datos con bulk_create
+# cuando se juntan GAME_EVENT_LOG_BATCH_SIZE eventos o pasan
+# GAME_EVENT_LOG_FLUSH_INTERVAL segundos. Así process_choice no hace ninguna
+# escritura síncrona más.
+#
+# Si el proceso muere de golpe se pierden los eventos pendientes (como mucho
+# un intervalo); al salir de forma ordenada se vuelcan con atexit. Si la base
+# de datos no responde, el búfer se limita a GAME_EVENT_LOG_MAX_BUFFER
+# eventos y los que no caben se descartan (métrica game_playthrough_events).
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Se guardan como mucho estos caracteres de lo que escribió el jugador
+MAX_INPUT_LENGTH = 500
+
+# Campos de cada evento en el búfer, en orden (tuplas: más baratas que modelos)
+FIELDS = (
+    'user_id', 'session_key', 'story_id', 'story_version', 'from_state',
+    'action', 'to_state', 'raw_input', 'tier', 'created_at',
+)
+
+
+def enabled():
+    return getattr(settings, 'GAME_EVENT_LOG', True)
+
+
+def player_of(request):
+    """`(id de usuario o None, clave de sesión)` sin consultar la tabla de usuarios."""
+    return request.session.get(SESSION_KEY), request.session.session_key or ''
+
+
+async def aplayer_of(request):
+    return await request.session.aget(SESSION_KEY), request.session.session_key or ''
+
+
+class WriteBehind:
+    """
+    Datos pendientes de un proceso con su hilo de volcado: las subclases
+    implementan `flush()`, que se llama cada `flush_interval` segundos o en
+    cuanto alguien llama a `wake()`. Con el intervalo a None no hay hilo y
+    solo se vuelca al llamar a `flush()` (pruebas, benchmarks).
+    """
+
+    flush_interval_setting = 'GAME_EVENT_LOG_FLUSH_INTERVAL'
+    thread_name = 'game-event-flusher'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, self.flush_interval_setting, 2.0)
+
+    def wake(self):
+        if self.flush_interval is not None:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        # Tras un fork (gunicorn --preload...) el hilo del padre no existe en el hijo
+        if self._pid == os.getpid() or self.flush_interval is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wakeup = threading.Event()
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            interval = self.flush_interval
+            # Si el intervalo pasa a None con el hilo ya en marcha
+            # (override_settings), el hilo espera sin volcar
+            self._wakeup.wait(interval if interval is not None else 1.0)
+            self._wakeup.clear()
+            if self.flush_interval is not None:
+                self.flush()
+
+    def _on_flusher_thread(self):
+        return threading.current_thread() is self._thread
+
+    def flush(self):
+        raise NotImplementedError
+
+
+class EventBuffer(WriteBehind):
+    """Búfer de eventos de un proceso (ver `WriteBehind`)."""
+
+    def __init__(self):
+        super().__init__()
+        self._events = []
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'GAME_EVENT_LOG_BATCH_SIZE', 500)
+
+    @property
+    def max_buffer(self):
+        return getattr(settings, 'GAME_EVENT_LOG_MAX_BUFFER', 50000)
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, event):
+        with self._lock:
+            if len(self._events) >= self.max_buffer:
+                dropped = True
+            else:
+                dropped = False
+                self._events.append(event)
+                full = len(self._events) >= self.batch_size
+        if dropped:
+            _count('dropped')
+            return
+        _count('recorded')
+        self._ensure_flusher()
+        if full:
+            self.wake()
+
+    def flush(self):
+        """Vuelca los eventos pendientes. Devuelve cuántos se escribieron."""
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        from .models import PlaythroughEvent
+
+        start = time.perf_counter()
+        try:
+            PlaythroughEvent.objects.bulk_create(
+                [PlaythroughEvent(**dict(zip(FIELDS, event))) for event in events],
+                batch_size=self.batch_size,
+            )
+        except DatabaseError:
+            logger.exception('No se pudieron guardar %d eventos de partida', len(events))
+            _count('dropped', len(events))
+            return 0
+        finally:
+            # Conexión propia de este hilo: no dejarla abierta entre volcados
+            if self._on_flusher_thread():
+                connection.close()
+        if metrics.enabled():
+            metrics.OPERATION_DURATION.observe(time.perf_counter() - start, 'event_flush')
+        _count('written', len(events))
+        return len(events)
+
+
+def _count(outcome, amount=1):
+    if metrics.enabled():
+        metrics.PLAYTHROUGH_EVENTS.inc(outcome, amount=amount)
+
+
+BUFFER = EventBuffer()
+atexit.register(BUFFER.flush)
+
+
+def record(story, player, from_state, user_input, tier, action, to_state):
+    """Añade una acción al búfer. `player` es el resultado de `player_of`."""
+    if not enabled():
+        return
+    user_id, session_key = player
+    BUFFER.add((
+        user_id, session_key, story.id, story.version, from_state,
+        action or '', to_state or '', user_input[:MAX_INPUT_LENGTH], tier or '', timezone.now(),
+    ))
+
+
+def flush():
+    return BUFFER.flush()
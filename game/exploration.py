@@ -0,0 +1,319 @@
+# game/exploration.py
+
+# Exploración de todos los caminos de una historia, para equilibrarla y para
+# el diagrama del AFD:
+#
+# - Partidas distintas que llegan a cada final: secuencias de acciones desde
+#   el estado inicial que no repiten estado (con `retroceder` los caminos con
+#   ciclos serían infinitos). Se cuentan con programación dinámica sobre el
+#   grafo de componentes fuertemente conexas; solo dentro de cada componente
+#   se enumeran caminos.
+# - Probabilidad de cada final y duración esperada de la partida si el jugador
+#   elige al azar entre las acciones disponibles: cadena de Markov absorbente
+#   (los finales y los callejones sin salida absorben). Con NumPy y pocos
+#   estados se resuelve con numpy.linalg (matriz densa); sin él, o con más de
+#   DENSE_SOLVE_LIMIT estados, por eliminación gaussiana dispersa en Python.
+#
+# Como en el motor, una transición a un estado inexistente vuelve al inicio.
+# Los estados finales terminan la partida aunque tengan transiciones.
+
+from collections import deque
+
+from .analysis import strongly_connected_components
+
+try:
+    import numpy
+except ImportError:  # NumPy es opcional: sin él se resuelve en Python puro
+    numpy = None
+
+
+# Pasos de enumeración de caminos dentro de las componentes antes de desistir
+# (el número de caminos simples puede crecer exponencialmente)
+MAX_PATH_STEPS = 1_000_000
+
+# Estados transitorios hasta los que se resuelve con una matriz densa de NumPy
+# (memoria O(n²), tiempo O(n³)); por encima, el solver disperso en Python
+DENSE_SOLVE_LIMIT = 400
+
+
+class _DemasiadosCaminos(Exception):
+    pass
+
+
+def _edges(afd):
+    """estado -> [(acción, destino)] con la semántica del motor."""
+    edges = {}
+    for state in afd.get_all_states():
+        if afd.get_state(state)['isFinal']:
+            edges[state] = []
+            continue
+        edges[state] = [
+            (action, target if afd.has_state(target) else afd.initial_state)
+            for action, target in afd.get_transitions_from_state(state).items()
+        ]
+    return edges
+
+
+def count_playthroughs(afd, max_steps=MAX_PATH_STEPS):
+    """
+    {final: número de partidas sin estados repetidos desde el estado inicial}.
+    Devuelve None si hay que enumerar más de `max_steps` caminos.
+    """
+    # Una transición a un estado inexistente vuelve al inicio, que ya está en
+    # el camino: nunca forma parte de una partida sin repeticiones
+    graph = {
+        state: {'transitions': {action: target for action, target in afd.get_transitions_from_state(state).items()
+                                if afd.has_state(target) and not afd.get_state(state)['isFinal']}}
+        for state in afd.get_all_states()
+    }
+    finals = {state for state in graph if afd.get_state(state)['isFinal']}
+    budget = [max_steps]
+
+    def paths_within(component, entry):
+        """Caminos simples dentro de `component` desde `entry`: {estado final del camino: número}."""
+        counts = {entry: 1}
+        path = [entry]
+        on_path = {entry}
+        work = [iter(graph[entry]['transitions'].values())]
+        while work:
+            target = next(work[-1], None)
+            if target is None:
+                work.pop()
+                if work:
+                    on_path.discard(path[-1])
+                    path.pop()
+                continue
+            if target not in component or target in on_path:
+                continue
+            budget[0] -= 1
+            if budget[0] < 0:
+                raise _DemasiadosCaminos
+            counts[target] = counts.get(target, 0) + 1
+            on_path.add(target)
+            path.append(target)
+            work.append(iter(graph[target]['transitions'].values()))
+        return counts
+
+    # ways[estado] = {final: partidas sin repeticiones desde ese estado}, solo
+    # para los estados por los que se entra en su componente (el inicial y los
+    # destinos de transiciones entre componentes). Las componentes salen en
+    # orden topológico inverso: los sucesores ya están calculados.
+    components = strongly_connected_components(graph)
+    component_of = {state: i for i, component in enumerate(components) for state in component}
+    entries = {afd.initial_state}
+    for state, details in graph.items():
+        entries.update(target for target in details['transitions'].values()
+                       if component_of[target] != component_of[state])
+
+    ways = {}
+    try:
+        for component in components:
+            members = set(component)
+            for entry in component:
+                if entry not in entries:
+                    continue
+                total = {}
+                for state, count in paths_within(members, entry).items():
+                    if state in finals:
+                        total[state] = total.get(state, 0) + count
+                    for target in graph[state]['transitions'].values():
+                        if target in members:
+                            continue
+                        for final, n in ways[target].items():
+                            total[final] = total.get(final, 0) + count * n
+                ways[entry] = total
+    except _DemasiadosCaminos:
+        return None
+    result = ways[afd.initial_state]
+    return {final: result.get(final, 0) for final in sorted(finals)}
+
+
+def _solve_python(rows, columns):
+    """
+    Resuelve `A · X = columns` con A dispersa (`rows[i] = {j: valor}`) por
+    eliminación gaussiana sin pivoteo, en el orden de las filas. Basta para
+    I - Q, que es una M-matriz; con las hojas del grafo primero apenas hay relleno.
+    """
+    size = len(rows)
+    rows = [dict(row) for row in rows]
+    rhs = [[column[i] for column in columns] for i in range(size)]
+    # Filas con un valor en cada columna (para no recorrer la matriz entera)
+    in_column = [set() for _ in range(size)]
+    for i, row in enumerate(rows):
+        for j in row:
+            in_column[j].add(i)
+
+    for k in range(size):
+        pivot_row = rows[k]
+        pivot = pivot_row[k]
+        for i in in_column[k]:
+            if i <= k:
+                continue
+            row = rows[i]
+            factor = row.pop(k) / pivot
+            for j, value in pivot_row.items():
+                if j == k:
+                    continue
+                if j not in row:
+                    in_column[j].add(i)
+                row[j] = row.get(j, 0.0) - factor * value
+            rhs[i] = [a - factor * b for a, b in zip(rhs[i], rhs[k])]
+
+    solution = [None] * size
+    for k in range(size - 1, -1, -1):
+        row = rows[k]
+        values = list(rhs[k])
+        for j, value in row.items():
+            if j > k:
+                values = [a - value * b for a, b in zip(values, solution[j])]
+        solution[k] = [a / row[k] for a in values]
+    return [[solution[i][c] for i in range(size)] for c in range(len(columns))]
+
+
+def _solver_for(size):
+    return 'numpy' if numpy is not None and size <= DENSE_SOLVE_LIMIT else 'python'
+
+
+def _solve(rows, columns):
+    """Resuelve `A · X = columns`; A viene como filas dispersas `{columna: valor}`."""
+    if _solver_for(len(rows)) == 'numpy':
+        matrix = numpy.zeros((len(rows), len(rows)))
+        for i, row in enumerate(rows):
+            for j, value in row.items():
+                matrix[i, j] = value
+        solution = numpy.linalg.solve(matrix, numpy.array(columns, dtype=float).T)
+        return solution.T.tolist()
+    return _solve_python(rows, columns)
+
+
+def random_play(afd):
+    """
+    Cadena de Markov absorbente del jugador que elige al azar (uniforme entre
+    las acciones del estado). Devuelve la probabilidad de terminar en cada
+    final o callejón sin salida, la duración esperada (condicionada a cada
+    final) y las visitas esperadas a cada estado por partida.
+    """
+    edges = _edges(afd)
+
+    # Estados alcanzables desde el inicio, en orden de BFS
+    order = [afd.initial_state]
+    reachable = {afd.initial_state}
+    queue = deque(order)
+    while queue:
+        for _, target in edges[queue.popleft()]:
+            if target not in reachable:
+                reachable.add(target)
+                order.append(target)
+                queue.append(target)
+
+    absorbing = sorted(state for state in reachable if not edges[state])
+    # Transitorios desde los que se puede terminar; si se llega a alguno de
+    # los demás, la partida puede no acabar nunca (la masa de probabilidad se pierde)
+    predecessors = {}
+    for state in reachable:
+        for _, target in edges[state]:
+            predecessors.setdefault(target, set()).add(state)
+    can_finish = set(absorbing)
+    queue = deque(absorbing)
+    while queue:
+        for source in predecessors.get(queue.popleft(), ()):
+            if source not in can_finish:
+                can_finish.add(source)
+                queue.append(source)
+    # De las hojas hacia el inicio: así la eliminación apenas genera relleno
+    transient = [state for state in reversed(order) if state in can_finish and edges[state]]
+    endless = any(state not in can_finish for state in reachable)
+
+    if afd.initial_state not in can_finish:
+        return {
+            'absorption': {state: 0.0 for state in absorbing},
+            'expected_length': None,
+            'conditional_length': {state: None for state in absorbing},
+            'expected_visits': {},
+        }
+    if not transient:
+        # El estado inicial ya es final o un callejón sin salida
+        return {
+            'absorption': {state: float(state == afd.initial_state) for state in absorbing},
+            'expected_length': 0.0,
+            'conditional_length': {state: 0.0 if state == afd.initial_state else None for state in absorbing},
+            'expected_visits': {},
+        }
+
+    index = {state: i for i, state in enumerate(transient)}
+    size = len(transient)
+    # (I - Q)^T en filas dispersas: fila j = probabilidades de llegar a j
+    transposed = [{j: 1.0} for j in range(size)]
+    for state in transient:
+        i = index[state]
+        probability = 1.0 / len(edges[state])
+        for _, target in edges[state]:
+            if target in index:
+                row = transposed[index[target]]
+                row[i] = row.get(i, 0.0) - probability
+
+    # Con N = (I - Q)^-1 y R (de transitorio a absorbente), desde el inicio:
+    #   v = e_inicio^T N        visitas esperadas a cada transitorio
+    #   v R                     probabilidad de acabar en cada absorbente
+    #   u = v N;  u R           E[pasos · 1{acabar en cada absorbente}]
+    # Basta resolver dos sistemas con (I - Q)^T, sin calcular N ni N R enteras.
+    start = [float(i == index[afd.initial_state]) for i in range(size)]
+    visits = _solve(transposed, [start])[0]
+    weighted_visits = _solve(transposed, [visits])[0]
+
+    absorption = {state: 0.0 for state in absorbing}
+    weighted_length = {state: 0.0 for state in absorbing}
+    for state in transient:
+        i = index[state]
+        probability = 1.0 / len(edges[state])
+        for _, target in edges[state]:
+            if target in absorption:
+                absorption[target] += visits[i] * probability
+                weighted_length[target] += weighted_visits[i] * probability
+
+    return {
+        'absorption': absorption,
+        'expected_length': None if endless else sum(visits),
+        'conditional_length': {
+            state: weighted_length[state] / absorption[state] if absorption[state] > 1e-12 else None
+            for state in absorbing
+        },
+        'expected_visits': {state: visits[index[state]] for state in transient},
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 6)
+
+
+def explore_story(afd):
+    """
+    Exploración completa para el análisis de la historia (ver
+    `analysis.analyze_story`): partidas distintas, probabilidad y duración
+    esperada por final, y visitas esperadas por estado.
+    """
+    playthroughs = count_playthroughs(afd)
+    chain = random_play(afd)
+    finals = [state for state in afd.get_all_states() if afd.get_state(state)['isFinal']]
+
+    endings = {}
+    for state in sorted(finals):
+        endings[state] = {
+            'finalType': afd.get_state(state)['finalType'],
+            'playthroughs': None if playthroughs is None else playthroughs[state],
+            'probability': _round(chain['absorption'].get(state, 0.0)),
+            'expected_length': _round(chain['conditional_length'].get(state)),
+        }
+    stuck = {
+        state: _round(probability) for state, probability in chain['absorption'].items()
+        if state not in endings
+    }
+    return {
+        'method': _solver_for(len(chain['expected_visits'])),
+        'playthroughs': None if playthroughs is None else sum(playthroughs.values()),
+        'expected_length': _round(chain['expected_length']),
+        'completion_probability': _round(sum(chain['absorption'].get(state, 0.0) for state in finals)),
+        'endings': endings,
+        'stuck': stuck,
+        'expected_visits': {state: _round(v) for state, v in sorted(chain['expected_visits'].items())},
+    }
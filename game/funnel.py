@@ -0,0 +1,202 @@
+# game/funnel.py
+
+# Embudo de cada historia mantenido de forma incremental: partidas empezadas,
+# partidas que llegan a cada estado, veces que se recorre cada transición y
+# partidas que acaban en cada tipo de final. Cada acción aceptada suma en un
+# diccionario en memoria del proceso y un hilo (ver `events.WriteBehind`)
+# suma esos incrementos a las filas de FunnelCounter cada
+# GAME_FUNNEL_FLUSH_INTERVAL segundos. Nunca se recorre el registro de eventos.
+#
+# "Llegar" a un estado cuenta una vez por partida: la primera vez que entra en
+# sus visitados (al volver con `retroceder` no se cuenta de nuevo).
+
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .events import WriteBehind
+from .responses import dumps
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return getattr(settings, 'GAME_FUNNEL', True)
+
+
+class FunnelCounters(WriteBehind):
+    """Incrementos del embudo pendientes de sumar a la base de datos."""
+
+    flush_interval_setting = 'GAME_FUNNEL_FLUSH_INTERVAL'
+    thread_name = 'game-funnel-flusher'
+
+    def __init__(self):
+        super().__init__()
+        # (story_id, story_version, kind, source, action, target) -> incremento
+        self._deltas = {}
+
+    def add(self, keys):
+        with self._lock:
+            deltas = self._deltas
+            for key in keys:
+                deltas[key] = deltas.get(key, 0) + 1
+        self._ensure_flusher()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._deltas)
+
+    def flush(self):
+        """Suma los incrementos pendientes a FunnelCounter. Devuelve cuántas filas tocó."""
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        if not deltas:
+            return 0
+        from .models import FunnelCounter
+
+        fields = ('story_id', 'story_version', 'kind', 'source', 'action', 'target')
+        start = time.perf_counter()
+        try:
+            with transaction.atomic():
+                # Las filas que faltan se crean a cero y después todas se
+                # incrementan en la base de datos (otros workers suman a la vez)
+                FunnelCounter.objects.bulk_create(
+                    [FunnelCounter(**dict(zip(fields, key))) for key in deltas],
+                    ignore_conflicts=True,
+                )
+                now = timezone.now()
+                for key, amount in deltas.items():
+                    FunnelCounter.objects.filter(**dict(zip(fields, key))).update(
+                        count=F('count') + amount, updated_at=now,
+                    )
+        except DatabaseError:
+            # Se reintentan en el siguiente volcado
+            logger.exception('No se pudieron guardar %d contadores del embudo', len(deltas))
+            with self._lock:
+                for key, amount in deltas.items():
+                    self._deltas[key] = self._deltas.get(key, 0) + amount
+            return 0
+        finally:
+            if self._on_flusher_thread():
+                connection.close()
+        if metrics.enabled():
+            metrics.OPERATION_DURATION.observe(time.perf_counter() - start, 'funnel_flush')
+        return len(deltas)
+
+
+COUNTERS = FunnelCounters()
+atexit.register(COUNTERS.flush)
+
+
+def record_transition(story, cursor, from_state, action, visited_before):
+    """
+    Cuenta una transición aplicada sobre `cursor`. `visited_before` es el
+    número de visitados antes de la transición: si creció, la partida llegó
+    a un estado nuevo.
+    """
+    if not enabled():
+        return
+    from .models import FunnelCounter
+
+    afd = story.afd
+    prefix = (story.id, story.version)
+    to_state = cursor.currentState
+    keys = [prefix + (FunnelCounter.EDGE, from_state, action, to_state)]
+    if visited_before == 1 and from_state == afd.initial_state:
+        # Primera acción de la partida
+        keys.append(prefix + (FunnelCounter.START, '', '', from_state))
+    if len(cursor.visited_ids) > visited_before:
+        keys.append(prefix + (FunnelCounter.REACHED, '', '', to_state))
+        if cursor.is_accepting_state():
+            final_type = afd.get_state(to_state).get('finalType') or to_state
+            keys.append(prefix + (FunnelCounter.ENDING, '', '', final_type))
+    COUNTERS.add(keys)
+
+
+def flush():
+    return COUNTERS.flush()
+
+
+def build_funnel(story, version=None):
+    """
+    Embudo agregado de `story` (por defecto, de su versión actual) desde las
+    filas de FunnelCounter: una consulta cuyo tamaño depende del grafo, no
+    del número de partidas.
+    """
+    from .models import FunnelCounter
+
+    version = version or story.version
+    states, edges, endings = {}, [], {}
+    starts = 0
+    rows = FunnelCounter.objects.filter(story_id=story.id, story_version=version).values_list(
+        'kind', 'source', 'action', 'target', 'count',
+    )
+    for kind, source, action, target, count in rows:
+        if kind == FunnelCounter.START:
+            starts += count
+        elif kind == FunnelCounter.REACHED:
+            states[target] = count
+        elif kind == FunnelCounter.EDGE:
+            edges.append({'from': source, 'action': action, 'to': target, 'count': count})
+        elif kind == FunnelCounter.ENDING:
+            endings[target] = count
+    if starts:
+        states[story.afd.initial_state] = starts
+    edges.sort(key=lambda edge: (-edge['count'], edge['from'], edge['action']))
+
+    reached = {}
+    if version == story.version:
+        # En el orden de la historia, con ceros para los estados a los que no llegó nadie
+        for state in story.afd.get_all_states():
+            count = states.pop(state, 0)
+            reached[state] = {'reached': count, 'rate': round(count / starts, 6) if starts else None}
+    for state, count in sorted(states.items()):
+        reached[state] = {'reached': count, 'rate': round(count / starts, 6) if starts else None}
+
+    return {
+        'story': story.id,
+        'version': version,
+        'starts': starts,
+        'finished': sum(endings.values()),
+        'states': reached,
+        'endings': dict(sorted(endings.items())),
+        'edges': edges,
+    }
+
+
+# (story_id, versión) -> (momento, JSON), del menos al más usado recientemente
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def funnel_json(story, version=None):
+    """
+    `build_funnel` serializado. Cada (historia, versión) se guarda
+    GAME_FUNNEL_CACHE_SECONDS segundos: los paneles pueden sondearlo sin
+    llegar a la base de datos en cada petición. Se guardan como mucho
+    GAME_FUNNEL_CACHE_SIZE; al pasarse se descarta la menos usada.
+    """
+    version = version or story.version
+    key = (story.id, version)
+    ttl = getattr(settings, 'GAME_FUNNEL_CACHE_SECONDS', 5.0)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and now - cached[0] < ttl:
+            _cache.move_to_end(key)
+            return cached[1]
+    body = dumps(build_funnel(story, version))
+    with _cache_lock:
+        _cache[key] = (now, body)
+        _cache.move_to_end(key)
+        while len(_cache) > getattr(settings, 'GAME_FUNNEL_CACHE_SIZE', 64):
+            _cache.popitem(last=False)
+    return body
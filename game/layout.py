@@ -0,0 +1,124 @@
+# game/layout.py
+
+# Disposición del diagrama del AFD calculada en el servidor, una vez por
+# versión de la historia (se guarda con la historia compilada). El navegador
+# recibe las coordenadas de cada estado y no tiene que colocar el grafo, que
+# con historias grandes bloquea los clientes modestos.
+#
+# Es un dibujo por capas de izquierda a derecha, como el `hierarchical` de
+# vis.js que usaba el cliente: cada estado va en la columna de su distancia
+# al estado inicial y, dentro de cada columna, se ordena por el baricentro de
+# sus vecinos para reducir los cruces de aristas (se queda el orden con menos).
+
+from collections import deque
+
+LEVEL_SEPARATION = 180
+NODE_SPACING = 120
+# Pasadas del ordenamiento por baricentro (ida y vuelta cuentan como dos)
+SWEEPS = 4
+
+
+def _levels(states, initial_state):
+    """Columna de cada estado: distancia BFS desde el inicial (los inalcanzables, desde sí mismos)."""
+    level = {}
+    for root in [initial_state] + list(states):
+        if root in level:
+            continue
+        level[root] = 0
+        queue = deque([root])
+        while queue:
+            state = queue.popleft()
+            for target in states[state]['transitions'].values():
+                if target in states and target not in level:
+                    level[target] = level[state] + 1
+                    queue.append(target)
+    return level
+
+
+def _barycenter(state, neighbours, position):
+    placed = [position[n] for n in neighbours.get(state, ()) if n in position]
+    return sum(placed) / len(placed) if placed else None
+
+
+def _crossings(order, successors):
+    """Cruces entre aristas de columnas contiguas (inversiones, con un árbol de Fenwick)."""
+    total = 0
+    for left, right in zip(order, order[1:]):
+        left_position = {state: p for p, state in enumerate(left)}
+        right_position = {state: p for p, state in enumerate(right)}
+        edges = sorted(
+            (left_position[state], right_position[target])
+            for state in left for target in successors.get(state, ()) if target in right_position
+        )
+        tree = [0] * (len(right) + 1)
+        for seen, (_, position) in enumerate(edges):
+            # Aristas anteriores que llegan más abajo que esta
+            i, not_below = position + 1, 0
+            while i > 0:
+                not_below += tree[i]
+                i -= i & -i
+            total += seen - not_below
+            i = position + 1
+            while i <= len(right):
+                tree[i] += 1
+                i += i & -i
+    return total
+
+
+def compute_layout(states, initial_state):
+    """
+    Coordenadas de cada estado: `{'nodes': {estado: {'x', 'y', 'level'}},
+    'width', 'height'}`. Determinista para una misma historia.
+    """
+    level = _levels(states, initial_state)
+    columns = {}
+    for state in states:
+        columns.setdefault(level[state], []).append(state)
+    order = [columns[i] for i in sorted(columns)]
+
+    # Vecinos en la columna anterior y en la siguiente
+    predecessors, successors = {}, {}
+    for state, details in states.items():
+        for target in details['transitions'].values():
+            if target not in states or target == state:
+                continue
+            successors.setdefault(state, []).append(target)
+            predecessors.setdefault(target, []).append(state)
+
+    best, fewest = [list(column) for column in order], _crossings(order, successors)
+    for sweep in range(SWEEPS):
+        forward = sweep % 2 == 0
+        indices = range(1, len(order)) if forward else range(len(order) - 2, -1, -1)
+        neighbours = predecessors if forward else successors
+        for i in indices:
+            reference = order[i - 1] if forward else order[i + 1]
+            position = {state: p for p, state in enumerate(reference)}
+            current = {state: p for p, state in enumerate(order[i])}
+
+            def key(state):
+                # Sin vecinos en la columna de referencia, el estado mantiene su sitio
+                barycenter = _barycenter(state, neighbours, position)
+                return (current[state] if barycenter is None else barycenter, current[state])
+
+            order[i] = sorted(order[i], key=key)
+
+        crossings = _crossings(order, successors)
+        if crossings < fewest:
+            best, fewest = [list(column) for column in order], crossings
+    order = best
+
+    nodes = {}
+    tallest = max(len(column) for column in order)
+    for column_index, column in enumerate(order):
+        offset = (len(column) - 1) / 2
+        for row, state in enumerate(column):
+            nodes[state] = {
+                'x': column_index * LEVEL_SEPARATION,
+                'y': round((row - offset) * NODE_SPACING),
+                'level': column_index,
+            }
+    return {
+        'nodes': nodes,
+        'width': (len(order) - 1) * LEVEL_SEPARATION,
+        'height': (tallest - 1) * NODE_SPACING,
+    }
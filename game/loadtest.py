@@ -0,0 +1,252 @@
+# game/loadtest.py
+
+# Generador de carga sin servicios externos: jugadores simulados que recorren
+# caminos válidos del AFD a través de /process_choice/ y /reset/, mezclando
+# sinónimos y entradas basura. Cada jugador tiene su propia sesión (cliente de
+# pruebas de Django o cookies contra un servidor local) y los jugadores se
+# reparten en un pool de procesos (ver `manage.py loadtest_game`).
+#
+# La contención del almacén de partidas se mide con la cabecera Server-Timing
+# (operaciones store_load y store_save, ver game/metrics.py): si el tiempo en
+# el almacén crece con el número de procesos, el cuello de botella es él.
+
+import http.cookiejar
+import json
+import random
+import string
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+from django.urls import reverse
+
+from .stories import get_story
+
+
+STORE_OPERATIONS = ('store_load', 'store_save')
+
+
+def parse_server_timing(header):
+    """`'store_load;dur=0.120, total;dur=1.5'` -> `{'store_load': 0.00012, 'total': 0.0015}`."""
+    durations = {}
+    for entry in header.split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                try:
+                    durations[name] = float(value) / 1000
+                except ValueError:
+                    pass
+    return durations
+
+
+class ClientePruebas:
+    """Peticiones con el cliente de pruebas de Django (en el propio proceso)."""
+
+    def __init__(self):
+        from django.test import Client
+        # Los errores del servidor (p. ej. "database is locked") cuentan como 500
+        self._client = Client(raise_request_exception=False)
+
+    def post(self, path, payload=None):
+        if payload is None:
+            response = self._client.post(path)
+        else:
+            response = self._client.post(path, json.dumps(payload), content_type='application/json')
+        return response.status_code, response.content, response.get('Server-Timing', '')
+
+
+class ClienteHTTP:
+    """Peticiones a un servidor en marcha, con las cookies de sesión de un jugador."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+        )
+
+    def post(self, path, payload=None):
+        data = json.dumps(payload or {}).encode()
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method='POST', headers={'Content-Type': 'application/json'},
+        )
+        try:
+            with self._opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.read(), response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers.get('Server-Timing', '')
+        except OSError:
+            # Conexión rechazada, timeout...: cuenta como error del servidor
+            return 0, b'', ''
+
+
+class JugadorSimulado:
+    """
+    Un jugador que parte de `reset/` y elige en cada paso una acción disponible
+    del estado en el que cree estar: por su nombre, con un sinónimo (con
+    probabilidad `synonym_rate`) o una entrada basura (`garbage_rate`). Al
+    llegar a un estado sin salida vuelve a empezar.
+    """
+
+    def __init__(self, story, client, rnd, synonym_rate=0.5, garbage_rate=0.1):
+        self.story = story
+        self.client = client
+        self.rnd = rnd
+        self.synonym_rate = synonym_rate
+        self.garbage_rate = garbage_rate
+        self.base = reverse('game_view', kwargs={'story_id': story.id})
+        self.state = story.afd.initial_state
+        self.stats = {
+            'latencies': {'choice': [], 'reset': []},
+            'store': [],
+            'status': Counter(),
+            'accepted': 0,
+            'rejected': 0,
+            'unexpected': 0,
+            'garbage_accepted': 0,
+            'started': None,
+            'finished': None,
+        }
+
+    def play(self, steps):
+        self.stats['started'] = time.time()
+        self.reset()
+        for _ in range(steps):
+            available = list(self.story.afd.get_transitions_from_state(self.state))
+            if not available:
+                self.reset()
+            else:
+                self.choose(available)
+        self.stats['finished'] = time.time()
+        return self.stats
+
+    def reset(self):
+        status, _, _ = self._request('reset', 'reset/')
+        if status == 200:
+            self.state = self.story.afd.initial_state
+
+    def choose(self, available):
+        if self.rnd.random() < self.garbage_rate:
+            expected, text = None, self._garbage()
+        else:
+            expected = self.rnd.choice(available)
+            phrases = self.story.gramatica.action_equivalents.get(expected)
+            if phrases and self.rnd.random() < self.synonym_rate:
+                text = self.rnd.choice(phrases)
+            else:
+                text = expected
+        status, content, _ = self._request('choice', 'process_choice/', {'choice': text})
+        if status != 200:
+            return
+        data = json.loads(content)
+        if not data.get('success'):
+            self.stats['rejected'] += 1
+            if expected is not None:
+                self.stats['unexpected'] += 1
+            return
+        self.stats['accepted'] += 1
+        if expected is None:
+            self.stats['garbage_accepted'] += 1
+        elif data['current_state'] != self.story.afd.next_state(self.state, expected):
+            # Un sinónimo compartido por varias acciones o un destino inexistente
+            # (ver `manage.py analyze_story`)
+            self.stats['unexpected'] += 1
+        # Seguir siempre al servidor
+        self.state = data['current_state']
+
+    def _garbage(self):
+        length = self.rnd.randint(3, 12)
+        return ''.join(self.rnd.choice(string.ascii_lowercase + ' ') for _ in range(length))
+
+    def _request(self, kind, path, payload=None):
+        start = time.perf_counter()
+        status, content, timing = self.client.post(self.base + path, payload)
+        self.stats['latencies'][kind].append(time.perf_counter() - start)
+        self.stats['status'][status] += 1
+        if timing:
+            durations = parse_server_timing(timing)
+            self.stats['store'].append(sum(durations.get(name, 0.0) for name in STORE_OPERATIONS))
+        return status, content, timing
+
+
+def run_player(player_id, story_id=None, steps=100, seed=0, synonym_rate=0.5, garbage_rate=0.1, base_url=None):
+    """Juega una partida simulada completa y devuelve sus estadísticas (picklables)."""
+    story = get_story(story_id)
+    client = ClienteHTTP(base_url) if base_url else ClientePruebas()
+    rnd = random.Random(f'{seed}:{player_id}')
+    player = JugadorSimulado(story, client, rnd, synonym_rate=synonym_rate, garbage_rate=garbage_rate)
+    return player.play(steps)
+
+
+def percentile(sorted_values, fraction):
+    """Percentil por rango más cercano de una lista ya ordenada (None si está vacía)."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': _ms(percentile(values, 0.50)),
+        'p90_ms': _ms(percentile(values, 0.90)),
+        'p99_ms': _ms(percentile(values, 0.99)),
+        'max_ms': _ms(values[-1] if values else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def merge_stats(results):
+    """
+    Agrega las estadísticas de todos los jugadores en el informe final. El
+    rendimiento se calcula sobre la ventana en la que hubo jugadores activos,
+    sin contar el arranque de los procesos.
+    """
+    elapsed = (max(stats['finished'] for stats in results) - min(stats['started'] for stats in results)
+               if results else 0.0)
+    latencies = {'choice': [], 'reset': []}
+    store = []
+    status = Counter()
+    totals = Counter()
+    for stats in results:
+        for kind, values in stats['latencies'].items():
+            latencies[kind].extend(values)
+        store.extend(stats['store'])
+        status.update(stats['status'])
+        for key in ('accepted', 'rejected', 'unexpected', 'garbage_accepted'):
+            totals[key] += stats[key]
+
+    all_latencies = latencies['choice'] + latencies['reset']
+    requests = len(all_latencies)
+    errors = sum(count for code, count in status.items() if code == 0 or code >= 500)
+    request_time = sum(all_latencies)
+    return {
+        'players': len(results),
+        'requests': requests,
+        'elapsed_seconds': elapsed,
+        'throughput_rps': requests / elapsed if elapsed else None,
+        'latency': {
+            'all': summarize_latencies(all_latencies),
+            'choice': summarize_latencies(latencies['choice']),
+            'reset': summarize_latencies(latencies['reset']),
+        },
+        'choices': dict(totals),
+        'status': {str(code): count for code, count in sorted(status.items())},
+        'errors': errors,
+        'error_rate': errors / requests if requests else 0.0,
+        # Tiempo dentro del almacén de partidas por petición y su peso sobre la
+        # latencia total; sin Server-Timing (servidor remoto sin
+        # GAME_SERVER_TIMING) no hay muestras.
+        'store': {
+            **summarize_latencies(store),
+            'share_of_request_time': sum(store) / request_time if store and request_time else None,
+        },
+    }
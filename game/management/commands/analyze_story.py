@@ -0,0 +1,80 @@
+# game/management/commands/analyze_story.py
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.analysis import problems
+from game.stories import StoryError, default_story_id, load_compiled
+
+
+class Command(BaseCommand):
+    help = (
+        'Analiza el grafo de una historia: destinos inexistentes, estados '
+        'inalcanzables, callejones sin salida, caminos más cortos a cada final '
+        'y ciclos (componentes fuertemente conexas).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('story', nargs='?', help='Historia a analizar (por defecto, GAME_DEFAULT_STORY).')
+        parser.add_argument('--json', action='store_true', help='Escribe el análisis completo en JSON.')
+        parser.add_argument('--strict', action='store_true', help='Termina con error si la historia tiene problemas.')
+
+    def handle(self, *args, **options):
+        story_id = options['story'] or default_story_id()
+        try:
+            version, compiled = load_compiled(story_id)
+        except StoryError as e:
+            raise CommandError(str(e))
+        analysis = compiled['analysis']
+
+        if options['json']:
+            self.stdout.write(json.dumps(analysis, indent=2, ensure_ascii=False))
+        else:
+            self._report(story_id, version, analysis)
+
+        if options['strict'] and not analysis['verified']:
+            raise CommandError(f'La historia {story_id!r} no supera la verificación.')
+
+    def _report(self, story_id, version, analysis):
+        self.stdout.write(f'Historia {story_id} (versión {version})')
+        self.stdout.write(
+            f"  {analysis['total_states']} estados, {analysis['total_transitions']} transiciones, "
+            f"{analysis['final_states_count']} finales, {analysis['reachable_count']} alcanzables"
+        )
+        self.stdout.write(f"  {analysis['scc_count']} componentes fuertemente conexas, {len(analysis['cycles'])} con ciclos")
+
+        self.stdout.write('Caminos más cortos a cada final:')
+        for state, ending in sorted(analysis['endings'].items()):
+            if ending['reachable']:
+                self.stdout.write(f"  {state} [{ending['finalType']}]: {ending['length']} pasos: "
+                                  + ' -> '.join(ending['actions']))
+            else:
+                self.stdout.write(f"  {state} [{ending['finalType']}]: inalcanzable")
+
+        exploration = analysis['exploration']
+        playthroughs = exploration['playthroughs']
+        self.stdout.write(
+            'Exploración: '
+            + (f'{playthroughs} partidas distintas sin repetir estado' if playthroughs is not None
+               else 'demasiadas partidas distintas para contarlas')
+            + (f", {exploration['expected_length']:.1f} pasos de media eligiendo al azar"
+               if exploration['expected_length'] is not None else ', la partida al azar puede no terminar')
+        )
+        for state, ending in exploration['endings'].items():
+            expected = ending['expected_length']
+            self.stdout.write(
+                f"  {state}: {ending['playthroughs'] if ending['playthroughs'] is not None else '?'} partidas, "
+                f"{ending['probability']:.1%} al azar"
+                + (f', {expected:.1f} pasos de media' if expected is not None else '')
+            )
+        for state, probability in exploration['stuck'].items():
+            self.stdout.write(f'  {state} (sin salida): {probability:.1%} al azar')
+
+        found = problems(analysis)
+        if found:
+            self.stdout.write(self.style.WARNING(f'{len(found)} problemas:'))
+            for line in found:
+                self.stdout.write(f'  {line}')
+        else:
+            self.stdout.write(self.style.SUCCESS('Historia verificada: sin problemas.'))
@@ -0,0 +1,122 @@
+# game/management/commands/bench_game.py
+
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from game import benchmarks, events, funnel
+from game.stories import get_story
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta los benchmarks del motor del juego y de los endpoints y '
+        'escribe los resultados en JSON (para comparar entre commits).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=1000, help='Iteraciones por ronda en los casos del motor.')
+        parser.add_argument('--http-number', type=int, default=200, help='Iteraciones por ronda en los casos HTTP.')
+        parser.add_argument('--repeat', type=int, default=5, help='Rondas por caso (se reporta la mínima).')
+        parser.add_argument('--filter', dest='name_filter', help='Ejecuta solo los casos cuyo nombre contenga este texto.')
+        parser.add_argument('--no-http', action='store_true', help='Omite los casos que pasan por el cliente de pruebas.')
+        parser.add_argument('--story', help='Historia a medir (por defecto, GAME_DEFAULT_STORY).')
+        parser.add_argument('--output', help='Archivo donde escribir el JSON (por defecto, la salida estándar).')
+        parser.add_argument('--compare', help='JSON de una ejecución anterior con el que comparar.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Empeoramiento relativo tolerado antes de marcar regresión (0.2 = 20%%).')
+
+    def handle(self, *args, **options):
+        story = get_story(options['story'])
+        results = benchmarks.run(
+            benchmarks.engine_benchmarks(story),
+            number=options['number'],
+            repeat=options['repeat'],
+            name_filter=options['name_filter'],
+        )
+        if not options['no_http']:
+            results.update(self._run_http(story, options))
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'commit': self._git_commit(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'story': story.id,
+                'story_version': story.version,
+            },
+            'results': results,
+        }
+        payload = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(payload + '\n')
+        else:
+            self.stdout.write(payload)
+
+        if options['compare']:
+            self._compare(results, options['compare'], options['threshold'])
+
+    def _run_http(self, story, options):
+        # Base de datos de pruebas para no tocar la real (usuarios, sesiones)
+        from django.contrib.auth.models import User
+        from django.test import Client
+
+        setup_test_environment()
+        # Los volcados del registro de eventos y del embudo, al final y en este
+        # hilo: la base de datos de pruebas en memoria no admite escrituras
+        # desde otro hilo mientras se atienden las peticiones
+        flush_manually = override_settings(GAME_EVENT_LOG_FLUSH_INTERVAL=None, GAME_FUNNEL_FLUSH_INTERVAL=None)
+        flush_manually.enable()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user = User.objects.create_user('bench', 'bench@example.com', 'bench-password')
+            client = Client()
+            client.force_login(user)
+            return benchmarks.run(
+                benchmarks.http_benchmarks(client, story),
+                number=options['http_number'],
+                repeat=options['repeat'],
+                name_filter=options['name_filter'],
+            )
+        finally:
+            events.flush()
+            funnel.flush()
+            flush_manually.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def _compare(self, results, path, threshold):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'No se pudo leer {path}: {e}')
+
+        regressions = []
+        for name, ratio, is_regression in benchmarks.compare(results, baseline, threshold):
+            line = f'{name:50s} {ratio:6.2f}x'
+            if is_regression:
+                regressions.append(name)
+                self.stderr.write(self.style.ERROR(line + '  REGRESIÓN'))
+            else:
+                self.stderr.write(line)
+        if regressions:
+            raise CommandError(f'{len(regressions)} caso(s) empeoraron más de un {threshold:.0%}')
+
+    @staticmethod
+    def _git_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,152 @@
+# game/management/commands/loadtest_game.py
+
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from game import loadtest
+from game.stories import StoryError, default_story_id, get_story
+
+
+def _init_worker(database_name, story_id, base_url):
+    """Prepara cada proceso del pool: Django, base de datos de pruebas e historia cargada."""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    if base_url is None:
+        from django.db import connections
+        from django.test.utils import override_settings, setup_test_environment
+        connections.close_all()
+        if database_name is not None:
+            connections['default'].settings_dict['NAME'] = database_name
+        setup_test_environment()
+        # Server-Timing trae el tiempo del almacén de partidas en cada respuesta
+        override_settings(GAME_METRICS=True, GAME_SERVER_TIMING=True).enable()
+    get_story(story_id)
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga: jugadores simulados recorren caminos válidos de la '
+        'historia desde un pool de procesos (con sinónimos y entradas basura) y '
+        'se informa del rendimiento, las latencias p50/p99 y la contención del '
+        'almacén de partidas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=20, help='Jugadores simulados (cada uno con su sesión).')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Procesos del pool (jugadores concurrentes).')
+        parser.add_argument('--steps', type=int, default=100, help='Acciones por jugador.')
+        parser.add_argument('--story', help='Historia a jugar (por defecto, GAME_DEFAULT_STORY).')
+        parser.add_argument('--url', help='Servidor en marcha (p. ej. http://127.0.0.1:8000); '
+                                          'por defecto se usa el cliente de pruebas en cada proceso.')
+        parser.add_argument('--synonym-rate', type=float, default=0.5,
+                            help='Probabilidad de usar un sinónimo en vez del nombre de la acción.')
+        parser.add_argument('--garbage-rate', type=float, default=0.1, help='Probabilidad de enviar una entrada basura.')
+        parser.add_argument('--seed', type=int, default=0, help='Semilla de los jugadores (reproducible).')
+        parser.add_argument('--json', action='store_true', help='Escribe el informe en JSON.')
+
+    def handle(self, *args, **options):
+        if options['players'] < 1 or options['processes'] < 1 or options['steps'] < 1:
+            raise CommandError('--players, --processes y --steps deben ser positivos.')
+        story_id = options['story'] or default_story_id()
+        try:
+            get_story(story_id)
+        except StoryError as e:
+            raise CommandError(str(e))
+
+        play = partial(
+            loadtest.run_player,
+            story_id=story_id,
+            steps=options['steps'],
+            seed=options['seed'],
+            synonym_rate=options['synonym_rate'],
+            garbage_rate=options['garbage_rate'],
+            base_url=options['url'],
+        )
+        if options['url']:
+            results = self._run_pool(play, options, None, story_id)
+        else:
+            results = self._run_with_test_database(play, options, story_id)
+
+        report = loadtest.merge_stats(results)
+        report['meta'] = {
+            'story': story_id,
+            'processes': options['processes'],
+            'steps': options['steps'],
+            'target': options['url'] or 'test-client',
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+        else:
+            self._report(report)
+
+    def _run_pool(self, play, options, database_name, story_id):
+        with ProcessPoolExecutor(
+            max_workers=options['processes'],
+            initializer=_init_worker,
+            initargs=(database_name, story_id, options['url']),
+        ) as executor:
+            return list(executor.map(play, range(options['players'])))
+
+    def _run_with_test_database(self, play, options, story_id):
+        # Una base de datos de pruebas en archivo, compartida por todos los
+        # procesos: las sesiones compiten por ella como en producción
+        old_name = connection.settings_dict['NAME']
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'loadtest.sqlite3')
+            database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            connections.close_all()
+            try:
+                return self._run_pool(play, options, database_name, story_id)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _report(self, report):
+        meta = report['meta']
+        self.stdout.write(
+            f"Historia {meta['story']} contra {meta['target']}: {report['players']} jugadores, "
+            f"{meta['processes']} procesos, {meta['steps']} acciones por jugador"
+        )
+        self.stdout.write(
+            f"  {report['requests']} peticiones en {report['elapsed_seconds']:.2f} s: "
+            f"{report['throughput_rps']:.1f} peticiones/s"
+        )
+        self.stdout.write('Latencia (ms):')
+        for kind, summary in report['latency'].items():
+            self.stdout.write(f'  {kind:8s} {self._format_summary(summary)}')
+        choices = report['choices']
+        self.stdout.write(
+            f"Acciones: {choices.get('accepted', 0)} aceptadas, {choices.get('rejected', 0)} rechazadas, "
+            f"{choices.get('unexpected', 0)} válidas con un resultado distinto del esperado, "
+            f"{choices.get('garbage_accepted', 0)} entradas basura reconocidas"
+        )
+        self.stdout.write('Códigos de estado: ' + ', '.join(f'{code}: {count}' for code, count in report['status'].items()))
+
+        store = report['store']
+        self.stdout.write('Almacén de partidas (ms por petición, de Server-Timing):')
+        if store['count']:
+            self.stdout.write(f'  {self._format_summary(store)}')
+            self.stdout.write(f"  {store['share_of_request_time']:.1%} del tiempo de las peticiones")
+        else:
+            self.stdout.write('  sin datos (activa GAME_SERVER_TIMING en el servidor)')
+
+        if report['errors']:
+            self.stdout.write(self.style.ERROR(
+                f"{report['errors']} errores ({report['error_rate']:.1%}): 5xx o conexiones fallidas"
+            ))
+
+    @staticmethod
+    def _format_summary(summary):
+        if not summary['count']:
+            return 'sin muestras'
+        return (f"n={summary['count']}  p50={summary['p50_ms']:.2f}  p90={summary['p90_ms']:.2f}  "
+                f"p99={summary['p99_ms']:.2f}  max={summary['max_ms']:.2f}")
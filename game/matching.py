@@ -0,0 +1,310 @@
+# game/matching.py
+
+import re
+import unicodedata
+from collections import deque
+
+
+def _strip_combining(text):
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+# Latin-1 y Latin Extended-A precalculados para no normalizar cada entrada
+# completa: solo se sustituyen los caracteres que no son ASCII.
+_FOLDED_CHARS = {
+    chr(code): _strip_combining(chr(code))
+    for code in range(0xC0, 0x180)
+    if _strip_combining(chr(code)) != chr(code)
+}
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def _fold_char(match):
+    char = match.group()
+    folded = _FOLDED_CHARS.get(char)
+    return folded if folded is not None else _strip_combining(char)
+
+
+def fold_accents(text):
+    """Quita tildes y diacríticos (`médico` -> `medico`, `ñ` -> `n`)."""
+    if text.isascii():
+        return text
+    return _NON_ASCII.sub(_fold_char, text)
+
+
+class IndiceSinonimos:
+    """
+    Autómata de Aho-Corasick sobre tokens (palabras) construido una sola vez
+    a partir de la tabla de sinónimos de las acciones.
+
+    Cada frase sinónima es una secuencia de palabras; al recorrer la entrada
+    del usuario palabra a palabra se obtienen, en una sola pasada, todas las
+    transiciones cuyas frases aparecen completas en la entrada. El coste por
+    consulta depende de la longitud de la entrada, no del tamaño de la tabla.
+    """
+
+    def __init__(self, action_equivalents):
+        # goto[n]: palabra -> nodo hijo; fail[n]: enlace de fallo;
+        # output[n]: transiciones cuyas frases terminan en el nodo n
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [frozenset()]
+
+        terminals = {}
+        for transition, equivalents in action_equivalents.items():
+            for equivalent in equivalents:
+                node = self._insert(equivalent.split())
+                terminals.setdefault(node, set()).add(transition)
+        for node, transitions in terminals.items():
+            self._output[node] = frozenset(transitions)
+
+        self._build_failure_links()
+
+    def _insert(self, words):
+        node = 0
+        for word in words:
+            child = self._goto[node].get(word)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][word] = child
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(frozenset())
+            node = child
+        return node
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(word, 0)
+                # Las frases que terminan en el nodo de fallo también terminan aquí
+                self._output[child] = self._output[child] | self._output[self._fail[child]]
+
+    def find(self, words):
+        """Devuelve el conjunto de transiciones con alguna frase presente en `words`."""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        node = 0
+        for word in words:
+            while node and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            if output[node]:
+                found |= output[node]
+        return found
+
+    def match(self, words, available_transitions):
+        """
+        Devuelve la primera transición de `available_transitions` (en su orden)
+        con alguna frase sinónima presente en `words`, o None.
+        """
+        found = self.find(words)
+        if not found:
+            return None
+        for transition in available_transitions:
+            if transition in found:
+                return transition
+        return None
+
+
+def edit_distance(a, b, limit):
+    """
+    Distancia de Damerau-Levenshtein restringida (una transposición de letras
+    contiguas cuenta como un error) entre `a` y `b`, o `limit + 1` si la supera.
+    Solo se calcula la franja de la matriz a `limit` de la diagonal.
+    """
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > limit:
+        return limit + 1
+    over = limit + 1
+    previous_previous = None
+    previous = [j if j <= limit else over for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        current = [over] * (len_b + 1)
+        if i <= limit:
+            current[0] = i
+        char_a = a[i - 1]
+        row_minimum = current[0]
+        for j in range(max(1, i - limit), min(len_b, i + limit) + 1):
+            value = previous[j - 1] if char_a == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if (previous_previous is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == b[j - 1]
+                    and previous_previous[j - 2] + 1 < value):
+                value = previous_previous[j - 2] + 1
+            if value > over:
+                value = over
+            current[j] = value
+            if value < row_minimum:
+                row_minimum = value
+        if row_minimum > limit:
+            return over
+        previous_previous, previous = previous, current
+    return previous[len_b] if previous[len_b] <= limit else over
+
+
+class IndiceDifuso:
+    """
+    Corrector de erratas por "borrado simétrico" sobre el vocabulario de las
+    acciones. Al construirlo se generan, para cada palabra, todas las variantes
+    con hasta `max_distance` letras borradas; una palabra de la entrada se
+    corrige buscando sus propias variantes en ese diccionario y verificando
+    la distancia real de los candidatos. La consulta no recorre el vocabulario.
+
+    La distancia admitida depende de la longitud de la palabra: las palabras
+    cortas ("al", "ir") no se corrigen, para no convertir una en otra.
+    """
+
+    # Palabras de la entrada que se intentan corregir como máximo por consulta
+    MAX_WORDS = 16
+    # Correcciones recordadas (las mismas erratas se repiten mucho)
+    CACHE_SIZE = 10000
+
+    def __init__(self, words, max_distance=2):
+        self.max_distance = max_distance
+        self.vocabulary = frozenset(words)
+        self._max_length = max((len(word) for word in self.vocabulary), default=0)
+        self._deletes = {}
+        for word in self.vocabulary:
+            for variant in self._variants(word, self.distance_for(word)):
+                self._deletes.setdefault(variant, []).append(word)
+        self._cache = {}
+
+    @staticmethod
+    def distance_for(word):
+        """Errores admitidos según la longitud: 0 hasta 3 letras, 1 hasta 7, 2 desde 8."""
+        if len(word) <= 3:
+            return 0
+        return 1 if len(word) <= 7 else 2
+
+    def _variants(self, word, distance):
+        variants = {word}
+        frontier = {word}
+        for _ in range(min(distance, self.max_distance)):
+            frontier = {candidate[:i] + candidate[i + 1:] for candidate in frontier for i in range(len(candidate))}
+            variants |= frontier
+        return variants
+
+    def correct_word(self, word):
+        """Palabra del vocabulario más cercana a `word`, o `word` si no hay ninguna."""
+        if word in self.vocabulary:
+            return word
+        corrected = self._cache.get(word)
+        if corrected is not None:
+            return corrected
+
+        corrected = word
+        distance = self.distance_for(word)
+        if distance and len(word) <= self._max_length + distance:
+            candidates = set()
+            for variant in self._variants(word, distance):
+                candidates.update(self._deletes.get(variant, ()))
+            best_distance, best = distance + 1, None
+            # En orden alfabético: a igual distancia gana la primera (resultado estable)
+            for candidate in sorted(candidates):
+                limit = min(distance, self.distance_for(candidate), best_distance - 1)
+                found = edit_distance(word, candidate, limit)
+                if found <= limit:
+                    best_distance, best = found, candidate
+                    if found == 1:
+                        break
+            if best is not None:
+                corrected = best
+
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[word] = corrected
+        return corrected
+
+    def correct(self, words):
+        """Corrige las MAX_WORDS primeras palabras de `words` y las devuelve."""
+        return [self.correct_word(word) for word in words[:self.MAX_WORDS]]
+
+
+def normalize_phrase(text):
+    """Minúsculas, sin tildes y con los espacios colapsados (se conserva uno final)."""
+    normalized = ' '.join(fold_accents(text.lower()).split())
+    if normalized and text[-1:].isspace():
+        normalized += ' '
+    return normalized
+
+
+class IndicePrefijos:
+    """
+    Trie de caracteres sobre las frases que el servidor acepta para cada
+    acción (sus sinónimos y su nombre), para autocompletar lo que escribe el
+    jugador. Cada nodo guarda, ya ordenadas, las frases que continúan su
+    prefijo: una consulta solo recorre el prefijo y filtra por las acciones
+    disponibles, sin mirar el resto de la tabla.
+
+    Las frases se indexan también desde el inicio de cada una de sus palabras
+    ("nave" sugiere "investigar nave"), detrás de las que empiezan por el prefijo.
+    """
+
+    # Prefijos más largos que esto no se buscan (no hay frases tan largas)
+    MAX_PREFIX = 100
+
+    def __init__(self, phrases):
+        # `phrases`: pares (texto, transición); el texto se muestra tal cual
+        self.phrases = []
+        self._children = [{}]
+        ranked = [[]]
+        seen = set()
+        for text, transition in phrases:
+            key = normalize_phrase(text).strip()
+            if not key or (key, transition) in seen:
+                continue
+            seen.add((key, transition))
+            index = len(self.phrases)
+            self.phrases.append((text, transition))
+            starts = [0] + [i + 1 for i, char in enumerate(key) if char == ' ']
+            for rank, start in enumerate(starts):
+                node = 0
+                for char in key[start:]:
+                    child = self._children[node].get(char)
+                    if child is None:
+                        child = len(self._children)
+                        self._children[node][char] = child
+                        self._children.append({})
+                        ranked.append([])
+                    node = child
+                    # Primero las frases que empiezan por el prefijo, luego las
+                    # más cortas (las más cerca de estar completas)
+                    ranked[node].append((min(rank, 1), len(key), key, index))
+
+        self._entries = []
+        for entries in ranked:
+            ordered, included = [], set()
+            for *_, index in sorted(entries):
+                if index not in included:
+                    included.add(index)
+                    ordered.append(index)
+            self._entries.append(tuple(ordered))
+
+    def completions(self, prefix, available_transitions):
+        """
+        Genera, por orden de relevancia, las frases `(texto, transición)` de
+        `available_transitions` que continúan `prefix`.
+        """
+        key = normalize_phrase(prefix)
+        if not key.strip() or len(key) > self.MAX_PREFIX:
+            return
+        node = 0
+        for char in key:
+            node = self._children[node].get(char)
+            if node is None:
+                return
+        available = set(available_transitions)
+        for index in self._entries[node]:
+            phrase = self.phrases[index]
+            if phrase[1] in available:
+                yield phrase
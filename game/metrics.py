@@ -0,0 +1,266 @@
+# game/metrics.py
+
+# Instrumentación del camino caliente del juego. Las métricas se acumulan en
+# memoria del proceso y se exponen en formato de texto de Prometheus en
+# /metrics; cada worker tiene las suyas, así que con varios procesos hay que
+# hacer scrape de cada uno (o sumar en Prometheus por instancia).
+#
+# /metrics solo responde a las direcciones de GAME_METRICS_ALLOWED_IPS (IPs o
+# redes en notación CIDR) y a los usuarios staff.
+#
+# Opcionalmente, GameMetricsMiddleware añade a cada respuesta una cabecera
+# Server-Timing con el desglose de la petición, visible en las DevTools.
+
+import ipaddress
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+
+
+# Cualquier otro método se cuenta como "other": la etiqueta la elige el
+# cliente y no debe crear series nuevas sin límite
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'))
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            yield f'{self.name}_total{_format_labels(self.labelnames, labelvalues)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [cuentas por bucket (+Inf al final), suma]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labelvalues, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', bound)])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f'{self.name}_sum{labels} {total}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'game_request_duration_seconds', 'Duración de las peticiones por vista.', ('view', 'method'),
+))
+REQUESTS = REGISTRY.register(Counter(
+    'game_requests', 'Peticiones atendidas por vista y código de estado.', ('view', 'method', 'status'),
+))
+OPERATION_DURATION = REGISTRY.register(Histogram(
+    'game_operation_duration_seconds',
+    'Duración de las operaciones del camino caliente (almacén, transición, texto, JSON).',
+    ('operation',),
+))
+VALIDATE_INPUT_DURATION = REGISTRY.register(Histogram(
+    'game_validate_input_duration_seconds',
+    'Duración de validate_input según el criterio que reconoció la acción (none si ninguno).',
+    ('tier',),
+))
+PLAYTHROUGH_EVENTS = REGISTRY.register(Counter(
+    'game_playthrough_events',
+    'Eventos de partida por resultado: recorded (al búfer), written (a la base de datos) o dropped.',
+    ('outcome',),
+))
+
+
+# Tiempos de la petición en curso para Server-Timing: lista de (nombre, segundos)
+_request_timings = ContextVar('game_request_timings', default=None)
+
+
+def enabled():
+    return getattr(settings, 'GAME_METRICS', True)
+
+
+def _record_timing(name, seconds):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def observe_operation(operation, seconds):
+    OPERATION_DURATION.observe(seconds, operation)
+    _record_timing(operation, seconds)
+
+
+def observe_validate_input(tier, seconds):
+    VALIDATE_INPUT_DURATION.observe(seconds, tier or 'none')
+    _record_timing('validate_input', seconds)
+
+
+@contextmanager
+def timed(operation):
+    """Mide el bloque como `operation` en game_operation_duration_seconds."""
+    if not enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_operation(operation, time.perf_counter() - start)
+
+
+def server_timing_header(timings, total):
+    """Cabecera Server-Timing, sumando las operaciones repetidas (p. ej. en lotes)."""
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations['total'] = total
+    return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in durations.items())
+
+
+class GameMetricsMiddleware:
+    """
+    Mide la duración de cada petición por vista y, si GAME_SERVER_TIMING está
+    activo, añade la cabecera Server-Timing con el desglose de operaciones.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        token = _request_timings.set([])
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self._finish(request, response, start)
+        finally:
+            _request_timings.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        token = _request_timings.set([])
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self._finish(request, response, start)
+        finally:
+            _request_timings.reset(token)
+        return response
+
+    def _finish(self, request, response, start):
+        total = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        REQUEST_DURATION.observe(total, view, method)
+        REQUESTS.inc(view, method, response.status_code)
+        if getattr(settings, 'GAME_SERVER_TIMING', False):
+            response['Server-Timing'] = server_timing_header(_request_timings.get(), total)
+
+
+@lru_cache(maxsize=8)
+def _allowed_networks(allowed):
+    return tuple(ipaddress.ip_network(value, strict=False) for value in allowed)
+
+
+def _metrics_allowed(request):
+    """La petición viene de GAME_METRICS_ALLOWED_IPS o de un usuario staff."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    allowed = tuple(getattr(settings, 'GAME_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')))
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in network for network in _allowed_networks(allowed))
+
+
+def metrics_view(request):
+    """Métricas del proceso en formato de texto de Prometheus."""
+    if not enabled():
+        raise Http404('Las métricas están desactivadas (GAME_METRICS).')
+    if not _metrics_allowed(request):
+        raise PermissionDenied('Las métricas solo están disponibles para GAME_METRICS_ALLOWED_IPS o usuarios staff.')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
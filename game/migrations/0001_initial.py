@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaythroughEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, max_length=40)),
+                ('story_id', models.CharField(max_length=100)),
+                ('story_version', models.CharField(max_length=16)),
+                ('from_state', models.CharField(max_length=100)),
+                ('action', models.CharField(blank=True, max_length=100)),
+                ('to_state', models.CharField(blank=True, max_length=100)),
+                ('raw_input', models.TextField()),
+                ('tier', models.CharField(blank=True, max_length=10)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='playthrough_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['story_id', 'created_at'], name='game_playth_story_i_b26abc_idx'), models.Index(fields=['user', 'created_at'], name='game_playth_user_id_5be90b_idx')],
+            },
+        ),
+    ]
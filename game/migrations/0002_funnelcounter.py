@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FunnelCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('story_id', models.CharField(max_length=100)),
+                ('story_version', models.CharField(max_length=16)),
+                ('kind', models.CharField(choices=[('start', 'Partidas empezadas'), ('reached', 'Partidas que llegan al estado'), ('edge', 'Transición recorrida'), ('ending', 'Partidas terminadas en el final')], max_length=8)),
+                ('source', models.CharField(blank=True, max_length=100)),
+                ('action', models.CharField(blank=True, max_length=100)),
+                ('target', models.CharField(max_length=100)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('story_id', 'story_version', 'kind', 'source', 'action', 'target'), name='unique_funnel_counter')],
+            },
+        ),
+    ]
@@ -1,3 +1,83 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class PlaythroughEvent(models.Model):
+    """
+    Una acción de un jugador: lo que escribió, cómo se reconoció y a dónde
+    llevó. Es un registro de solo inserción; las filas se escriben por lotes
+    fuera de la petición (ver game/events.py).
+    """
+
+    # Sin restricción en la base de datos: el lote no debe fallar si el
+    # usuario se borró mientras el evento esperaba en memoria
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL,
+        db_constraint=False, related_name='playthrough_events',
+    )
+    session_key = models.CharField(max_length=40, blank=True)
+    story_id = models.CharField(max_length=100)
+    story_version = models.CharField(max_length=16)
+    from_state = models.CharField(max_length=100)
+    # Vacíos si la entrada no se reconoció como ninguna acción
+    action = models.CharField(max_length=100, blank=True)
+    to_state = models.CharField(max_length=100, blank=True)
+    raw_input = models.TextField()
+    # 'exact', 'synonym', 'keyword', 'fuzzy' o vacío (ver GramaticaNarrativa.match_input)
+    tier = models.CharField(max_length=10, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['story_id', 'created_at']),
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.story_id}: {self.from_state} --{self.action or "?"}--> {self.to_state or "-"}'
+
+
+class FunnelCounter(models.Model):
+    """
+    Contador agregado del embudo de una versión de una historia. Cada worker
+    acumula incrementos en memoria y los suma a estas filas periódicamente
+    (ver game/funnel.py); hay una fila por estado, transición y final, no por
+    partida, así que leer el embudo no depende del número de jugadores.
+    """
+
+    START = 'start'
+    REACHED = 'reached'
+    EDGE = 'edge'
+    ENDING = 'ending'
+    KINDS = [
+        (START, 'Partidas empezadas'),
+        (REACHED, 'Partidas que llegan al estado'),
+        (EDGE, 'Transición recorrida'),
+        (ENDING, 'Partidas terminadas en el final'),
+    ]
+
+    story_id = models.CharField(max_length=100)
+    story_version = models.CharField(max_length=16)
+    kind = models.CharField(max_length=8, choices=KINDS)
+    # Origen y acción solo en las transiciones; el destino es el estado
+    # (o el tipo de final, en ENDING)
+    source = models.CharField(max_length=100, blank=True)
+    action = models.CharField(max_length=100, blank=True)
+    target = models.CharField(max_length=100)
+    count = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['story_id', 'story_version', 'kind', 'source', 'action', 'target'],
+                name='unique_funnel_counter',
+            ),
+        ]
+
+    def __str__(self):
+        if self.kind == self.EDGE:
+            return f'{self.story_id}: {self.source} --{self.action}--> {self.target} ({self.count})'
+        return f'{self.story_id}: {self.kind} {self.target} ({self.count})'
@@ -0,0 +1,102 @@
+# game/responses.py
+
+# Serialización JSON y respuestas HTTP del juego.
+#
+# - `dumps`/`loads` usan orjson si está instalado (varias veces más rápido que
+#   el módulo json) y si no, json con separadores compactos. Ambos devuelven
+#   UTF-8 sin escapar los acentos, así que las respuestas son más pequeñas que
+#   las de JsonResponse.
+# - Las respuestas grandes se comprimen con gzip si el cliente lo acepta
+#   (`Accept-Encoding`). Las que no cambian (afd_info) se comprimen una vez
+#   por versión de la historia y se guardan ya comprimidas.
+
+import gzip
+import json
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json
+    orjson = None
+
+
+def _dumps_stdlib(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps(obj):
+    """Serializa `obj` a JSON en bytes UTF-8."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # Enteros de más de 64 bits, claves que no son cadenas...
+            pass
+    return _dumps_stdlib(obj)
+
+
+def loads(data):
+    """Como json.loads (lanza json.JSONDecodeError), con orjson si está disponible."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def gzip_min_size():
+    return getattr(settings, 'GAME_GZIP_MIN_SIZE', 1024)
+
+
+def accepts_gzip(request):
+    """El cliente acepta gzip (sin `q=0`) en `Accept-Encoding`."""
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            q = params.strip()
+            if not q.startswith('q='):
+                return True
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def compress(body, level=None):
+    return gzip.compress(body, compresslevel=level or getattr(settings, 'GAME_GZIP_LEVEL', 6), mtime=0)
+
+
+def json_bytes_response(request, body, status=200, compressed=None, etag=None):
+    """
+    Respuesta con un cuerpo JSON ya serializado. Si ocupa al menos
+    GAME_GZIP_MIN_SIZE bytes y el cliente acepta gzip, se envía comprimido:
+    `compressed` es la versión ya comprimida (o una función que la devuelve)
+    y `etag`, el ETag fuerte que tendría la respuesta sin comprimir.
+    """
+    headers = {}
+    if request is not None and len(body) >= gzip_min_size():
+        if accepts_gzip(request):
+            with metrics.timed('compress'):
+                if compressed is None:
+                    body = compress(body)
+                else:
+                    body = compressed() if callable(compressed) else compressed
+            headers['Content-Encoding'] = 'gzip'
+            if etag is not None:
+                # Otra representación del mismo recurso: ETag débil, como GZipMiddleware
+                headers['ETag'] = f'W/"{etag}"'
+        response = HttpResponse(body, content_type='application/json', status=status, headers=headers)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+    return HttpResponse(body, content_type='application/json', status=status)
+
+
+def json_response(data, status=200, request=None):
+    """Como JsonResponse, con `dumps` y gzip si se pasa la petición."""
+    with metrics.timed('json_serialize'):
+        body = dumps(data)
+    return json_bytes_response(request, body, status=status)
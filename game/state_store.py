@@ -0,0 +1,505 @@
+# game/state_store.py
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .metrics import enabled as metrics_enabled, timed
+from .stories import default_story_id
+
+
+# ============ ALMACENES DEL PROGRESO DE LA PARTIDA ============
+# El progreso de un jugador es (estado actual, visitados, versión de la historia),
+# y cada jugador tiene una partida por historia (`story_id`).
+# Los visitados llegan ya codificados como una cadena compacta de ids (ver
+# game/codec.py) que solo es válida para esa versión de la historia; para el
+# almacén es un valor opaco al que `update` concatena el delta.
+# Los almacenes reciben escrituras completas (`save`) o deltas (`update`):
+# al avanzar normalmente solo cambia el estado actual y, como mucho, se
+# añade un estado visitado, así que no hace falta reescribir todo el blob.
+
+class GameStateStore:
+    """Interfaz común de los almacenes de partidas."""
+
+    # Si se puede usar desde el canal WebSocket (game/websocket.py)
+    supports_websocket = True
+
+    def __init__(self, **options):
+        self.options = options
+
+    def load(self, request, story_id):
+        """Devuelve `(current_state, visited, story_version)` o None si no hay partida."""
+        raise NotImplementedError
+
+    def save(self, request, story_id, current_state, visited, story_version):
+        """Reemplaza el progreso completo del jugador."""
+        raise NotImplementedError
+
+    def update(self, request, story_id, current_state, new_visited):
+        """Cambia el estado actual y concatena `new_visited` a los visitados."""
+        raise NotImplementedError
+
+    # Versiones asíncronas (vistas ASGI). Por defecto delegan en un hilo;
+    # los almacenes que pueden hacerlo sin bloquear las sobrescriben.
+
+    async def aload(self, request, story_id):
+        return await sync_to_async(self.load)(request, story_id)
+
+    async def asave(self, request, story_id, current_state, visited, story_version):
+        await sync_to_async(self.save)(request, story_id, current_state, visited, story_version)
+
+    async def aupdate(self, request, story_id, current_state, new_visited):
+        await sync_to_async(self.update)(request, story_id, current_state, new_visited)
+
+    def commit(self, request, response):
+        """Se llama al terminar la petición (lo usan los almacenes basados en cookies)."""
+
+    @staticmethod
+    def slot(story_id, separator=':'):
+        """
+        Sufijo de las claves de la partida de `story_id`. La historia por defecto
+        no lleva sufijo, así que conserva las claves de antes de haber varias.
+        """
+        if story_id is None or story_id == default_story_id():
+            return ''
+        return f'{separator}{story_id}'
+
+    def player_key(self, request, story_id=None):
+        """Clave del jugador (su id de usuario o, si es anónimo, la de su sesión) en `story_id`."""
+        if request.user.is_authenticated:
+            return f'user:{request.user.pk}{self.slot(story_id)}'
+        if request.session.session_key is None:
+            request.session.save()
+        return f'session:{request.session.session_key}{self.slot(story_id)}'
+
+    async def aplayer_key(self, request, story_id=None):
+        user = await request.auser()
+        if user.is_authenticated:
+            return f'user:{user.pk}{self.slot(story_id)}'
+        if request.session.session_key is None:
+            await request.session.asave()
+        return f'session:{request.session.session_key}{self.slot(story_id)}'
+
+
+class SessionGameStateStore(GameStateStore):
+    """
+    Guarda la partida en `request.session['game_state']` (comportamiento
+    original); las de otras historias, en `game_state:<story_id>`.
+    """
+
+    session_key = 'game_state'
+
+    def _key(self, story_id):
+        return self.session_key + self.slot(story_id)
+
+    @staticmethod
+    def _loaded(game_state):
+        if game_state is None:
+            return None
+        if 'visited' not in game_state:
+            # Sesiones anteriores a la codificación compacta: lista de nombres
+            return game_state.get('current_state'), game_state.get('visited_states') or [], None
+        return game_state['current_state'], game_state['visited'], game_state.get('story_version')
+
+    def load(self, request, story_id):
+        return self._loaded(request.session.get(self._key(story_id)))
+
+    def save(self, request, story_id, current_state, visited, story_version):
+        request.session[self._key(story_id)] = {
+            'current_state': current_state,
+            'visited': visited,
+            'story_version': story_version,
+        }
+
+    def update(self, request, story_id, current_state, new_visited):
+        game_state = request.session[self._key(story_id)]
+        game_state['current_state'] = current_state
+        game_state['visited'] += new_visited
+        request.session.modified = True # Importante para que Django guarde los cambios en la sesión
+
+    async def aload(self, request, story_id):
+        return self._loaded(await request.session.aget(self._key(story_id)))
+
+    async def asave(self, request, story_id, current_state, visited, story_version):
+        await request.session.aset(self._key(story_id), {
+            'current_state': current_state,
+            'visited': visited,
+            'story_version': story_version,
+        })
+
+    async def aupdate(self, request, story_id, current_state, new_visited):
+        game_state = await request.session.aget(self._key(story_id))
+        game_state['current_state'] = current_state
+        game_state['visited'] += new_visited
+        request.session.modified = True
+
+
+class SignedCookieGameStateStore(GameStateStore):
+    """
+    Guarda la partida en una cookie firmada (una por historia), sin tocar la
+    base de datos. Las escrituras se acumulan en la petición y `commit` pone
+    las cookies.
+
+    Opciones: COOKIE_NAME, SALT, MAX_AGE (segundos).
+    """
+
+    # Un WebSocket no puede escribir cookies: el progreso se perdería
+    supports_websocket = False
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.cookie_name = options.get('COOKIE_NAME', 'game_state')
+        self.salt = options.get('SALT', 'game.state_store')
+        self.max_age = options.get('MAX_AGE', 60 * 60 * 24 * 30)
+
+    def _cookie_name(self, story_id):
+        # ':' no es válido en el nombre de una cookie
+        return self.cookie_name + self.slot(story_id, separator='_')
+
+    def load(self, request, story_id):
+        pending = getattr(request, '_game_state_pending', {})
+        cookie_name = self._cookie_name(story_id)
+        if cookie_name in pending:
+            return pending[cookie_name]
+        value = request.COOKIES.get(cookie_name)
+        if not value:
+            return None
+        try:
+            game_state = signing.loads(value, salt=self.salt, max_age=self.max_age)
+            if len(game_state) == 2:
+                # Cookies anteriores a la codificación compacta: lista de nombres
+                return game_state[0], game_state[1], None
+            current_state, visited, story_version = game_state
+        except (signing.BadSignature, ValueError, TypeError):
+            return None
+        return current_state, visited, story_version
+
+    def save(self, request, story_id, current_state, visited, story_version):
+        if not hasattr(request, '_game_state_pending'):
+            request._game_state_pending = {}
+        request._game_state_pending[self._cookie_name(story_id)] = (current_state, visited, story_version)
+
+    def update(self, request, story_id, current_state, new_visited):
+        _, visited, story_version = self.load(request, story_id)
+        self.save(request, story_id, current_state, visited + new_visited, story_version)
+
+    # Solo lee cookies de la petición: no hay E/S que esperar
+    async def aload(self, request, story_id):
+        return self.load(request, story_id)
+
+    async def asave(self, request, story_id, current_state, visited, story_version):
+        self.save(request, story_id, current_state, visited, story_version)
+
+    async def aupdate(self, request, story_id, current_state, new_visited):
+        self.update(request, story_id, current_state, new_visited)
+
+    def commit(self, request, response):
+        for cookie_name, game_state in getattr(request, '_game_state_pending', {}).items():
+            response.set_cookie(
+                cookie_name,
+                signing.dumps(list(game_state), salt=self.salt, compress=True),
+                max_age=self.max_age,
+                httponly=True,
+                samesite='Lax',
+            )
+
+
+class LocMemGameStateStore(GameStateStore):
+    """
+    Almacén en memoria del proceso, con expulsión LRU. Es el más rápido, pero
+    cada worker tiene el suyo: solo sirve con un único proceso o con afinidad
+    de sesión en el balanceador.
+
+    Opciones: MAX_ENTRIES.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.max_entries = options.get('MAX_ENTRIES', 10000)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, request, story_id):
+        return self._load(self.player_key(request, story_id))
+
+    def save(self, request, story_id, current_state, visited, story_version):
+        self._save(self.player_key(request, story_id), current_state, visited, story_version)
+
+    def update(self, request, story_id, current_state, new_visited):
+        self._update(self.player_key(request, story_id), current_state, new_visited)
+
+    # Las operaciones son en memoria: en async solo hace falta resolver la clave
+    async def aload(self, request, story_id):
+        return self._load(await self.aplayer_key(request, story_id))
+
+    async def asave(self, request, story_id, current_state, visited, story_version):
+        self._save(await self.aplayer_key(request, story_id), current_state, visited, story_version)
+
+    async def aupdate(self, request, story_id, current_state, new_visited):
+        self._update(await self.aplayer_key(request, story_id), current_state, new_visited)
+
+    def _load(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return tuple(entry)
+
+    def _save(self, key, current_state, visited, story_version):
+        with self._lock:
+            self._entries[key] = [current_state, visited, story_version]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _update(self, key, current_state, new_visited):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [current_state, '', None]
+            entry[0] = current_state
+            entry[1] += new_visited
+            self._entries.move_to_end(key)
+
+
+class RedisGameStateStore(GameStateStore):
+    """
+    Almacén en Redis (o cualquier servidor que hable su protocolo). Cada partida
+    (jugador e historia) tiene tres claves: `<prefijo>:<jugador>:cur` con el estado actual,
+    `<prefijo>:<jugador>:seen` con los visitados codificados, a la que solo se
+    le hace APPEND, y `<prefijo>:<jugador>:ver` con la versión de la historia.
+
+    Opciones: LOCATION (URL de Redis, o 'local://' para usar LocalRedis),
+    KEY_PREFIX, TIMEOUT (segundos; None para no expirar).
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.key_prefix = options.get('KEY_PREFIX', 'game')
+        self.timeout = options.get('TIMEOUT', 60 * 60 * 24 * 30)
+        location = options.get('LOCATION', 'redis://localhost:6379/0')
+        if 'CLIENT' in options:
+            self.client, self.async_client = options['CLIENT'], options.get('ASYNC_CLIENT')
+        else:
+            self.client, self.async_client = self._connect(location)
+
+    @staticmethod
+    def _connect(location):
+        """Devuelve (cliente, cliente_async). LocalRedis no necesita cliente async."""
+        if location.startswith('local://'):
+            return LocalRedis(), None
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise ImproperlyConfigured('RedisGameStateStore necesita el paquete "redis" (pip install redis)')
+        return (
+            redis.Redis.from_url(location, decode_responses=True),
+            redis.asyncio.Redis.from_url(location, decode_responses=True),
+        )
+
+    def _keys(self, player_key):
+        base = f'{self.key_prefix}:{player_key}'
+        return f'{base}:cur', f'{base}:seen', f'{base}:ver'
+
+    # Cada operación encola sus comandos en un pipeline; el mismo código
+    # sirve para el cliente síncrono y el asíncrono (solo cambia execute()).
+
+    def _queue_load(self, pipe, player_key):
+        for key in self._keys(player_key):
+            pipe.get(key)
+
+    def _queue_save(self, pipe, player_key, current_state, visited, story_version):
+        cur_key, visited_key, version_key = self._keys(player_key)
+        pipe.set(visited_key, visited)
+        pipe.set(version_key, story_version or '')
+        pipe.set(cur_key, current_state)
+        self._queue_expire(pipe, cur_key, visited_key, version_key)
+
+    def _queue_update(self, pipe, player_key, current_state, new_visited):
+        cur_key, visited_key, version_key = self._keys(player_key)
+        if new_visited:
+            pipe.append(visited_key, new_visited)
+        pipe.set(cur_key, current_state)
+        self._queue_expire(pipe, cur_key, visited_key, version_key)
+
+    def _queue_expire(self, pipe, *keys):
+        if self.timeout is not None:
+            for key in keys:
+                pipe.expire(key, self.timeout)
+
+    @staticmethod
+    def _loaded(results):
+        current_state, visited, story_version = results
+        if current_state is None:
+            return None
+        return current_state, visited or '', story_version or None
+
+    def load(self, request, story_id):
+        pipe = self.client.pipeline()
+        self._queue_load(pipe, self.player_key(request, story_id))
+        return self._loaded(pipe.execute())
+
+    def save(self, request, story_id, current_state, visited, story_version):
+        pipe = self.client.pipeline()
+        self._queue_save(pipe, self.player_key(request, story_id), current_state, visited, story_version)
+        pipe.execute()
+
+    def update(self, request, story_id, current_state, new_visited):
+        pipe = self.client.pipeline()
+        self._queue_update(pipe, self.player_key(request, story_id), current_state, new_visited)
+        pipe.execute()
+
+    async def _aexecute(self, queue, *args):
+        if self.async_client is None:
+            # LocalRedis vive en el proceso: ejecutarlo directamente no bloquea
+            pipe = self.client.pipeline()
+            queue(pipe, *args)
+            return pipe.execute()
+        pipe = self.async_client.pipeline()
+        queue(pipe, *args)
+        return await pipe.execute()
+
+    async def aload(self, request, story_id):
+        player_key = await self.aplayer_key(request, story_id)
+        return self._loaded(await self._aexecute(self._queue_load, player_key))
+
+    async def asave(self, request, story_id, current_state, visited, story_version):
+        player_key = await self.aplayer_key(request, story_id)
+        await self._aexecute(self._queue_save, player_key, current_state, visited, story_version)
+
+    async def aupdate(self, request, story_id, current_state, new_visited):
+        player_key = await self.aplayer_key(request, story_id)
+        await self._aexecute(self._queue_update, player_key, current_state, new_visited)
+
+
+class LocalRedis:
+    """
+    Sustituto en proceso de un servidor Redis, con el subconjunto de la API de
+    redis-py que usa RedisGameStateStore (get/set/append/delete/expire y
+    pipelines). Pensado para desarrollo y pruebas sin un servidor real; no
+    implementa la expiración.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = str(value)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def append(self, key, value):
+        with self._lock:
+            self._data[key] = self._data.get(key, '') + str(value)
+            return len(self._data[key])
+
+    def expire(self, key, seconds):
+        return key in self._data
+
+    def pipeline(self):
+        return _LocalPipeline(self)
+
+
+class _LocalPipeline:
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args):
+            self._calls.append((method, args))
+            return self
+        return queue
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        return [method(*args) for method, args in calls]
+
+
+class InstrumentedGameStateStore:
+    """Envuelve un almacén y mide sus lecturas y escrituras (ver game/metrics.py)."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def load(self, request, story_id):
+        with timed('store_load'):
+            return self.store.load(request, story_id)
+
+    def save(self, request, story_id, current_state, visited, story_version):
+        with timed('store_save'):
+            self.store.save(request, story_id, current_state, visited, story_version)
+
+    def update(self, request, story_id, current_state, new_visited):
+        with timed('store_save'):
+            self.store.update(request, story_id, current_state, new_visited)
+
+    async def aload(self, request, story_id):
+        with timed('store_load'):
+            return await self.store.aload(request, story_id)
+
+    async def asave(self, request, story_id, current_state, visited, story_version):
+        with timed('store_save'):
+            await self.store.asave(request, story_id, current_state, visited, story_version)
+
+    async def aupdate(self, request, story_id, current_state, new_visited):
+        with timed('store_save'):
+            await self.store.aupdate(request, story_id, current_state, new_visited)
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    """Almacén configurado en settings.GAME_STATE_STORE (por defecto, la sesión)."""
+    config = getattr(settings, 'GAME_STATE_STORE', {})
+    backend = import_string(config.get('BACKEND', 'game.state_store.SessionGameStateStore'))
+    store = backend(**config.get('OPTIONS', {}))
+    if metrics_enabled():
+        store = InstrumentedGameStateStore(store)
+    return store
+
+
+class GameStateMiddleware:
+    """Da a los almacenes la oportunidad de escribir en la respuesta (p. ej. cookies)."""
+
+    # Compatible con WSGI y ASGI: bajo ASGI no fuerza un salto a un hilo
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        get_store().commit(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        get_store().commit(request, response)
+        return response
@@ -0,0 +1,389 @@
+# game/stories.py
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+
+from .analysis import analyze_story, problems
+from .engine import AFDNarrativo, GramaticaNarrativa, compile_transition_table
+from .exploration import explore_story
+from .layout import compute_layout
+
+try:
+    import yaml
+except ImportError:  # PyYAML es opcional: solo hace falta para historias .yaml
+    yaml = None
+
+
+# Versión del formato compilado. Cambiarla invalida las cachés en disco.
+COMPILED_FORMAT_VERSION = 6
+
+STORY_EXTENSIONS = ('.json', '.yaml', '.yml')
+STORY_ID_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+logger = logging.getLogger(__name__)
+
+
+class StoryError(Exception):
+    """Error al cargar o compilar una historia."""
+
+
+class StoryNotFound(StoryError):
+    """No existe un archivo de historia con ese identificador."""
+
+
+class Historia:
+    """Historia cargada: grafo (AFD) y gramática, identificada por id y versión."""
+
+    def __init__(self, story_id, version, title, afd, gramatica, layout=None):
+        self.id = story_id
+        self.version = version
+        self.title = title
+        self.afd = afd
+        self.gramatica = gramatica
+        # Disposición precalculada del diagrama del AFD (ver game/layout.py)
+        self.layout = layout
+        self._derived = {}
+
+    def cached(self, key, factory):
+        """Valor derivado de la historia (`factory(historia)`), calculado una vez por versión."""
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = factory(self)
+            return value
+
+
+def default_story_id():
+    return getattr(settings, 'GAME_DEFAULT_STORY', 'omega7')
+
+
+def stories_dir():
+    return Path(getattr(settings, 'GAME_STORIES_DIR', Path(__file__).resolve().parent / 'stories'))
+
+
+def cache_dir():
+    return Path(getattr(settings, 'GAME_STORY_CACHE_DIR', Path(settings.BASE_DIR) / '.story_cache'))
+
+
+def find_story_file(story_id):
+    if not STORY_ID_RE.match(story_id or ''):
+        raise StoryNotFound(f'Identificador de historia no válido: {story_id!r}')
+    for extension in STORY_EXTENSIONS:
+        path = stories_dir() / f'{story_id}{extension}'
+        if path.is_file():
+            return path
+    raise StoryNotFound(f'No existe la historia {story_id!r} en {stories_dir()}')
+
+
+def _parse(path, raw):
+    if path.suffix == '.json':
+        return json.loads(raw.decode('utf-8'))
+    if yaml is None:
+        raise StoryError(f'Hace falta PyYAML para cargar {path.name}')
+    return yaml.safe_load(raw)
+
+
+def compile_story(data):
+    """
+    Normaliza los datos de una historia a la forma que consume el motor.
+    El resultado es lo que se guarda (ver `_dump_compiled`) en la caché en disco,
+    incluido el análisis estático del grafo (ver game/analysis.py y
+    game/exploration.py).
+    """
+    states = {}
+    for name, details in data['states'].items():
+        states[name] = {
+            'description': details.get('description', ''),
+            'transitions': dict(details.get('transitions') or {}),
+            'isFinal': bool(details.get('isFinal', False)),
+            'finalType': details.get('finalType', ''),
+        }
+
+    initial_state = data.get('initial_state', 'inicio')
+    if initial_state not in states:
+        raise StoryError(f'El estado inicial {initial_state!r} no existe en la historia')
+
+    table = compile_transition_table(states)
+    analysis = analyze_story(states, initial_state)
+    # Partidas distintas y juego al azar, sobre el AFD ya construido
+    analysis['exploration'] = explore_story(AFDNarrativo(states, initial_state, table, analysis))
+
+    grammar = data.get('grammar') or {}
+    rules = grammar.get('rules') or {}
+    for symbol, productions in rules.items():
+        if not productions:
+            # Al generar texto no habría ninguna producción que elegir
+            raise StoryError(f'La regla {symbol!r} de la gramática no tiene producciones')
+    return {
+        'id': data.get('id'),
+        'title': data.get('title', ''),
+        'initial_state': initial_state,
+        'states': states,
+        'table': table,
+        'analysis': analysis,
+        'layout': compute_layout(states, initial_state),
+        'rules': rules,
+        'contextualEnhancements': grammar.get('contextualEnhancements') or {},
+        'action_equivalents': grammar.get('action_equivalents') or {},
+    }
+
+
+def _write_atomic(path, payload):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def layout_path(digest):
+    return cache_dir() / 'layouts' / f'{digest}.json'
+
+
+def _layout_payload(story):
+    """`(hash, JSON en bytes)` de la disposición del diagrama de `story`."""
+    payload = json.dumps(story.layout, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()[:16], payload
+
+
+def publish_layout(story):
+    """
+    Escribe la disposición del diagrama en la caché en disco, con el hash de
+    su contenido en el nombre (así se puede servir como recurso inmutable), y
+    devuelve ese hash, o None si no se pudo escribir.
+    """
+    digest, payload = _layout_payload(story)
+    path = layout_path(digest)
+    if not path.exists():
+        try:
+            _write_atomic(path, payload)
+        except OSError:
+            return None
+    return digest
+
+
+def _compiled_path(story_id, version):
+    return cache_dir() / f'{story_id}-{version}.compiled'
+
+
+def _dump_compiled(compiled):
+    """
+    Forma compilada en bytes: una línea de JSON con todo salvo la tabla de
+    transiciones y los estados finales, que van detrás en binario. Solo
+    datos: a diferencia de pickle, leer la caché en disco no ejecuta código.
+    """
+    table = compiled['table']
+    header = dict(compiled, table={
+        'state_names': table['state_names'],
+        'action_names': table['action_names'],
+        'typecode': table['table'].typecode,
+        'itemsize': table['table'].itemsize,
+        'byteorder': sys.byteorder,
+        'length': len(table['table']),
+    })
+    return b''.join((
+        json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), b'\n',
+        table['table'].tobytes(), table['final'],
+    ))
+
+
+def _load_compiled_bytes(payload):
+    """Inverso de `_dump_compiled`; lanza ValueError si el archivo no encaja."""
+    line, _, binary = payload.partition(b'\n')
+    compiled = json.loads(line)
+    meta = compiled['table']
+    table = array(meta['typecode'])
+    if table.itemsize != meta['itemsize'] or meta['byteorder'] != sys.byteorder:
+        raise ValueError('Caché compilada en otra plataforma')
+    size = meta['length'] * table.itemsize
+    table.frombytes(binary[:size])
+    final = binary[size:]
+    if len(table) != meta['length'] or len(final) != len(meta['state_names']):
+        raise ValueError('Caché compilada incompleta')
+    compiled['table'] = {
+        'state_names': meta['state_names'],
+        'action_names': meta['action_names'],
+        'table': table,
+        'final': final,
+    }
+    return compiled
+
+
+def _prune_compiled(story_id, keep):
+    """Borra las versiones anteriores de la historia (y las cachés .pickle del formato antiguo)."""
+    pattern = re.compile(r'^%s-[0-9a-f]{16}\.(compiled|pickle)$' % re.escape(story_id))
+    try:
+        entries = list(cache_dir().iterdir())
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name != keep.name and (pattern.match(entry.name) or entry.suffix == '.pickle'):
+            try:
+                entry.unlink()
+            except OSError:
+                pass
+
+
+def load_compiled(story_id):
+    """
+    Devuelve `(version, compiled)` para la historia `story_id`.
+
+    La versión es un hash del contenido del archivo. La forma compilada se
+    guarda en disco con ese hash en el nombre, así que el primer worker que
+    carga una versión la compila y el resto solo la lee. Al compilar una
+    versión nueva se borran las anteriores de la misma historia.
+    """
+    path = find_story_file(story_id)
+    raw = path.read_bytes()
+    version = hashlib.sha256(b'%d:' % COMPILED_FORMAT_VERSION + raw).hexdigest()[:16]
+    cached = _compiled_path(story_id, version)
+
+    try:
+        return version, _load_compiled_bytes(cached.read_bytes())
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, TypeError):
+        logger.warning('Caché compilada no válida, se vuelve a compilar: %s', cached)
+
+    compiled = compile_story(_parse(path, raw))
+    try:
+        _write_atomic(cached, _dump_compiled(compiled))
+    except OSError:
+        # Sin permisos de escritura: se sigue funcionando sin caché en disco
+        pass
+    else:
+        _prune_compiled(story_id, cached)
+    return version, compiled
+
+
+def build_story(story_id):
+    version, compiled = load_compiled(story_id)
+    analysis = compiled['analysis']
+    if not analysis['verified']:
+        found = problems(analysis)
+        logger.warning('La historia %r (versión %s) tiene %d problemas; ejecuta '
+                       '`manage.py analyze_story %s` para verlos.', story_id, version, len(found), story_id)
+    afd = AFDNarrativo(
+        compiled['states'], compiled['initial_state'], compiled['table'], analysis, version, story_id,
+    )
+    gramatica = GramaticaNarrativa(
+        compiled['rules'],
+        compiled['contextualEnhancements'],
+        compiled['action_equivalents'],
+        seed=getattr(settings, 'GAME_GRAMMAR_SEED', None),
+        actions=afd.action_names,
+    )
+    story = Historia(story_id, version, compiled['title'], afd, gramatica, compiled['layout'])
+    if story.layout is not None:
+        # Cada worker que carga la historia publica la disposición: la URL que
+        # da afd_info puede llegar a cualquier otro worker
+        story.cached('layout_digest', publish_layout)
+    return story
+
+
+# Historias ya cargadas en este proceso, de la menos a la más usada
+# recientemente: story_id -> (Historia, mtime, última comprobación).
+# Se guardan como mucho GAME_STORY_CACHE_SIZE; al pasarse se descarta la
+# menos usada (se volverá a cargar desde la caché en disco si se pide).
+_loaded = OrderedDict()
+_lock = threading.Lock()
+# Serializa las cargas para que dos peticiones no compilen la misma historia
+_build_lock = threading.Lock()
+
+
+def _fresh(checked_at, now):
+    interval = getattr(settings, 'GAME_STORY_RELOAD_INTERVAL', 5)
+    return interval is None or now - checked_at < interval
+
+
+def peek_story(story_id=None):
+    """
+    La historia `story_id` si ya está cargada y no toca comprobar su archivo;
+    si no, None. No hace E/S: las vistas asíncronas la usan antes de llamar
+    a `get_story` en un hilo.
+    """
+    story_id = story_id or default_story_id()
+    with _lock:
+        entry = _loaded.get(story_id)
+        if entry is None:
+            return None
+        _loaded.move_to_end(story_id)
+    story, _, checked_at = entry
+    return story if _fresh(checked_at, time.monotonic()) else None
+
+
+def get_story(story_id=None):
+    """
+    Devuelve la historia `story_id` (o la historia por defecto), cargándola la
+    primera vez que se pide. Cada GAME_STORY_RELOAD_INTERVAL segundos se
+    comprueba si el archivo cambió, para no necesitar un despliegue.
+    """
+    story_id = story_id or default_story_id()
+    now = time.monotonic()
+    with _lock:
+        entry = _loaded.get(story_id)
+        if entry is not None:
+            _loaded.move_to_end(story_id)
+    if entry is not None:
+        story, mtime, checked_at = entry
+        if _fresh(checked_at, now):
+            return story
+        if find_story_file(story_id).stat().st_mtime_ns == mtime:
+            with _lock:
+                _loaded[story_id] = (story, mtime, now)
+            return story
+
+    with _build_lock:
+        mtime = find_story_file(story_id).stat().st_mtime_ns
+        entry = _loaded.get(story_id)
+        if entry is not None and entry[1] == mtime:
+            return entry[0]
+        story = build_story(story_id)
+        with _lock:
+            _loaded[story_id] = (story, mtime, now)
+            _loaded.move_to_end(story_id)
+            while len(_loaded) > getattr(settings, 'GAME_STORY_CACHE_SIZE', 32):
+                _loaded.popitem(last=False)
+        return story
+
+
+def find_layout(digest):
+    """
+    JSON de la disposición `digest` desde las historias cargadas en este
+    proceso (y se vuelve a escribir en disco), o None si no es de ninguna.
+    Para cuando falta el archivo: caché en disco borrada o no compartida.
+    """
+    with _lock:
+        stories = [story for story, _, _ in _loaded.values()]
+    for story in stories:
+        if story.layout is None:
+            continue
+        story_digest, payload = _layout_payload(story)
+        if story_digest == digest:
+            try:
+                _write_atomic(layout_path(digest), payload)
+            except OSError:
+                pass
+            return payload
+    return None
+
+
+def clear_loaded_stories():
+    with _lock:
+        _loaded.clear()
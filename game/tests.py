@@ -1,3 +1,1306 @@
-from django.test import TestCase
+import gzip
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import CommandError, call_command
+from django.http import Http404
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.templatetags.static import static
+from django.urls import include, path, re_path, reverse
+
+from . import assets, async_views, events, exploration, funnel, responses, stories, views
+from .analysis import analyze_story, problems
+from .codec import decode_ids, encode_ids
+from .engine import AFDNarrativo, GramaticaNarrativa
+from .exploration import count_playthroughs, explore_story, random_play
+from .matching import IndiceDifuso, IndicePrefijos, IndiceSinonimos, edit_distance, fold_accents
+from .models import PlaythroughEvent
+from .state_store import get_store
+from .stories import StoryError, clear_loaded_stories, compile_story, find_story_file, get_story, layout_path, load_compiled, publish_layout
+from .websocket import GameConnection
+
+
+# URLconf con las vistas asíncronas (game/urls.py las elige con GAME_ASYNC_VIEWS
+# al importarse), para AsyncViewsTests
+_async_story_urlpatterns = [
+    path('state/', async_views.get_game_state, name='get_game_state'),
+    path('process_choice/', async_views.process_choice, name='process_choice'),
+    path('process_batch/', async_views.process_batch, name='process_batch'),
+    path('reset/', async_views.reset_game_view, name='reset_game'),
+    path('afd_info/', async_views.get_afd_info, name='get_afd_info'),
+    path('afd_info/current/', async_views.get_afd_current, name='get_afd_current'),
+    path('suggest/', async_views.suggest_actions, name='suggest_actions'),
+]
+urlpatterns = [
+    path('game/', include(_async_story_urlpatterns)),
+    path('game/stories/<slug:story_id>/', include(_async_story_urlpatterns)),
+    re_path(r'^game/layout/(?P<digest>[0-9a-f]{16})\.json$', views.get_afd_layout, name='get_afd_layout'),
+]
+
+
+class IndiceSinonimosTests(SimpleTestCase):
+    def setUp(self):
+        self.indice = IndiceSinonimos({
+            'buscar_salida': ['buscar salida', 'huir'],
+            'salida_emergencia': ['salida de emergencia'],
+            'medico': ['medico', 'ir al medico'],
+        })
+
+    def test_find_returns_every_phrase_in_the_input(self):
+        self.assertEqual(self.indice.find('quiero huir por la salida de emergencia'.split()),
+                         {'buscar_salida', 'salida_emergencia'})
+
+    def test_phrases_must_be_complete_words(self):
+        self.assertEqual(self.indice.find('buscar la salida'.split()), set())
+        self.assertEqual(self.indice.find(['medicos']), set())
+
+    def test_overlapping_phrases_use_failure_links(self):
+        # "ir al ir al medico": el primer "ir al" no termina en frase
+        self.assertEqual(self.indice.find('ir al ir al medico'.split()), {'medico'})
+
+    def test_match_follows_available_order(self):
+        words = 'huir por la salida de emergencia'.split()
+        self.assertEqual(self.indice.match(words, ['salida_emergencia', 'buscar_salida']), 'salida_emergencia')
+        self.assertEqual(self.indice.match(words, ['buscar_salida']), 'buscar_salida')
+        self.assertIsNone(self.indice.match(words, ['medico']))
+
+
+class MatchInputTests(SimpleTestCase):
+    """Niveles de `GramaticaNarrativa.match_input` sobre la historia omega7."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        story = get_story('omega7')
+        cls.gramatica = story.gramatica
+        cls.available = {
+            state: list(story.afd.get_transitions_from_state(state))
+            for state in ('inicio', 'sala_control', 'sector_laboratorio')
+        }
+
+    def assertMatches(self, state, user_input, expected):
+        self.assertEqual(self.gramatica.match_input(user_input, self.available[state]), expected, user_input)
+
+    def test_exact(self):
+        self.assertMatches('inicio', 'investigar_nave', ('exact', 'investigar_nave'))
+        self.assertMatches('sala_control', '  Laboratorio ', ('exact', 'laboratorio'))
+        self.assertMatches('sector_laboratorio', 'examinar_muestra', ('exact', 'examinar_muestra'))
+
+    def test_synonym(self):
+        self.assertMatches('inicio', 'Investigar Nave', ('synonym', 'investigar_nave'))
+        self.assertMatches('inicio', 'quiero huir de aqui', ('synonym', 'buscar_salida'))
+        self.assertMatches('inicio', 'escapar', ('synonym', 'buscar_salida'))
+        self.assertMatches('sala_control', 'al laboratorio ahora', ('synonym', 'laboratorio'))
+        self.assertMatches('sector_laboratorio', 'examinar muestra', ('synonym', 'examinar_muestra'))
+
+    def test_keyword(self):
+        self.assertMatches('inicio', 'buscar una salida', ('keyword', 'buscar_salida'))
+        self.assertMatches('sala_control', 'revisar los datos', ('keyword', 'revisar_datos'))
+        self.assertMatches('sector_laboratorio', 'examinar la muestra', ('keyword', 'examinar_muestra'))
+
+    def test_accents_are_folded(self):
+        self.assertEqual(fold_accents('médico ñandú'), 'medico nandu')
+        self.assertMatches('sala_control', 'médico', ('exact', 'medico'))
+        self.assertMatches('sala_control', 'ir al médico', ('synonym', 'medico'))
+        self.assertMatches('sala_control', 'IR AL MEDICO', ('synonym', 'medico'))
+
+    def test_fuzzy(self):
+        self.assertMatches('sala_control', 'labratorio', ('fuzzy', 'laboratorio'))
+        self.assertMatches('sala_control', 'ir al medco', ('fuzzy', 'medico'))
+        self.assertMatches('sector_laboratorio', 'examniar muestra', ('fuzzy', 'examinar_muestra'))
+        self.assertMatches('sector_laboratorio', 'exminar muestr', ('fuzzy', 'examinar_muestra'))
+        # Las palabras cortas no se corrigen
+        self.assertMatches('sala_control', 'lab', (None, None))
+
+    def test_exact_and_synonym_beat_fuzzy(self):
+        # Corregida, "revsar datos" sería revisar_datos, que va antes en las disponibles
+        available = ['revisar_datos', 'laboratorio']
+        match = self.gramatica.match_input
+        self.assertEqual(match('revsar datos', available), ('fuzzy', 'revisar_datos'))
+        self.assertEqual(match('al laboratorio y revsar datos', available), ('synonym', 'laboratorio'))
+        self.assertEqual(match('laboratorio', available), ('exact', 'laboratorio'))
+
+    def test_unavailable_or_unknown_actions_are_rejected(self):
+        self.assertMatches('inicio', 'ir al médico', (None, None))
+        self.assertMatches('inicio', 'laboratorio', (None, None))
+        self.assertMatches('sala_control', 'escapar', (None, None))
+        self.assertMatches('inicio', 'bailar', (None, None))
+        self.assertMatches('inicio', '', (None, None))
+        self.assertMatches('sector_laboratorio', 'examinar', (None, None))
+
+
+class GramaticaPoolTests(SimpleTestCase):
+    """Textos generados desde el pool precompilado de la GLC."""
+
+    rules = {
+        'S': [['A', 'fin'], ['c']],
+        'A': [['a'], ['b'], ['b']],
+    }
+
+    def test_pool_follows_the_exact_weights(self):
+        gramatica = GramaticaNarrativa(self.rules, seed=1)
+        pool, _ = gramatica._build_pool('S')
+        # c: 1/2; "b fin": 1/2 · 2/3; "a fin": 1/2 · 1/3
+        self.assertEqual(Counter(pool), {'c': 3, 'b fin': 2, 'a fin': 1})
+        # Cada vuelta al pool da cada frase exactamente en su proporción
+        self.assertEqual(Counter(gramatica.generate_text() for _ in range(12)), {'c': 6, 'b fin': 4, 'a fin': 2})
+
+    def test_seed_and_reseed_repeat_the_sequence(self):
+        first = GramaticaNarrativa(self.rules, seed=7)
+        texts = [first.generate_text() for _ in range(20)]
+        second = GramaticaNarrativa(self.rules, seed=7)
+        self.assertEqual([second.generate_text() for _ in range(20)], texts)
+        first.reseed(7)
+        self.assertEqual([first.generate_text() for _ in range(20)], texts)
+
+    def test_recursive_grammars_are_sampled(self):
+        gramatica = GramaticaNarrativa({'S': [['x'], ['S', 'x']]}, seed=1)
+        pool, _ = gramatica._build_pool('S')
+        self.assertEqual(len(pool), GramaticaNarrativa.POOL_SAMPLE_SIZE)
+        self.assertTrue(all(set(text.split()) == {'x'} for text in pool))
+
+    def test_grammars_over_the_limit_are_sampled(self):
+        gramatica = GramaticaNarrativa(self.rules, seed=1)
+        gramatica.POOL_LIMIT = 2
+        pool, _ = gramatica._build_pool('S')
+        self.assertEqual(len(pool), GramaticaNarrativa.POOL_SAMPLE_SIZE)
+        self.assertEqual(set(pool), {'c', 'a fin', 'b fin'})
+
+    def test_unknown_symbol_is_returned_as_is(self):
+        self.assertEqual(GramaticaNarrativa(self.rules).generate_text('Z'), 'Z')
+
+    def test_empty_rules_are_rejected_when_compiling(self):
+        data = json.loads(find_story_file('omega7').read_text(encoding='utf-8'))
+        data['grammar'] = dict(data['grammar'], rules=dict(data['grammar']['rules'], S=[]))
+        with self.assertRaisesMessage(StoryError, "'S'"):
+            compile_story(data)
+
+
+def _reference_distance(a, b):
+    """Damerau-Levenshtein restringida con la matriz completa."""
+    d = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+
+class IndicePrefijosTests(SimpleTestCase):
+    """Trie de autocompletado (game/matching.py)."""
+
+    def setUp(self):
+        self.index = IndicePrefijos([
+            ('investigar nave', 'investigar_nave'),
+            ('ir al laboratorio', 'laboratorio'),
+            ('laboratorio', 'laboratorio'),
+            ('Laboratorio', 'laboratorio'),
+            ('nave espacial', 'huir'),
+            ('Nadar rápido', 'nadar'),
+        ])
+        self.all = ['investigar_nave', 'laboratorio', 'huir', 'nadar']
+
+    def completions(self, prefix, available=None):
+        return [text for text, _ in self.index.completions(prefix, self.all if available is None else available)]
+
+    def test_phrase_starts_before_word_starts(self):
+        self.assertEqual(self.completions('nav'), ['nave espacial', 'investigar nave'])
+        # Entre las que empiezan igual, primero las más cortas; sin repetidas
+        self.assertEqual(self.completions('la'), ['laboratorio', 'ir al laboratorio'])
+        self.assertEqual(self.completions('  NA'), ['Nadar rápido', 'nave espacial', 'investigar nave'])
+        self.assertEqual(self.completions('nadar rapido'), ['Nadar rápido'])
+
+    def test_only_available_transitions(self):
+        self.assertEqual(self.completions('nav', ['investigar_nave']), ['investigar nave'])
+        self.assertEqual(self.completions('la', ['huir']), [])
+
+    def test_nothing_to_complete(self):
+        for prefix in ('', '   ', 'x', 'nave espacial y mas', 'n' * (IndicePrefijos.MAX_PREFIX + 1)):
+            self.assertEqual(self.completions(prefix), [], prefix)
+
+
+class EditDistanceTests(SimpleTestCase):
+    def test_transposition_counts_as_one_error(self):
+        self.assertEqual(edit_distance('examinar', 'exaimnar', 2), 1)
+        self.assertEqual(edit_distance('abcd', 'bacd', 2), 1)
+        # Restringida: no se edita dos veces la misma subcadena
+        self.assertEqual(edit_distance('ca', 'abc', 3), 3)
+
+    def test_band_cut_off(self):
+        self.assertEqual(edit_distance('kitten', 'sitting', 3), 3)
+        self.assertEqual(edit_distance('kitten', 'sitting', 2), 3)
+        self.assertEqual(edit_distance('kitten', 'sitting', 1), 2)
+        # Diferencia de longitud mayor que el límite: ni se calcula
+        self.assertEqual(edit_distance('abc', 'abcdef', 2), 3)
+        self.assertEqual(edit_distance('', 'abc', 3), 3)
+
+    def test_matches_full_matrix(self):
+        rng = random.Random(17)
+        for _ in range(2000):
+            a = ''.join(rng.choice('abc') for _ in range(rng.randrange(8)))
+            b = ''.join(rng.choice('abc') for _ in range(rng.randrange(8)))
+            limit = rng.randrange(4)
+            self.assertEqual(edit_distance(a, b, limit), min(_reference_distance(a, b), limit + 1), (a, b, limit))
+
+
+class IndiceDifusoTests(SimpleTestCase):
+    def setUp(self):
+        self.indice = IndiceDifuso(['laboratorio', 'examinar', 'muestra', 'medico', 'bodega', 'al', 'ir'])
+
+    def test_distance_for(self):
+        self.assertEqual([IndiceDifuso.distance_for(word) for word in ('ir', 'lab', 'muestra', 'examinar')], [0, 0, 1, 2])
+
+    def test_symmetric_delete_lookup(self):
+        self.assertEqual(self.indice.correct_word('labratorio'), 'laboratorio')
+        self.assertEqual(self.indice.correct_word('laboratroio'), 'laboratorio')
+        self.assertEqual(self.indice.correct('examniar muestra'.split()), ['examinar', 'muestra'])
+        self.assertEqual(self.indice.correct_word('mdico'), 'medico')
+
+    def test_too_far_or_too_short_is_unchanged(self):
+        # "muestra" admite un error, no dos
+        self.assertEqual(self.indice.correct_word('mestar'), 'mestar')
+        self.assertEqual(self.indice.correct_word('el'), 'el')
+        self.assertEqual(self.indice.correct_word('xylofono'), 'xylofono')
+
+
+class TemporaryStoriesMixin:
+    """
+    Historias y caché en disco en un directorio temporal: cada prueba escribe
+    las suyas (copias de omega7) con `write_story`.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.data = json.loads(find_story_file('omega7').read_text(encoding='utf-8'))
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.stories = self.directory / 'stories'
+        self.stories.mkdir()
+        self.cache = self.directory / 'cache'
+        settings = override_settings(GAME_STORIES_DIR=self.stories, GAME_STORY_CACHE_DIR=self.cache)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        clear_loaded_stories()
+        self.addCleanup(clear_loaded_stories)
+
+    def write_story(self, story_id, title, **changes):
+        data = dict(self.data, title=title, **changes)
+        (self.stories / f'{story_id}.json').write_text(json.dumps(data), encoding='utf-8')
+
+
+class CompiledCacheTests(TemporaryStoriesMixin, SimpleTestCase):
+    """Caché en disco de las historias compiladas (game/stories.py)."""
+
+    def test_round_trip_without_pickle(self):
+        self.write_story('prueba', 'Uno')
+        version, compiled = load_compiled('prueba')
+        cached = self.cache / f'prueba-{version}.compiled'
+        self.assertTrue(cached.is_file())
+        # Una línea de JSON y después binario: nada que deserializar como objetos
+        json.loads(cached.read_bytes().partition(b'\n')[0])
+        self.assertEqual(load_compiled('prueba'), (version, compiled))
+
+    def test_corrupt_cache_is_recompiled(self):
+        self.write_story('prueba', 'Uno')
+        version, compiled = load_compiled('prueba')
+        cached = self.cache / f'prueba-{version}.compiled'
+        cached.write_bytes(cached.read_bytes()[:-3])
+        with self.assertLogs('game.stories', 'WARNING'):
+            self.assertEqual(load_compiled('prueba'), (version, compiled))
+
+    def test_old_versions_are_pruned(self):
+        self.write_story('prueba', 'Uno')
+        self.write_story('prueba-2', 'Otra historia')
+        load_compiled('prueba-2')
+        old_version, _ = load_compiled('prueba')
+        (self.cache / 'prueba-0123456789abcdef.pickle').write_bytes(b'')
+        self.write_story('prueba', 'Dos')
+        new_version, _ = load_compiled('prueba')
+        names = sorted(path.name for path in self.cache.iterdir() if path.is_file())
+        self.assertNotEqual(old_version, new_version)
+        self.assertIn(f'prueba-{new_version}.compiled', names)
+        self.assertNotIn(f'prueba-{old_version}.compiled', names)
+        self.assertFalse(any(name.endswith('.pickle') for name in names))
+        # Las de otras historias con el mismo prefijo no se tocan
+        self.assertEqual(len([name for name in names if name.startswith('prueba-2-')]), 1)
+
+    def test_grammar_seed_setting(self):
+        self.write_story('prueba', 'Uno')
+        with self.settings(GAME_GRAMMAR_SEED=3):
+            texts = [get_story('prueba').gramatica.generate_text() for _ in range(10)]
+            clear_loaded_stories()
+            self.assertEqual([get_story('prueba').gramatica.generate_text() for _ in range(10)], texts)
+
+    def test_layout_is_published_when_the_story_loads(self):
+        self.write_story('prueba', 'Uno')
+        story = get_story('prueba')
+        digest = story.cached('layout_digest', publish_layout)
+        path = layout_path(digest)
+        self.assertTrue(path.is_file())
+        url = reverse('get_afd_layout', kwargs={'digest': digest})
+        content = b''.join(self.client.get(url).streaming_content)
+        self.assertEqual(json.loads(content), story.layout)
+
+        # Sin el archivo (otro disco, caché borrada) se rehace desde la historia cargada
+        path.unlink()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, content)
+        self.assertTrue(path.is_file())
+        self.assertEqual(self.client.get(reverse('get_afd_layout', kwargs={'digest': '0' * 16})).status_code, 404)
+
+
+@override_settings(GAME_EVENT_LOG_FLUSH_INTERVAL=None, GAME_FUNNEL_FLUSH_INTERVAL=None)
+class GameTestCase(TestCase):
+    """
+    Pruebas que juegan partidas: sin hilos de volcado (escribirían en la base
+    de datos de pruebas desde otro hilo); los eventos y el embudo pendientes
+    se vuelcan al terminar cada prueba.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(funnel.flush)
+        self.addCleanup(events.flush)
+
+
+class AfdInfoTests(TemporaryStoriesMixin, GameTestCase):
+    """Grafo de la historia con ETag (afd_info) y estado del jugador (afd_info/current)."""
+
+    def url(self, name, story_id='prueba'):
+        return reverse(name, kwargs={'story_id': story_id})
+
+    def test_if_none_match_gets_304(self):
+        self.write_story('prueba', 'Uno')
+        response = self.client.get(self.url('get_afd_info'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{get_story("prueba").version}"')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.client.get(self.url('get_afd_info'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_changes_with_the_story_version(self):
+        self.write_story('prueba', 'Uno')
+        etag = self.client.get(self.url('get_afd_info'))['ETag']
+        self.write_story('prueba', 'Dos')
+        with self.settings(GAME_STORY_RELOAD_INTERVAL=0):
+            response = self.client.get(self.url('get_afd_info'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['version'], get_story('prueba').version)
+
+    def test_current_reports_the_cursor(self):
+        self.write_story('prueba', 'Uno')
+        self.assertEqual(self.client.get(self.url('get_afd_current')).json(),
+                         {'current_state': 'inicio', 'visited_states': ['inicio']})
+        self.client.post(self.url('process_batch'), {'choices': ['investigar_nave', 'laboratorio']},
+                         content_type='application/json')
+        self.assertEqual(self.client.get(self.url('get_afd_current')).json(), {
+            'current_state': 'sector_laboratorio',
+            'visited_states': ['inicio', 'sala_control', 'sector_laboratorio'],
+        })
+
+
+class StoryRoutingTests(TemporaryStoriesMixin, GameTestCase):
+    """Varias historias: URLs por historia y caché de historias cargadas (game/stories.py)."""
+
+    def state(self, story_id=None):
+        kwargs = {'story_id': story_id} if story_id else {}
+        return self.client.get(reverse('get_game_state', kwargs=kwargs)).json()['current_state']
+
+    def choose(self, choice, story_id=None):
+        kwargs = {'story_id': story_id} if story_id else {}
+        self.client.post(reverse('process_choice', kwargs=kwargs), {'choice': choice}, content_type='application/json')
+
+    def test_each_story_has_its_own_game(self):
+        self.write_story('omega7', 'Por defecto')
+        self.write_story('segunda', 'Segunda')
+        self.choose('investigar_nave')
+        self.assertEqual((self.state(), self.state('segunda')), ('sala_control', 'inicio'))
+        self.choose('buscar salida', 'segunda')
+        self.assertEqual((self.state(), self.state('segunda')), ('sala_control', 'final_escape_prematuro'))
+        # /game/stories/<historia por defecto>/ es la misma partida que /game/
+        self.assertEqual(self.state('omega7'), 'sala_control')
+        self.assertEqual(get_story('segunda').title, 'Segunda')
+
+    def test_unknown_story_is_404(self):
+        self.write_story('omega7', 'Por defecto')
+        self.assertEqual(self.client.get(reverse('get_game_state', kwargs={'story_id': 'no-existe'})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('get_afd_info', kwargs={'story_id': 'no-existe'})).status_code, 404)
+
+    def test_least_recently_used_story_is_evicted(self):
+        for story_id in ('a', 'b', 'c'):
+            self.write_story(story_id, story_id)
+        with self.settings(GAME_STORY_CACHE_SIZE=2):
+            first = get_story('a')
+            get_story('b')
+            get_story('a')
+            get_story('c')
+            self.assertEqual(list(stories._loaded), ['a', 'c'])
+            self.assertIs(get_story('a'), first)
+            self.assertIsNone(stories.peek_story('b'))
+
+    def test_rewritten_story_is_reloaded_after_the_interval(self):
+        self.write_story('prueba', 'Uno')
+        with self.settings(GAME_STORY_RELOAD_INTERVAL=60):
+            story = get_story('prueba')
+            self.write_story('prueba', 'Dos')
+            self.assertIs(get_story('prueba'), story)
+        with self.settings(GAME_STORY_RELOAD_INTERVAL=0):
+            reloaded = get_story('prueba')
+            self.assertEqual(reloaded.title, 'Dos')
+            self.assertNotEqual(reloaded.version, story.version)
+            # Sin cambios en el archivo se sigue usando la misma
+            self.assertIs(get_story('prueba'), reloaded)
+
+
+class StateStoreMixin:
+    """
+    Una partida completa por el cliente de pruebas (acción, reinicio y lote)
+    contra el almacén de GAME_STATE_STORE que define cada subclase.
+    """
+
+    store = None
+
+    def setUp(self):
+        super().setUp()
+        settings = override_settings(GAME_STATE_STORE=self.store)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_store.cache_clear()
+        self.addCleanup(get_store.cache_clear)
+
+    def post(self, name, data=None):
+        response = self.client.post(reverse(name), data or {}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def state(self):
+        return self.client.get(reverse('get_game_state'), {'visited': 'full'}).json()
+
+    def test_choice_reset_and_batch(self):
+        self.assertEqual(self.state()['current_state'], 'inicio')
+
+        data = self.post('process_choice', {'choice': 'investigar nave'})
+        self.assertTrue(data['success'])
+        self.assertEqual(data['current_state'], 'sala_control')
+        state = self.state()
+        self.assertEqual(state['current_state'], 'sala_control')
+        self.assertEqual(state['visited_states'], ['inicio', 'sala_control'])
+
+        data = self.post('process_choice', {'choice': 'bailar'})
+        self.assertFalse(data['success'])
+        self.assertEqual(self.state()['current_state'], 'sala_control')
+
+        self.assertTrue(self.post('reset_game')['success'])
+        state = self.state()
+        self.assertEqual(state['current_state'], 'inicio')
+        self.assertEqual(state['visited_states'], ['inicio'])
+
+        data = self.post('process_batch', {'choices': ['investigar_nave', 'laboratorio', 'retroceder']})
+        self.assertTrue(data['success'])
+        self.assertEqual([step['current_state'] for step in data['steps']],
+                         ['sala_control', 'sector_laboratorio', 'sala_control'])
+        state = self.state()
+        self.assertEqual(state['current_state'], 'sala_control')
+        self.assertEqual(state['visited_states'], ['inicio', 'sala_control', 'sector_laboratorio'])
+
+    def test_players_do_not_share_games(self):
+        self.post('process_choice', {'choice': 'investigar_nave'})
+        self.client = self.client_class()
+        self.assertEqual(self.state()['current_state'], 'inicio')
+
+
+class SessionStateStoreTests(StateStoreMixin, GameTestCase):
+    store = {'BACKEND': 'game.state_store.SessionGameStateStore'}
+
+
+class SignedCookieStateStoreTests(StateStoreMixin, GameTestCase):
+    store = {'BACKEND': 'game.state_store.SignedCookieGameStateStore'}
+
+    def test_tampered_cookie_starts_a_new_game(self):
+        self.post('process_choice', {'choice': 'investigar_nave'})
+        cookie = self.client.cookies['game_state']
+        cookie.set(cookie.key, cookie.value[:-2] + 'xx', cookie.coded_value[:-2] + 'xx')
+        self.assertEqual(self.state()['current_state'], 'inicio')
+
+
+class LocMemStateStoreTests(StateStoreMixin, GameTestCase):
+    store = {'BACKEND': 'game.state_store.LocMemGameStateStore'}
+
+
+class RedisStateStoreTests(StateStoreMixin, GameTestCase):
+    store = {'BACKEND': 'game.state_store.RedisGameStateStore', 'OPTIONS': {'LOCATION': 'local://'}}
+
+
+class ChoiceValidationTests(GameTestCase):
+    """Acciones que no son texto, por HTTP y por el WebSocket."""
+
+    def test_http_rejects_non_string_choices(self):
+        url = reverse('process_choice')
+        for body in ({'choice': ['investigar_nave']}, {'choice': 7}, {'choice': {'a': 1}}):
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertFalse(response.json()['success'])
+        response = self.client.post(url, ['investigar_nave'], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message'], 'La acción no puede estar vacía.')
+
+    async def test_websocket_bad_messages_keep_the_connection(self):
+        story = get_story('omega7')
+        connection = GameConnection({'type': 'websocket', 'headers': []}, None, None)
+        connection.story, connection.cursor, connection.player = story, story.afd.cursor(), None
+
+        reply = json.loads(await connection.handle('{"id": 1, "type": "choice", "choice": ["investigar_nave"]}'))
+        self.assertEqual(reply, {'id': 1, 'type': 'choice', 'success': False, 'message': '"choice" debe ser un texto.'})
+        reply = json.loads(await connection.handle('[1, 2]'))
+        self.assertEqual(reply['type'], 'error')
+
+        with mock.patch('game.websocket._apply_choice', side_effect=RuntimeError('fallo')):
+            with self.assertLogs('game.websocket', 'ERROR'):
+                reply = json.loads(await connection.handle('{"id": 2, "type": "choice", "choice": "investigar_nave"}'))
+        self.assertEqual((reply['id'], reply['success']), (2, False))
+
+        reply = json.loads(await connection.handle('{"id": 3, "type": "state"}'))
+        self.assertTrue(reply['success'])
+        self.assertEqual(reply['current_state'], 'inicio')
+
+
+class GameStateSerializationTests(GameTestCase):
+    """La página, HTTP y el WebSocket envían el mismo estado para el mismo cursor."""
+
+    def setUp(self):
+        super().setUp()
+        self.story = get_story('omega7')
+        self.addCleanup(self.story.gramatica.reseed, None)
+
+    async def test_same_json_everywhere(self):
+        story = self.story
+        await self.async_client.post(reverse('process_batch'), {'choices': ['investigar_nave', 'laboratorio']},
+                                     content_type='application/json')
+
+        story.gramatica.reseed(11)
+        http = (await self.async_client.get(reverse('get_game_state'), {'visited': 'full'})).json()
+
+        cursor = story.afd.cursor('sector_laboratorio', ['inicio', 'sala_control', 'sector_laboratorio'])
+        story.gramatica.reseed(11)
+        page = views._game_state_payload(story, cursor, full_visited=True)
+        self.assertEqual(page, http)
+
+        connection = GameConnection({'type': 'websocket', 'headers': []}, None, None)
+        connection.story, connection.cursor, connection.player = story, cursor, None
+        story.gramatica.reseed(11)
+        reply = json.loads(await connection.handle('{"id": 4, "type": "state", "visited": "full"}'))
+        self.assertEqual(reply, dict(http, id=4, type='state', success=True))
+        self.assertEqual(set(http), {
+            'current_state', 'possible_transitions', 'is_final_state', 'final_type',
+            'story_text', 'glc_example', 'visited_count', 'visited_states',
+        })
+
+    def test_game_page(self):
+        self.client.force_login(get_user_model().objects.create_user('jugador', password='clave-de-prueba'))
+        response = self.client.get(reverse('game_view'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['current_state'], 'inicio')
+        self.assertEqual(response.context['visited_states'], ['inicio'])
+        self.assertEqual(response.context['story_title'], self.story.title)
+
+
+class CodecTests(SimpleTestCase):
+    """Listas de ids codificadas como VLQ en base64 (game/codec.py)."""
+
+    def test_round_trip(self):
+        rng = random.Random(13)
+        samples = [[], [0], [31], [32], [1023, 1024], [2 ** 40], list(range(70))]
+        samples += [[rng.randrange(2 ** rng.randrange(1, 30)) for _ in range(rng.randrange(20))] for _ in range(200)]
+        for ids in samples:
+            self.assertEqual(decode_ids(encode_ids(ids)), ids)
+
+    def test_small_ids_take_one_character(self):
+        self.assertEqual(len(encode_ids(range(32))), 32)
+        self.assertEqual(len(encode_ids([32])), 2)
+
+    def test_concatenation_appends(self):
+        self.assertEqual(decode_ids(encode_ids([1, 500]) + encode_ids([40, 2])), [1, 500, 40, 2])
+
+    def test_invalid_text(self):
+        with self.assertRaises(ValueError):
+            decode_ids('A*')
+        with self.assertRaises(ValueError):
+            decode_ids(encode_ids([1000])[:-1])
+
+
+class JsonResponseTests(SimpleTestCase):
+    """Serialización y compresión de las respuestas JSON (game/responses.py)."""
+
+    def request(self, accept_encoding):
+        return RequestFactory().get('/', headers={'Accept-Encoding': accept_encoding})
+
+    def test_accepts_gzip(self):
+        for accept_encoding, expected in (
+            ('gzip', True), ('deflate, GZIP', True), ('br;q=1.0, gzip;q=0.5', True), ('*', True),
+            ('', False), ('br, deflate', False), ('gzip;q=0', False), ('gzip;q=0.0, *', False),
+            ('gzip;q=nada', False),
+        ):
+            self.assertEqual(responses.accepts_gzip(self.request(accept_encoding)), expected, accept_encoding)
+
+    @override_settings(GAME_GZIP_MIN_SIZE=100)
+    def test_gzip_only_from_the_minimum_size(self):
+        small, large = b'[' + b'1,' * 48 + b'1]', b'[' + b'1,' * 49 + b'1]'
+        self.assertEqual((len(small), len(large)), (99, 101))
+
+        response = responses.json_bytes_response(self.request('gzip'), small)
+        self.assertEqual(response.content, small)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertNotIn('Vary', response)
+
+        response = responses.json_bytes_response(self.request('gzip'), large)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), large)
+
+        for request in (self.request('gzip;q=0'), self.request('br'), None):
+            response = responses.json_bytes_response(request, large)
+            self.assertEqual(response.content, large)
+            self.assertNotIn('Content-Encoding', response)
+
+    @override_settings(GAME_GZIP_MIN_SIZE=10)
+    def test_precompressed_body_gets_a_weak_etag(self):
+        body = responses.dumps({'estados': list(range(20))})
+        compressed = responses.compress(body, level=9)
+        response = responses.json_bytes_response(self.request('gzip'), body, compressed=lambda: compressed, etag='abc')
+        self.assertEqual(response.content, compressed)
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+        # Sin comprimir, el ETag fuerte lo pone la vista
+        response = responses.json_bytes_response(self.request(''), body, compressed=compressed, etag='abc')
+        self.assertEqual(response.content, body)
+        self.assertNotIn('ETag', response)
+
+    @skipIf(responses.orjson is None, 'orjson no está instalado')
+    def test_stdlib_fallback_gives_the_same_bytes(self):
+        samples = [
+            {'texto': 'Sí, el ñandú ✓ </script>', 'números': [0, -3, 2.5, 0.001, None, True, False]},
+            {'anidado': {'vacío': {}, 'lista': [[], ['a\n"b"']]}},
+            [], '', 2 ** 63 - 1,
+        ]
+        with_orjson = [responses.dumps(sample) for sample in samples]
+        with mock.patch('game.responses.orjson', None):
+            self.assertEqual([responses.dumps(sample) for sample in samples], with_orjson)
+            self.assertEqual([responses.loads(body) for body in with_orjson], samples)
+            # Solo cambia cómo se escribe el exponente ('1e-07' y '1e-7'): el valor es el mismo
+            self.assertEqual(responses.loads(responses.dumps([1e-7])), [1e-7])
+        # Lo que orjson no sabe serializar pasa a json
+        self.assertEqual(responses.dumps({1: 2 ** 70}), b'{"1":' + str(2 ** 70).encode() + b'}')
+
+
+class VisitedDeltaTests(GameTestCase):
+    """Las respuestas solo llevan los visitados nuevos salvo que haga falta la lista."""
+
+    def choose(self, choice, **params):
+        url = reverse('process_choice')
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, {'choice': choice}, content_type='application/json').json()
+
+    def test_delta_after_each_choice(self):
+        # Partida nueva: lista completa
+        data = self.client.get(reverse('get_game_state')).json()
+        self.assertEqual((data['visited_states'], data['visited_count']), (['inicio'], 1))
+
+        data = self.choose('investigar_nave')
+        self.assertEqual((data['visited_delta'], data['visited_count']), (['sala_control'], 2))
+        data = self.choose('laboratorio')
+        self.assertEqual((data['visited_delta'], data['visited_count']), (['sector_laboratorio'], 3))
+        # Volver a un estado ya visitado no añade nada
+        data = self.choose('retroceder')
+        self.assertEqual((data['visited_delta'], data['visited_count']), ([], 3))
+        # Un error no cambia los visitados
+        self.assertNotIn('visited_delta', self.choose('bailar'))
+
+        data = self.choose('laboratorio', visited='full')
+        self.assertEqual(data['visited_states'], ['inicio', 'sala_control', 'sector_laboratorio'])
+
+    def test_store_keeps_the_encoded_list(self):
+        self.choose('investigar_nave')
+        self.choose('laboratorio')
+        afd = get_story('omega7').afd
+        current_state, visited, version = self.client.session['game_state'].values()
+        self.assertEqual((current_state, version), ('sector_laboratorio', afd.version))
+        self.assertEqual([afd.state_names[i] for i in decode_ids(visited)],
+                         ['inicio', 'sala_control', 'sector_laboratorio'])
+
+    def test_repeated_or_invalid_ids_are_dropped(self):
+        self.choose('investigar_nave')
+        afd = get_story('omega7').afd
+        session = self.client.session
+        delta = encode_ids([afd.state_id('sala_control')])
+        # Dos peticiones a la vez añadieron el mismo delta, y un id que no existe
+        session['game_state']['visited'] += delta + delta + encode_ids([len(afd.state_names) + 40])
+        session.save()
+
+        data = self.client.get(reverse('get_game_state'), {'visited': 'full'}).json()
+        self.assertEqual((data['visited_states'], data['visited_count']), (['inicio', 'sala_control'], 2))
+        # Se guarda la lista limpia
+        visited = self.client.session['game_state']['visited']
+        self.assertEqual(decode_ids(visited), [afd.state_id('inicio'), afd.state_id('sala_control')])
+        data = self.choose('laboratorio')
+        self.assertEqual((data['visited_delta'], data['visited_count']), (['sector_laboratorio'], 3))
+
+    def test_other_version_keeps_only_the_current_state(self):
+        self.choose('investigar_nave')
+        session = self.client.session
+        session['game_state']['story_version'] = '0' * 16
+        session.save()
+        data = self.client.get(reverse('get_game_state')).json()
+        self.assertEqual(data['current_state'], 'sala_control')
+        self.assertEqual(data['visited_states'], ['sala_control'])
+
+
+class EventLogTests(GameTestCase):
+    """Registro de acciones con escritura diferida (game/events.py)."""
+
+    def choose(self, choice):
+        self.client.post(reverse('process_choice'), {'choice': choice}, content_type='application/json')
+
+    def test_choices_wait_in_the_buffer_until_flush(self):
+        events.flush()
+        self.choose('investigar nave')
+        self.assertEqual(len(events.BUFFER), 1)
+        self.assertFalse(PlaythroughEvent.objects.exists())
+        self.choose('bailar')
+        # Los dos eventos en un solo INSERT
+        with self.assertNumQueries(1):
+            self.assertEqual(events.flush(), 2)
+        self.assertEqual(len(events.BUFFER), 0)
+        self.assertEqual(list(PlaythroughEvent.objects.order_by('pk').values_list(
+            'from_state', 'raw_input', 'action', 'to_state', 'story_version')), [
+            ('inicio', 'investigar nave', 'investigar_nave', 'sala_control', get_story('omega7').version),
+            ('sala_control', 'bailar', '', '', get_story('omega7').version),
+        ])
+
+    def test_anonymous_and_authenticated_players(self):
+        # El cliente empieza pidiendo el estado, que crea la sesión
+        self.client.get(reverse('get_game_state'))
+        self.choose('investigar_nave')
+        anonymous_key = self.client.session.session_key
+        user = get_user_model().objects.create_user('jugador', password='clave-de-prueba')
+        self.client.force_login(user)
+        self.choose('laboratorio')
+        events.flush()
+        self.assertEqual(list(PlaythroughEvent.objects.order_by('pk').values_list('user_id', 'session_key')),
+                         [(None, anonymous_key), (user.pk, self.client.session.session_key)])
+
+    def test_async_player_matches(self):
+        self.client.force_login(get_user_model().objects.create_user('jugador', password='clave-de-prueba'))
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        self.assertEqual(async_to_sync(events.aplayer_of)(request), events.player_of(request))
+
+    def test_full_buffer_drops_what_does_not_fit(self):
+        events.flush()
+        with self.settings(GAME_EVENT_LOG_MAX_BUFFER=2):
+            for choice in ('investigar_nave', 'laboratorio', 'retroceder'):
+                self.choose(choice)
+            self.assertEqual(len(events.BUFFER), 2)
+
+
+class EventFlusherTests(TransactionTestCase):
+    """El hilo de volcado escribe en cuanto el búfer junta un lote (game/events.py)."""
+
+    @override_settings(GAME_EVENT_LOG_BATCH_SIZE=2, GAME_EVENT_LOG_FLUSH_INTERVAL=60)
+    def test_full_batch_is_flushed_without_waiting(self):
+        # Un búfer propio: el hilo no se queda en el global
+        buffer = events.EventBuffer()
+        flushed = threading.Event()
+        flush = buffer.flush
+        buffer.flush = lambda: flushed.set() or flush()
+        story = get_story('omega7')
+        with mock.patch.object(events, 'BUFFER', buffer):
+            events.record(story, (None, 'sesion'), 'inicio', 'investigar nave', 'exact', 'investigar_nave', 'sala_control')
+            self.assertFalse(flushed.wait(0.2))
+            events.record(story, (None, 'sesion'), 'sala_control', 'laboratorio', 'exact', 'laboratorio', 'sector_laboratorio')
+            self.assertTrue(flushed.wait(10))
+        for _ in range(100):
+            if PlaythroughEvent.objects.count() == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual(PlaythroughEvent.objects.count(), 2)
+        self.assertEqual(len(buffer), 0)
+
+
+class SuggestViewTests(GameTestCase):
+    """/suggest/: solo se proponen frases que el servidor aceptaría (game/views.py)."""
+
+    def suggest(self, prefix):
+        return self.client.get(reverse('suggest_actions'), {'q': prefix}).json()['suggestions']
+
+    def test_suggestions_are_accepted_by_match_input(self):
+        story = get_story('omega7')
+        for choices, prefixes in (([], ('i', 'inv', 'nave', 'b', 'sal')),
+                                  (['investigar_nave'], ('l', 'lab', 'bo', 'me', 'rev', 'datos'))):
+            self.client.post(reverse('process_batch'), {'choices': choices}, content_type='application/json')
+            state = self.client.get(reverse('get_game_state')).json()
+            available = state['possible_transitions']
+            found = set()
+            for prefix in prefixes:
+                for item in self.suggest(prefix):
+                    self.assertIn(item['action'], available)
+                    self.assertEqual(story.gramatica.match_input(item['text'], available)[1], item['action'], item)
+                    found.add(item['action'])
+            self.assertEqual(found, set(available))
+
+    def test_cache_key_is_the_normalized_prefix(self):
+        story = get_story('omega7')
+        cursor = story.afd.cursor()
+        cache = story.cached('suggestions', lambda story: {})
+        cache.clear()
+        self.addCleanup(cache.clear)
+        first = views._suggestions(story, cursor, 'Inv')
+        self.assertTrue(first)
+        self.assertIs(views._suggestions(story, cursor, '  inv'), first)
+        self.assertEqual(views._suggestions(story, cursor, 'ínv'), first)
+        for prefix in ('', '   ', 'i' * (IndicePrefijos.MAX_PREFIX + 1)):
+            self.assertEqual(views._suggestions(story, cursor, prefix), [])
+        self.assertEqual(list(cache), [(cursor.state_id, 'inv')])
+
+
+class MetricsViewTests(GameTestCase):
+    """Acceso a /metrics y etiquetas de las peticiones (game/metrics.py)."""
+
+    def test_allowed_ips(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.settings(GAME_METRICS_ALLOWED_IPS=['10.0.0.0/8']):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.1.2.3').status_code, 200)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='no-es-una-ip').status_code, 403)
+
+    def test_staff_users(self):
+        url = reverse('metrics')
+        user = get_user_model().objects.create_user('jugador', password='clave-de-prueba')
+        self.client.force_login(user)
+        with self.settings(GAME_METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            user.is_staff = True
+            user.save()
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_unknown_methods_are_labelled_other(self):
+        self.client.generic('BREW', reverse('get_game_state'))
+        self.client.generic('brew', reverse('get_game_state'))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('method="other"', body)
+        self.assertNotIn('BREW', body)
+        self.assertNotIn('brew', body)
+
+
+def _state(transitions=None, is_final=False, final_type=''):
+    return {'description': '', 'transitions': transitions or {}, 'isFinal': is_final, 'finalType': final_type}
+
+
+class AnalyzeStoryTests(SimpleTestCase):
+    """Análisis estático del grafo (game/analysis.py) y `manage.py analyze_story`."""
+
+    def setUp(self):
+        self.states = {
+            'inicio': _state({'avanzar': 'pasillo', 'saltar': 'no_existe'}),
+            'pasillo': _state({'volver': 'inicio', 'bajar': 'sotano', 'salir': 'fin'}),
+            'sotano': _state(),
+            'fin': _state(is_final=True, final_type='bueno'),
+            'isla': _state({'nadar': 'fin'}),
+            'secreto': _state(is_final=True, final_type='oculto'),
+        }
+
+    def test_problems(self):
+        analysis = analyze_story(self.states, 'inicio')
+        self.assertFalse(analysis['verified'])
+        self.assertEqual(analysis['missing_targets'], [{'state': 'inicio', 'action': 'saltar', 'target': 'no_existe'}])
+        self.assertEqual(analysis['unreachable'], ['isla', 'secreto'])
+        self.assertEqual(analysis['dead_ends'], ['sotano'])
+        self.assertEqual(analysis['endings']['fin']['actions'], ['avanzar', 'salir'])
+        self.assertEqual(analysis['cycles'], [['inicio', 'pasillo']])
+        self.assertEqual(problems(analysis), [
+            'inicio --saltar--> no_existe: el destino no existe',
+            'isla: no es alcanzable desde el estado inicial',
+            'secreto: no es alcanzable desde el estado inicial',
+            'sotano: no es final y no tiene transiciones válidas',
+            'secreto: final inalcanzable',
+        ])
+
+    def test_unverified_story_checks_dangling_targets(self):
+        afd = AFDNarrativo(self.states, 'inicio', analysis=analyze_story(self.states, 'inicio'))
+        self.assertFalse(afd.verified)
+        self.assertEqual(afd.next_state('inicio', 'saltar'), 'no_existe')
+        cursor = afd.cursor()
+        cursor.transition('avanzar')
+        cursor.transition('volver')
+        # El destino no existe: la partida vuelve a empezar
+        self.assertTrue(cursor.transition('saltar'))
+        self.assertEqual((cursor.currentState, cursor.visitedStates), ('inicio', ['inicio']))
+
+    def test_verified_story_skips_dangling_checks(self):
+        del self.states['inicio']['transitions']['saltar']
+        del self.states['isla'], self.states['secreto']
+        analysis = analyze_story(self.states, 'inicio')
+        # Un callejón sin salida no impide verificarla
+        self.assertTrue(analysis['verified'])
+        self.assertEqual(problems(analysis), ['sotano: no es final y no tiene transiciones válidas'])
+        afd = AFDNarrativo(self.states, 'inicio', analysis=analysis)
+        self.assertTrue(afd.verified)
+        with mock.patch('game.engine.DANGLING', afd.state_ids['pasillo']):
+            # Con la historia verificada el destino se usa sin compararlo con DANGLING
+            cursor = afd.cursor()
+            self.assertTrue(cursor.transition('avanzar'))
+            self.assertEqual(cursor.currentState, 'pasillo')
+            self.assertEqual(afd.next_state('inicio', 'avanzar'), 'pasillo')
+
+    def test_command_on_omega7(self):
+        out = StringIO()
+        call_command('analyze_story', 'omega7', stdout=out)
+        output = out.getvalue()
+        analysis = get_story('omega7').afd.analysis
+        self.assertTrue(output.startswith(f'Historia omega7 (versión {get_story("omega7").version})'))
+        self.assertIn(f"{analysis['total_states']} estados", output)
+        self.assertIn(f'{len(problems(analysis))} problemas:', output)
+        self.assertIn('Caminos más cortos a cada final:', output)
+
+        out = StringIO()
+        call_command('analyze_story', 'omega7', '--json', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['verified'], analysis['verified'])
+
+    def test_command_exit_status(self):
+        with self.assertRaisesMessage(CommandError, 'no supera la verificación'):
+            call_command('analyze_story', 'omega7', '--strict', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('analyze_story', 'no-existe', stdout=StringIO())
+
+
+def _random_afd(rng, size):
+    """AFD aleatorio con ciclos, callejones sin salida y destinos inexistentes."""
+    names = [f'e{i}' for i in range(size)]
+    states = {}
+    for i, name in enumerate(names):
+        is_final = i > 0 and rng.random() < 0.25
+        transitions = {}
+        for action in range(rng.randrange(4)):
+            target = 'perdido' if rng.random() < 0.1 else rng.choice(names)
+            transitions[f'a{action}'] = target
+        states[name] = {
+            'description': name, 'transitions': transitions,
+            'isFinal': is_final, 'finalType': 'bueno' if is_final and i % 2 else '',
+        }
+    return AFDNarrativo(states, 'e0')
+
+
+def _brute_force_playthroughs(afd):
+    """Enumera todas las partidas sin estados repetidos."""
+    counts = {state: 0 for state in afd.get_all_states() if afd.get_state(state)['isFinal']}
+
+    def walk(state, path):
+        if afd.get_state(state)['isFinal']:
+            counts[state] += 1
+            return
+        for target in afd.get_transitions_from_state(state).values():
+            if not afd.has_state(target):
+                target = afd.initial_state
+            if target not in path:
+                walk(target, path | {target})
+
+    walk(afd.initial_state, {afd.initial_state})
+    return dict(sorted(counts.items()))
+
+
+def _brute_force_random_play(afd):
+    """
+    Jugador al azar simulado paso a paso: se reparte la probabilidad entre las
+    acciones hasta que toda la que puede terminar lo ha hecho.
+    """
+    def edges(state):
+        if afd.get_state(state)['isFinal']:
+            return []
+        return [target if afd.has_state(target) else afd.initial_state
+                for target in afd.get_transitions_from_state(state).values()]
+
+    # Estados desde los que se puede terminar (la probabilidad que cae en los demás no vuelve)
+    can_finish = {state for state in afd.get_all_states() if not edges(state)}
+    changed = True
+    while changed:
+        changed = False
+        for state in afd.get_all_states():
+            if state not in can_finish and any(target in can_finish for target in edges(state)):
+                can_finish.add(state)
+                changed = True
+
+    absorption, weighted_length, visits = {}, {}, {}
+    lost = 0.0
+    mass = {afd.initial_state: 1.0}
+    step = 0
+    while mass and sum(mass.values()) > 1e-13:
+        following = {}
+        for state, probability in mass.items():
+            targets = edges(state)
+            if not targets:
+                absorption[state] = absorption.get(state, 0.0) + probability
+                weighted_length[state] = weighted_length.get(state, 0.0) + step * probability
+                continue
+            if state not in can_finish:
+                lost += probability
+                continue
+            visits[state] = visits.get(state, 0.0) + probability
+            for target in targets:
+                following[target] = following.get(target, 0.0) + probability / len(targets)
+        mass = following
+        step += 1
+    return {
+        'absorption': absorption,
+        'expected_length': None if lost > 1e-9 else sum(visits.values()),
+        'conditional_length': {state: weighted_length[state] / p for state, p in absorption.items() if p > 1e-12},
+        'expected_visits': visits,
+    }
+
+
+class ExplorationTests(SimpleTestCase):
+    """game/exploration.py contra una enumeración y una simulación directas."""
+
+    def test_playthroughs_on_random_stories(self):
+        rng = random.Random(19)
+        for _ in range(300):
+            afd = _random_afd(rng, rng.randrange(1, 9))
+            self.assertEqual(count_playthroughs(afd), _brute_force_playthroughs(afd), afd.states)
+
+    def test_playthroughs_on_omega7(self):
+        afd = get_story('omega7').afd
+        self.assertEqual(count_playthroughs(afd), _brute_force_playthroughs(afd))
+
+    def test_playthroughs_give_up_over_budget(self):
+        afd = get_story('omega7').afd
+        self.assertIsNone(count_playthroughs(afd, max_steps=5))
+
+    def test_random_play_on_random_stories(self):
+        # Solver disperso en Python (con NumPy, ver test_random_play_with_numpy)
+        with mock.patch('game.exploration.numpy', None):
+            self.check_random_play()
+
+    @skipIf(exploration.numpy is None, 'NumPy no está instalado')
+    def test_random_play_with_numpy(self):
+        self.assertEqual(exploration._solver_for(exploration.DENSE_SOLVE_LIMIT), 'numpy')
+        self.check_random_play()
+
+    def test_large_chains_use_the_sparse_solver(self):
+        self.assertEqual(exploration._solver_for(exploration.DENSE_SOLVE_LIMIT + 1), 'python')
+        # Cadena de 1000 estados: con la matriz densa serían 10⁶ celdas
+        size = 1000
+        states = {f'e{i}': _state({'seguir': f'e{i + 1}', 'volver': f'e{max(i - 1, 0)}'}) for i in range(size)}
+        states[f'e{size}'] = _state(is_final=True, final_type='bueno')
+        afd = AFDNarrativo(states, 'e0')
+        with mock.patch('game.exploration._solve_python', wraps=exploration._solve_python) as solve_python:
+            result = explore_story(afd)
+        self.assertTrue(solve_python.called)
+        self.assertEqual(result['method'], 'python')
+        self.assertEqual(result['completion_probability'], 1.0)
+
+    def check_random_play(self):
+        rng = random.Random(19)
+        for _ in range(150):
+            afd = _random_afd(rng, rng.randrange(1, 8))
+            result, expected = random_play(afd), _brute_force_random_play(afd)
+            reachable_absorbing = {state for state, p in result['absorption'].items() if p > 1e-12}
+            self.assertEqual(reachable_absorbing, {state for state, p in expected['absorption'].items() if p > 1e-12})
+            for state in reachable_absorbing:
+                self.assertAlmostEqual(result['absorption'][state], expected['absorption'][state], places=7)
+                self.assertAlmostEqual(result['conditional_length'][state], expected['conditional_length'][state], places=5)
+            if expected['expected_length'] is None:
+                self.assertIsNone(result['expected_length'])
+            else:
+                self.assertAlmostEqual(result['expected_length'], expected['expected_length'], places=5)
+            for state, visits in expected['expected_visits'].items():
+                self.assertAlmostEqual(result['expected_visits'].get(state, 0.0), visits, places=5)
+
+    def test_explore_story_summary(self):
+        states = {
+            'inicio': {'description': '', 'isFinal': False, 'finalType': '',
+                       'transitions': {'izquierda': 'bucle', 'derecha': 'fin', 'atajo': 'no_existe'}},
+            'bucle': {'description': '', 'isFinal': False, 'finalType': '',
+                      'transitions': {'seguir': 'bucle', 'volver': 'inicio', 'atasco': 'pozo'}},
+            'pozo': {'description': '', 'isFinal': False, 'finalType': '', 'transitions': {}},
+            'fin': {'description': '', 'isFinal': True, 'finalType': 'bueno', 'transitions': {'otra': 'inicio'}},
+        }
+        afd = AFDNarrativo(states, 'inicio')
+        result = explore_story(afd)
+        expected = _brute_force_random_play(afd)
+        self.assertEqual(result['playthroughs'], 1)
+        self.assertEqual(result['endings']['fin']['playthroughs'], 1)
+        self.assertEqual(result['endings']['fin']['finalType'], 'bueno')
+        self.assertAlmostEqual(result['endings']['fin']['probability'], expected['absorption']['fin'], places=6)
+        self.assertAlmostEqual(result['stuck']['pozo'], expected['absorption']['pozo'], places=6)
+        self.assertAlmostEqual(result['completion_probability'] + result['stuck']['pozo'], 1.0, places=6)
+        self.assertAlmostEqual(result['expected_length'], expected['expected_length'], places=5)
+
+
+class FunnelViewTests(GameTestCase):
+    """/game/funnel/: acceso y caché de las respuestas (game/funnel.py)."""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(funnel._cache.clear)
+        funnel._cache.clear()
+        self.url = reverse('get_funnel')
+        self.story = get_story('omega7')
+
+    def login_staff(self):
+        user = get_user_model().objects.create_user('panel', password='clave-de-prueba', is_staff=True)
+        self.client.force_login(user)
+
+    def play(self):
+        self.client.post(reverse('process_choice'), {'choice': 'investigar_nave'}, content_type='application/json')
+        funnel.flush()
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(get_user_model().objects.create_user('jugador', password='clave-de-prueba'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.login_staff()
+        data = self.client.get(self.url).json()
+        self.assertEqual((data['story'], data['version']), ('omega7', self.story.version))
+
+    def test_cache_per_story_version_with_ttl(self):
+        self.login_staff()
+        self.assertEqual(self.client.get(self.url).json()['starts'], 0)
+        self.assertEqual(self.client.get(self.url, {'version': '0' * 16}).json()['version'], '0' * 16)
+        self.play()
+        with self.settings(GAME_FUNNEL_CACHE_SECONDS=60):
+            self.assertEqual(self.client.get(self.url).json()['starts'], 0)
+        with self.settings(GAME_FUNNEL_CACHE_SECONDS=0):
+            self.assertEqual(self.client.get(self.url).json()['starts'], 1)
+        self.assertEqual(set(funnel._cache), {('omega7', self.story.version), ('omega7', '0' * 16)})
+
+    def test_cache_is_bounded(self):
+        self.login_staff()
+        with self.settings(GAME_FUNNEL_CACHE_SIZE=3):
+            for i in range(10):
+                self.client.get(self.url, {'version': f'{i:016x}'})
+            self.assertEqual(list(funnel._cache), [('omega7', f'{i:016x}') for i in (7, 8, 9)])
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewsTests(GameTestCase):
+    """Una partida por las vistas asíncronas (game/async_views.py)."""
+
+    async def test_play_a_game(self):
+        client = self.async_client
+        state = (await client.get(reverse('get_game_state'))).json()
+        self.assertEqual(state['current_state'], 'inicio')
+
+        data = (await client.post(reverse('process_choice'), {'choice': 'investigar nave'},
+                                  content_type='application/json')).json()
+        self.assertEqual((data['success'], data['current_state']), (True, 'sala_control'))
+        data = (await client.post(reverse('process_batch'), {'choices': ['laboratorio', 'retroceder']},
+                                  content_type='application/json')).json()
+        self.assertEqual([step['current_state'] for step in data['steps']], ['sector_laboratorio', 'sala_control'])
+        current = (await client.get(reverse('get_afd_current'))).json()
+        self.assertEqual(current['visited_states'], ['inicio', 'sala_control', 'sector_laboratorio'])
+        suggestions = (await client.get(reverse('suggest_actions'), {'q': 'lab'})).json()
+        self.assertIn('laboratorio', [item['action'] for item in suggestions['suggestions']])
+
+        self.assertTrue((await client.post(reverse('reset_game'))).json()['success'])
+        self.assertEqual((await client.get(reverse('get_game_state'))).json()['current_state'], 'inicio')
+
+    async def test_afd_info_etag(self):
+        response = await self.async_client.get(reverse('get_afd_info'))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = await self.async_client.get(reverse('get_afd_info'), headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.content, response['ETag']), (304, b'', etag))
+        response = await self.async_client.get(reverse('get_afd_info', kwargs={'story_id': 'no-existe'}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_stories_load_outside_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        threads = []
+
+        def load(story_id=None):
+            threads.append(threading.get_ident())
+            return get_story(story_id)
+
+        clear_loaded_stories()
+        with mock.patch('game.views.get_story', side_effect=load):
+            await async_views._astory('omega7')
+            # Ya cargada: no hace falta otro hilo
+            await async_views._astory('omega7')
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+
+class StaticAssetsTests(SimpleTestCase):
+    """Estáticos de collectstatic con hash y precomprimidos, servidos por serve_static (game/assets.py)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = Path(tempfile.mkdtemp())
+        cls.addClassCleanup(shutil.rmtree, cls.root)
+        settings = override_settings(STATIC_ROOT=cls.root)
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+        assets._hashed_names.cache_clear()
+        cls.addClassCleanup(assets._hashed_names.cache_clear)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.hashed = staticfiles_storage.stored_name('js/script.js')
+        cls.original = (cls.root / 'js' / 'script.js').read_bytes()
+
+    def get(self, path, **headers):
+        response = assets.serve_static(RequestFactory().get('/static/' + path, headers=headers), path)
+        self.addCleanup(response.close)
+        return response
+
+    def cache_control(self, response):
+        return {part.strip() for part in response['Cache-Control'].split(',')}
+
+    def test_hashed_names_come_from_the_manifest(self):
+        self.assertRegex(self.hashed, r'^js/script\.[0-9a-f]{12}\.js$')
+        self.assertEqual(static('js/script.js'), '/static/' + self.hashed)
+        self.assertIn(self.hashed, assets._hashed_names())
+        self.assertNotIn('js/script.js', assets._hashed_names())
+        self.assertTrue((self.root / (self.hashed + '.gz')).is_file())
+
+    def test_gzip_is_chosen_by_accept_encoding(self):
+        response = self.get(self.hashed, accept_encoding='deflate, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.original)
+        # El nombre del recurso, no el del .gz
+        self.assertEqual(response['Content-Disposition'], f'inline; filename="{Path(self.hashed).name}"')
+
+        for accept_encoding in ('', 'gzip;q=0', 'br'):
+            response = self.get(self.hashed, accept_encoding=accept_encoding)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(b''.join(response.streaming_content), self.original)
+
+    def test_hashed_names_are_immutable(self):
+        for accept_encoding in ('gzip', ''):
+            response = self.get(self.hashed, accept_encoding=accept_encoding)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertEqual(self.cache_control(response), {'public', 'max-age=31536000', 'immutable'})
+
+    def test_other_names_are_revalidated(self):
+        response = self.get('js/script.js', accept_encoding='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(self.cache_control(response), {'no-cache'})
+        with self.assertRaises(Http404):
+            self.get('js/no-existe.js')
 
-# Create your tests here.
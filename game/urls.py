@@ -1,13 +1,30 @@
 # game/urls.py
 
-from django.urls import path
-from . import views
+from django.conf import settings
+from django.urls import include, path, re_path
+from . import views, async_views
 
-urlpatterns = [
+# Con ASGI (uvicorn, daphne...) se usan las versiones asíncronas de los endpoints
+game_views = async_views if getattr(settings, 'GAME_ASYNC_VIEWS', False) else views
+
+# Endpoints de una partida. Se sirven para la historia por defecto en /game/ y
+# para cualquier otra en /game/stories/<story_id>/ (las vistas reciben story_id).
+story_urlpatterns = [
     path('', views.game_view, name='game_view'),
-    path('state/', views.get_game_state, name='get_game_state'),
-    path('process_choice/', views.process_choice, name='process_choice'),
-    path('reset/', views.reset_game_view, name='reset_game'),  # Cambiado de reset_game/ a reset/
-    path('afd_info/', views.get_afd_info, name='get_afd_info'),
+    path('state/', game_views.get_game_state, name='get_game_state'),
+    path('process_choice/', game_views.process_choice, name='process_choice'),
+    path('process_batch/', game_views.process_batch, name='process_batch'),
+    path('reset/', game_views.reset_game_view, name='reset_game'),  # Cambiado de reset_game/ a reset/
+    path('afd_info/', game_views.get_afd_info, name='get_afd_info'),
+    path('afd_info/current/', game_views.get_afd_current, name='get_afd_current'),
+    path('suggest/', game_views.suggest_actions, name='suggest_actions'),
+    path('funnel/', views.get_funnel, name='get_funnel'),
+]
+
+urlpatterns = [
+    path('', include(story_urlpatterns)),
+    path('stories/<slug:story_id>/', include(story_urlpatterns)),
     path('register/', views.register_view, name='register'),
-]
\ No newline at end of file
+    # Recursos inmutables con el hash del contenido en el nombre
+    re_path(r'^layout/(?P<digest>[0-9a-f]{16})\.json$', views.get_afd_layout, name='get_afd_layout'),
+]
@@ -0,0 +1,203 @@
+# game/websocket.py
+
+# Canal WebSocket por jugador, servido directamente sobre ASGI (sin Channels).
+# La sesión, el usuario y el cursor de la partida se cargan una sola vez al
+# conectar; después cada acción viaja como un mensaje JSON pequeño y solo se
+# escribe el delta en el almacén de partidas.
+#
+# Mensajes del cliente:  {"id": 1, "type": "state", "visited": "full"}
+#                        {"id": 2, "type": "choice", "choice": "investigar nave"}
+#                        {"id": 3, "type": "reset"}
+# Cada respuesta repite el "id" y el "type" de la petición. Como en HTTP, de
+# los visitados solo se envía el delta salvo que se pida "visited": "full".
+
+import logging
+import re
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.db import close_old_connections
+from django.http.cookie import parse_cookie
+
+from .engine import CursorAFD
+from .metrics import timed
+from .responses import dumps, loads
+from .state_store import get_store
+from .stories import StoryNotFound, get_story
+from .views import _apply_choice, _game_state_json
+
+logger = logging.getLogger(__name__)
+
+# Códigos de cierre (rango 4000-4999 reservado para aplicaciones)
+CLOSE_FORBIDDEN_ORIGIN = 4403
+CLOSE_NOT_AUTHENTICATED = 4401
+CLOSE_UNSUPPORTED_STORE = 4400
+CLOSE_NOT_FOUND = 4404
+
+
+class _ConnectionRequest:
+    """Lo mínimo de un HttpRequest que necesitan la sesión, la autenticación y los almacenes."""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.META = {}
+        headers = {name.decode('latin1'): value.decode('latin1') for name, value in scope.get('headers', [])}
+        self.headers = headers
+        self.COOKIES = parse_cookie(headers.get('cookie', ''))
+        engine = import_module(settings.SESSION_ENGINE)
+        self.session = engine.SessionStore(self.COOKIES.get(settings.SESSION_COOKIE_NAME))
+
+    async def auser(self):
+        if not hasattr(self, 'user'):
+            self.user = await aget_user(self)
+        return self.user
+
+
+class GameConnection:
+    def __init__(self, scope, receive, send, story_id=None):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.request = _ConnectionRequest(scope)
+        self.store = get_store()
+        self.story_id = story_id
+        self.story = None
+        self.cursor = None
+
+    def _origin_allowed(self):
+        # Evita que otra web abra el socket con las cookies del jugador
+        origin = self.request.headers.get('origin')
+        if not origin:
+            return True
+        return urlsplit(origin).netloc == self.request.headers.get('host')
+
+    async def _close(self, code):
+        await self.send({'type': 'websocket.close', 'code': code})
+
+    async def run(self):
+        event = await self.receive()
+        if event['type'] != 'websocket.connect':
+            return
+
+        if not self._origin_allowed():
+            return await self._close(CLOSE_FORBIDDEN_ORIGIN)
+        if not getattr(self.store, 'supports_websocket', True):
+            return await self._close(CLOSE_UNSUPPORTED_STORE)
+        user = await self.request.auser()
+        if not user.is_authenticated:
+            return await self._close(CLOSE_NOT_AUTHENTICATED)
+        # Para el registro de eventos (ver game/events.py)
+        self.player = (user.pk, self.request.session.session_key or '')
+
+        try:
+            # La conexión sigue con la misma versión de la historia hasta cerrarse
+            self.story = get_story(self.story_id)
+        except StoryNotFound:
+            return await self._close(CLOSE_NOT_FOUND)
+        self.cursor = await CursorAFD.aload(self.story.afd, self.store, self.request)
+        await self._save_session()
+        await self.send({'type': 'websocket.accept'})
+
+        try:
+            while True:
+                event = await self.receive()
+                if event['type'] == 'websocket.disconnect':
+                    return
+                if event['type'] != 'websocket.receive':
+                    continue
+                text = event.get('text')
+                if text is None:
+                    text = (event.get('bytes') or b'').decode('utf-8', 'replace')
+                reply = await self.handle(text)
+                await self.send({'type': 'websocket.send', 'text': reply.decode('utf-8')})
+        finally:
+            await sync_to_async(close_old_connections)()
+
+    async def handle(self, text):
+        """Respuesta (JSON en bytes) al mensaje `text`."""
+        try:
+            message = loads(text)
+            message_type = message.get('type')
+        except (ValueError, AttributeError):
+            return self._dumps({'type': 'error', 'success': False, 'message': 'JSON inválido.'})
+
+        reply = {'id': message.get('id'), 'type': message_type}
+        try:
+            return await self._dispatch(message, reply)
+        except Exception:
+            # Un mensaje que falla no debe cerrar la conexión del jugador
+            logger.exception('Error al procesar un mensaje del WebSocket (%r)', message_type)
+            reply.update({'success': False, 'message': 'Error interno al procesar la acción.'})
+            return self._dumps(reply)
+
+    @staticmethod
+    def _dumps(reply):
+        with timed('json_serialize'):
+            return dumps(reply)
+
+    def _state_reply(self, reply, full_visited):
+        reply['success'] = True
+        return _game_state_json(self.story, self.cursor, reply, full_visited)
+
+    async def _dispatch(self, message, reply):
+        message_type = reply['type']
+        full_visited = message.get('visited') == 'full'
+        self.cursor.checkpoint()
+        if message_type == 'state':
+            return self._state_reply(reply, full_visited)
+        elif message_type == 'choice':
+            user_input = message.get('choice')
+            if not user_input:
+                error_message = 'La acción no puede estar vacía.'
+            elif not isinstance(user_input, str):
+                error_message = '"choice" debe ser un texto.'
+            else:
+                error_message = _apply_choice(self.story, self.cursor, user_input, self.player)
+            if error_message:
+                reply.update({'success': False, 'message': error_message})
+            else:
+                await self._persist()
+                return self._state_reply(reply, full_visited)
+        elif message_type == 'reset':
+            self.cursor.reset()
+            await self._persist()
+            return self._state_reply(reply, full_visited)
+        else:
+            reply.update({'success': False, 'message': f'Tipo de mensaje desconocido: {message_type!r}'})
+        return self._dumps(reply)
+
+    async def _persist(self):
+        await self.cursor.apersist(self.store, self.request)
+        await self._save_session()
+
+    async def _save_session(self):
+        # Fuera de HTTP no hay SessionMiddleware que guarde la sesión
+        if self.request.session.modified:
+            await self.request.session.asave()
+            self.request.session.modified = False
+
+
+class GameWebSocketApp:
+    """
+    Aplicación ASGI que atiende el WebSocket del juego en `<prefix>ws/` (historia
+    por defecto) y `<prefix>stories/<story_id>/ws/`, y delega todo lo demás
+    (HTTP, lifespan) en la aplicación de Django.
+    """
+
+    def __init__(self, django_application, prefix='/game/'):
+        self.django_application = django_application
+        self.path_re = re.compile(re.escape(prefix) + r'(?:stories/(?P<story_id>[A-Za-z0-9_-]+)/)?ws/')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.django_application(scope, receive, send)
+        match = self.path_re.fullmatch(scope['path'])
+        if match:
+            return await GameConnection(scope, receive, send, match['story_id']).run()
+        # Cualquier otro WebSocket se rechaza
+        event = await receive()
+        if event['type'] == 'websocket.connect':
+            await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'narrative_game.settings')
+# Bajo ASGI los endpoints del juego se sirven con vistas async (ver game/urls.py)
+os.environ.setdefault('GAME_ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Importar después de configurar Django: el canal WebSocket usa modelos y sesiones
+from game.websocket import GameWebSocketApp  # noqa: E402
+
+application = GameWebSocketApp(django_application)
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'game.metrics.GameMetricsMiddleware', # Primero, para medir la petición completa
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -49,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.locale.LocaleMiddleware',
+    'game.state_store.GameStateMiddleware',
 ]
 
 ROOT_URLCONF = 'narrative_game.urls'
@@ -122,6 +124,15 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# `collectstatic` deja en STATIC_ROOT los archivos con el hash del contenido en
+# el nombre y precomprimidos (.gz y, con el paquete brotli, .br); ver game/assets.py
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'game.assets.CompressedManifestStaticFilesStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -129,3 +140,57 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = '/game/' # Redirige al juego después de iniciar sesión
 LOGOUT_REDIRECT_URL = '/accounts/login/' # Redirige al login después de cerrar sesión
+
+# Historias del juego (archivos JSON/YAML en game/stories/)
+GAME_DEFAULT_STORY = 'omega7'
+GAME_STORY_CACHE_DIR = BASE_DIR / '.story_cache' # Historias compiladas, por hash de contenido
+GAME_GRAMMAR_SEED = None # Un entero hace reproducible el texto generado por la GLC
+GAME_STORY_CACHE_SIZE = 32 # Historias cargadas a la vez por worker (LRU); cada una se sirve en /game/stories/<id>/
+
+# Almacén del progreso de las partidas (ver game/state_store.py). Alternativas:
+#   'game.state_store.SignedCookieGameStateStore' (cookie firmada, sin BD)
+#   'game.state_store.LocMemGameStateStore'       (memoria del proceso, LRU)
+#   'game.state_store.RedisGameStateStore'        (OPTIONS: {'LOCATION': 'redis://localhost:6379/0'})
+GAME_STATE_STORE = {
+    'BACKEND': 'game.state_store.SessionGameStateStore',
+    'OPTIONS': {},
+}
+
+# Máximo de acciones por petición en /game/process_batch/
+GAME_BATCH_MAX_CHOICES = 200
+
+# Máximo de sugerencias por petición en /game/suggest/
+GAME_SUGGEST_LIMIT = 8
+
+# Usar las versiones asíncronas de los endpoints (game/async_views.py).
+# narrative_game/asgi.py lo activa por defecto al servir con ASGI.
+GAME_ASYNC_VIEWS = os.environ.get('GAME_ASYNC_VIEWS', '0') == '1'
+
+# Instrumentación (game/metrics.py): métricas de Prometheus en /metrics y,
+# opcionalmente, la cabecera Server-Timing con el desglose de cada petición
+GAME_METRICS = True
+GAME_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1'] # IPs o redes (CIDR) del scraper; los usuarios staff siempre pueden
+GAME_SERVER_TIMING = DEBUG
+
+# Registro de acciones de los jugadores (game/events.py): se acumulan en memoria
+# y se guardan con bulk_create por lotes, fuera de la petición
+GAME_EVENT_LOG = True
+GAME_EVENT_LOG_BATCH_SIZE = 500 # Eventos que disparan un volcado
+GAME_EVENT_LOG_FLUSH_INTERVAL = 2.0 # Segundos máximos entre volcados (None: solo al llamar a events.flush())
+GAME_EVENT_LOG_MAX_BUFFER = 50000 # Si la base de datos no responde, se descartan los que no quepan
+
+# Embudo de cada historia (game/funnel.py): contadores en memoria que se suman
+# periódicamente a FunnelCounter; se leen en /game/funnel/
+GAME_FUNNEL = True
+GAME_FUNNEL_FLUSH_INTERVAL = 5.0 # Segundos entre volcados de los contadores (None: solo con funnel.flush())
+GAME_FUNNEL_CACHE_SECONDS = 5.0 # Cuánto se reutiliza la respuesta de /game/funnel/
+GAME_FUNNEL_CACHE_SIZE = 64 # Embudos (historia y versión) guardados a la vez
+
+# Servir STATIC_ROOT desde Django (con caché inmutable para los nombres con
+# hash); desactívalo si un servidor web sirve los estáticos
+GAME_SERVE_STATIC = not DEBUG
+
+# Respuestas JSON (game/responses.py): las de al menos GAME_GZIP_MIN_SIZE bytes
+# se comprimen con gzip si el cliente lo acepta
+GAME_GZIP_MIN_SIZE = 1024
+GAME_GZIP_LEVEL = 6 # Respuestas dinámicas; afd_info se comprime una vez con nivel 9
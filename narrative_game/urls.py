@@ -1,9 +1,12 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, include, re_path
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout
 from django.http import HttpResponse
+from game.assets import serve_static
+from game.metrics import metrics_view
 
 def home_view(request):
     """Vista de inicio que redirige al login si no está autenticado"""
@@ -23,4 +26,8 @@ urlpatterns = [
     path('game/', include('game.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
     path('logout/', logout_view, name='logout'),
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+if getattr(settings, 'GAME_SERVE_STATIC', False):
+    urlpatterns.append(re_path(r'^%s(?P<path>.+)$' % settings.STATIC_URL.lstrip('/'), serve_static))
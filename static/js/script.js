@@ -2,6 +2,10 @@
 
 // ============ FUNCIONES DE COMUNICACIÓN CON EL SERVIDOR ============
 
+// Base de los endpoints de la historia en juego: /game/ para la historia por
+// defecto o /game/stories/<id>/ (la pone la plantilla en <body data-game-url>).
+const GAME_URL = document.body.dataset.gameUrl || '/game/';
+
 /**
  * Realiza una petición GET a una URL de Django.
  * @param {string} url La URL a la que se enviará la petición.
@@ -60,8 +64,119 @@ async function postData(url, data) {
     }
 }
 
+// ============ CANAL WEBSOCKET (CON RESPALDO HTTP) ============
+
+// Con ASGI el servidor ofrece un WebSocket por jugador en GAME_URL + 'ws/': la sesión
+// se carga una vez por conexión y cada acción es un mensaje pequeño. Si no está
+// disponible (servidor WSGI, proxy sin soporte...) se usan las peticiones HTTP.
+const gameSocket = {
+    socket: null,
+    nextId: 1,
+    pending: new Map()
+};
+
+/**
+ * Abre el WebSocket del juego.
+ * @returns {Promise<boolean>} true si la conexión quedó abierta.
+ */
+function connectGameSocket() {
+    if (!('WebSocket' in window)) {
+        return Promise.resolve(false);
+    }
+    return new Promise(resolve => {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        let socket;
+        try {
+            socket = new WebSocket(`${protocol}//${window.location.host}${GAME_URL}ws/`);
+        } catch (error) {
+            resolve(false);
+            return;
+        }
+        // No esperar indefinidamente si el servidor no responde al handshake
+        const timeout = setTimeout(() => resolve(false), 2000);
+
+        socket.onopen = () => {
+            clearTimeout(timeout);
+            gameSocket.socket = socket;
+            console.log("WebSocket del juego conectado");
+            resolve(true);
+        };
+        socket.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            const callback = gameSocket.pending.get(data.id);
+            if (callback) {
+                gameSocket.pending.delete(data.id);
+                callback(data);
+            }
+        };
+        socket.onclose = (event) => {
+            clearTimeout(timeout);
+            console.log("WebSocket del juego cerrado:", event.code);
+            gameSocket.socket = null;
+            // Las peticiones en curso se resuelven con null para reintentarlas por HTTP
+            gameSocket.pending.forEach(callback => callback(null));
+            gameSocket.pending.clear();
+            resolve(false);
+        };
+    });
+}
+
+/**
+ * Envía un mensaje por el WebSocket y espera su respuesta.
+ * @param {Object} message El mensaje ({type: 'state' | 'choice' | 'reset', ...}).
+ * @returns {Promise<Object|null>} La respuesta, o null si no hay conexión (usar HTTP).
+ */
+function sendGameMessage(message) {
+    if (!gameSocket.socket || gameSocket.socket.readyState !== WebSocket.OPEN) {
+        return Promise.resolve(null);
+    }
+    const id = gameSocket.nextId++;
+    return new Promise(resolve => {
+        gameSocket.pending.set(id, resolve);
+        gameSocket.socket.send(JSON.stringify({ ...message, id }));
+    });
+}
+
 // ============ FUNCIONES DE ACTUALIZACIÓN DE UI ============
 
+// Copia local de los estados visitados. El servidor solo envía los nuevos
+// (visited_delta) salvo que se pida la lista completa o la partida empiece de nuevo.
+let visitedStates = [];
+
+/**
+ * Actualiza la copia local de visitados con la respuesta del servidor.
+ * @param {Object} gameState Los datos del estado del juego.
+ * @returns {boolean} false si la copia local quedó desincronizada.
+ */
+function applyVisitedStates(gameState) {
+    if (Array.isArray(gameState.visited_states)) {
+        visitedStates = gameState.visited_states;
+    } else if (Array.isArray(gameState.visited_delta)) {
+        visitedStates = visitedStates.concat(gameState.visited_delta);
+    }
+    return gameState.visited_count === undefined || visitedStates.length === gameState.visited_count;
+}
+
+/**
+ * Pide la lista completa de visitados (si la copia local se desincronizó).
+ */
+async function refreshVisitedStates() {
+    const data = await fetchData(GAME_URL + 'afd_info/current/');
+    if (data && Array.isArray(data.visited_states)) {
+        visitedStates = data.visited_states;
+        renderVisitedStates();
+    }
+}
+
+function renderVisitedStates() {
+    const visitedStatesDisplay = document.getElementById('visitedStates');
+    if (visitedStatesDisplay) {
+        visitedStatesDisplay.innerHTML = visitedStates.map(state =>
+            `<span class="state-indicator">${state}</span>`
+        ).join('');
+    }
+}
+
 /**
  * Actualiza la interfaz de usuario con el estado del juego recibido del servidor.
  * @param {Object} gameState Los datos del estado del juego.
@@ -116,9 +231,11 @@ function updateUI(gameState) {
     }, 100);
 
     currentStateDisplay.textContent = gameState.current_state.toUpperCase();
-    visitedStatesDisplay.innerHTML = gameState.visited_states.map(state =>
-        `<span class="state-indicator">${state}</span>`
-    ).join('');
+    if (applyVisitedStates(gameState)) {
+        renderVisitedStates();
+    } else {
+        refreshVisitedStates();
+    }
 
     possibleTransitionsDisplay.textContent = gameState.possible_transitions.length > 0 ?
         gameState.possible_transitions.join(', ') : 'Estado final - Sin transiciones';
@@ -201,7 +318,12 @@ function updateUI(gameState) {
 // ============ FUNCIONES DE INTERACCIÓN DEL JUEGO ============
 
 async function startGame() {
-    const gameState = await fetchData('/game/state/?v=' + Date.now()); // Pide el estado inicial del juego a Django
+    // Pide el estado inicial del juego a Django (por WebSocket si está conectado)
+    // Al empezar se pide la lista completa de visitados; después llegan solo deltas
+    let gameState = await sendGameMessage({ type: 'state', visited: 'full' });
+    if (!gameState) {
+        gameState = await fetchData(GAME_URL + 'state/?visited=full&v=' + Date.now());
+    }
     updateUI(gameState);
 }
 
@@ -218,7 +340,10 @@ async function makeChoice() {
     submitBtn.disabled = true;
     submitBtn.textContent = 'Procesando...';
 
-    const response = await postData('/game/process_choice/', { choice: userInput.value });
+    let response = await sendGameMessage({ type: 'choice', choice: userInput.value });
+    if (!response) {
+        response = await postData(GAME_URL + 'process_choice/', { choice: userInput.value });
+    }
 
     // Rehabilitar botón
     submitBtn.disabled = false;
@@ -284,13 +409,35 @@ function showHelp() {
     }
 }
 
+// Petición de sugerencias en curso (se cancela si el jugador sigue escribiendo)
+let suggestionsRequest = null;
+let suggestionsTimer = null;
+const SUGGESTIONS_DELAY_MS = 120;
+
+async function fetchSuggestions(userInput) {
+    // Las calcula el servidor con los sinónimos que acepta (ver /game/suggest/)
+    if (suggestionsRequest) {
+        suggestionsRequest.abort();
+    }
+    suggestionsRequest = new AbortController();
+    try {
+        const response = await fetch(GAME_URL + 'suggest/?q=' + encodeURIComponent(userInput), {
+            signal: suggestionsRequest.signal,
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        return data.suggestions || [];
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error("Error al obtener sugerencias:", error);
+        }
+        return null;
+    }
+}
+
 function showActionSuggestions(userInput) {
-    // Obtener las transiciones disponibles del estado actual
-    const possibleTransitionsDisplay = document.getElementById('possibleTransitions');
-    if (!possibleTransitionsDisplay) return;
-    
-    const availableActions = possibleTransitionsDisplay.textContent.split(', ');
-    
     // Crear o actualizar el contenedor de sugerencias
     let suggestionsContainer = document.getElementById('actionSuggestions');
     if (!suggestionsContainer) {
@@ -315,24 +462,34 @@ function showActionSuggestions(userInput) {
         inputContainer.appendChild(suggestionsContainer);
     }
     
+    clearTimeout(suggestionsTimer);
     if (!userInput.trim()) {
+        if (suggestionsRequest) {
+            suggestionsRequest.abort();
+        }
         suggestionsContainer.style.display = 'none';
         return;
     }
     
-    // Filtrar sugerencias basadas en la entrada del usuario
-    const filteredSuggestions = availableActions.filter(action => 
-        action.toLowerCase().includes(userInput.toLowerCase())
-    );
-    
-    if (filteredSuggestions.length > 0) {
-        suggestionsContainer.innerHTML = filteredSuggestions.map(action => 
-            `<div class="suggestion-item" onclick="selectSuggestion('${action}')">${action}</div>`
-        ).join('');
-        suggestionsContainer.style.display = 'block';
-    } else {
-        suggestionsContainer.style.display = 'none';
-    }
+    // Esperar a que el jugador deje de teclear un momento antes de preguntar
+    suggestionsTimer = setTimeout(async () => {
+        const suggestions = await fetchSuggestions(userInput);
+        if (suggestions === null) return; // Cancelada o con error: se deja como estaba
+
+        if (suggestions.length > 0) {
+            suggestionsContainer.replaceChildren(...suggestions.map(suggestion => {
+                const item = document.createElement('div');
+                item.className = 'suggestion-item';
+                item.textContent = suggestion.text;
+                item.title = suggestion.action;
+                item.onclick = () => selectSuggestion(suggestion.text);
+                return item;
+            }));
+            suggestionsContainer.style.display = 'block';
+        } else {
+            suggestionsContainer.style.display = 'none';
+        }
+    }, SUGGESTIONS_DELAY_MS);
 }
 
 function selectSuggestion(action) {
@@ -353,14 +510,20 @@ async function resetGame() {
     resetBtn.disabled = true;
     resetBtn.textContent = '🔄 Reiniciando...';
     
-    const response = await postData('/game/reset/', {});
+    // Por WebSocket la respuesta ya trae el estado reiniciado
+    const socketResponse = await sendGameMessage({ type: 'reset' });
+    const response = socketResponse || await postData(GAME_URL + 'reset/', {});
     
     // Restaurar botón
     resetBtn.disabled = false;
     resetBtn.textContent = originalText;
     
     if (response && response.success) {
-        await startGame(); // Vuelve a iniciar el juego para obtener el estado reiniciado
+        if (socketResponse) {
+            updateUI(socketResponse);
+        } else {
+            await startGame(); // Vuelve a iniciar el juego para obtener el estado reiniciado
+        }
         showMessage('¡Aventura reiniciada! Comienza de nuevo.', 'success');
     } else if (response && response.message) {
         showMessage(response.message, 'error');
@@ -386,7 +549,11 @@ async function showAFDInfo() {
 
     try {
         console.log("Solicitando información del AFD...");
-        const afdInfo = await fetchData('/game/afd_info/?v=' + Date.now());
+        // El grafo lo cachea el navegador (ETag + 304); el estado del jugador se pide aparte
+        const [afdInfo, afdCurrent] = await Promise.all([
+            fetchData(GAME_URL + 'afd_info/'),
+            fetchData(GAME_URL + 'afd_info/current/')
+        ]);
         console.log("Información del AFD recibida:", afdInfo);
         
         if (!afdInfo) {
@@ -394,6 +561,13 @@ async function showAFDInfo() {
             showMessage("Error al cargar datos. Por favor, recarga la página.", "error");
             return;
         }
+
+        if (afdCurrent) {
+            afdInfo.current_state = afdCurrent.current_state;
+            afdInfo.visited_states = afdCurrent.visited_states;
+        }
+        // La disposición del grafo es un recurso inmutable: el navegador la guarda en caché
+        const layout = afdInfo.layout_url ? await fetchData(afdInfo.layout_url) : null;
         
         if (!afdInfo.states || !Array.isArray(afdInfo.states)) {
             console.error("Información del AFD inválida:", afdInfo);
@@ -408,7 +582,7 @@ async function showAFDInfo() {
             script.src = 'https://unpkg.com/vis-network/standalone/umd/vis-network.min.js';
             script.onload = () => {
                 console.log("Vis.js cargado, dibujando gráfico...");
-                drawAFDGraph(afdInfo);
+                drawAFDGraph(afdInfo, layout);
             };
             script.onerror = () => {
                 console.error("Error al cargar Vis.js");
@@ -417,7 +591,7 @@ async function showAFDInfo() {
             document.head.appendChild(script);
         } else {
             console.log("Vis.js ya está cargado, dibujando gráfico...");
-            drawAFDGraph(afdInfo);
+            drawAFDGraph(afdInfo, layout);
         }
     } catch (error) {
         console.error("Error al obtener información del AFD:", error);
@@ -425,7 +599,63 @@ async function showAFDInfo() {
     }
 }
 
-function drawAFDGraph(afdInfo) {
+function explorationTooltip(state, exploration) {
+    let title = state.description || state.label;
+    if (!exploration) {
+        return title;
+    }
+    const ending = exploration.endings[state.id];
+    if (ending) {
+        const playthroughs = ending.playthroughs !== null ? ending.playthroughs : '?';
+        title += `\n\nPartidas distintas: ${playthroughs}`;
+        title += `\nProbabilidad eligiendo al azar: ${(ending.probability * 100).toFixed(1)}%`;
+        if (ending.expected_length !== null) {
+            title += `\nDuración media: ${ending.expected_length.toFixed(1)} pasos`;
+        }
+    } else if (exploration.expected_visits[state.id] !== undefined) {
+        title += `\n\nVisitas esperadas por partida: ${exploration.expected_visits[state.id].toFixed(2)}`;
+    }
+    return title;
+}
+
+// Diagrama ya dibujado: al volver a abrir el modal solo se resaltan los estados
+let afdNetwork = null;
+let afdNetworkVersion = null;
+let afdNodes = null;
+let afdFinalStates = new Set();
+
+function afdNodeStyle(stateId, isFinal, currentState, visited) {
+    // Determinar el color del nodo
+    let nodeColor = '#4a9eff'; // Color por defecto
+    if (stateId === currentState) {
+        nodeColor = '#00d4ff'; // Estado actual
+    } else if (isFinal) {
+        nodeColor = '#ff4757'; // Estado final
+    } else if (visited.has(stateId)) {
+        nodeColor = '#2ed573'; // Estado visitado
+    }
+    const isCurrent = stateId === currentState;
+    return {
+        color: nodeColor,
+        borderWidth: isCurrent ? 3 : 1,
+        size: isCurrent ? 35 : 30,
+        font: {
+            size: isCurrent ? 16 : 14,
+            color: '#ffffff',
+            face: 'Arial'
+        }
+    };
+}
+
+function highlightAFDGraph(currentState, visitedStatesList) {
+    const visited = new Set(visitedStatesList || []);
+    afdNodes.update(afdNodes.getIds().map(id => Object.assign(
+        { id: id },
+        afdNodeStyle(id, afdFinalStates.has(id), currentState, visited)
+    )));
+}
+
+function drawAFDGraph(afdInfo, layout) {
     console.log("Iniciando dibujo del gráfico AFD con datos:", afdInfo);
     console.log("Tipo de vis:", typeof vis);
     console.log("Vis disponible:", window.vis);
@@ -436,6 +666,12 @@ function drawAFDGraph(afdInfo) {
         return;
     }
 
+    // Misma versión de la historia: el grafo ya está colocado, solo cambia el resaltado
+    if (afdNetwork && afdNetworkVersion === afdInfo.version) {
+        highlightAFDGraph(afdInfo.current_state, afdInfo.visited_states);
+        return;
+    }
+
     const container = document.getElementById('afdGraph');
     console.log("Buscando contenedor afdGraph:", container);
     if (!container) {
@@ -448,14 +684,16 @@ function drawAFDGraph(afdInfo) {
 
     const nodes = [];
     const edges = [];
+    // Exploración de caminos precalculada en el servidor (game/exploration.py)
+    const exploration = afdInfo.analysis ? afdInfo.analysis.exploration : null;
+    // Coordenadas precalculadas en el servidor (game/layout.py)
+    const positions = layout ? layout.nodes : null;
+    const visited = new Set(afdInfo.visited_states || []);
+    afdFinalStates = new Set();
 
     afdInfo.states.forEach(state => {
-        // Determinar el color del nodo
-        let nodeColor = '#4a9eff'; // Color por defecto
-        if (state.id === afdInfo.current_state) {
-            nodeColor = '#00d4ff'; // Estado actual
-        } else if (state.isFinal) {
-            nodeColor = '#ff4757'; // Estado final
+        if (state.isFinal) {
+            afdFinalStates.add(state.id);
         }
 
         // Crear etiqueta más legible
@@ -466,20 +704,17 @@ function drawAFDGraph(afdInfo) {
             ).join('\n');
         }
 
-        nodes.push({
+        const node = Object.assign({
             id: state.id,
             label: label,
-            color: nodeColor,
             shape: state.isFinal ? 'diamond' : 'ellipse',
-            borderWidth: (state.id === afdInfo.current_state) ? 3 : 1,
-            size: (state.id === afdInfo.current_state) ? 35 : 30,
-            font: { 
-                size: (state.id === afdInfo.current_state) ? 16 : 14,
-                color: '#ffffff',
-                face: 'Arial'
-            },
-            title: state.description || state.label // Tooltip con descripción
-        });
+            title: explorationTooltip(state, exploration) // Tooltip con descripción y exploración
+        }, afdNodeStyle(state.id, state.isFinal, afdInfo.current_state, visited));
+        if (positions && positions[state.id]) {
+            node.x = positions[state.id].x;
+            node.y = positions[state.id].y;
+        }
+        nodes.push(node);
 
         Object.entries(state.transitions).forEach(([input, target]) => {
             // Crear etiqueta más legible para las transiciones
@@ -512,10 +747,18 @@ function drawAFDGraph(afdInfo) {
     document.getElementById('totalStates').textContent = afdInfo.total_states;
     document.getElementById('totalTransitions').textContent = afdInfo.total_transitions;
     document.getElementById('finalStates').textContent = afdInfo.final_states_count;
+    if (exploration) {
+        document.getElementById('playthroughs').textContent =
+            exploration.playthroughs !== null ? exploration.playthroughs : 'demasiadas para contarlas';
+        document.getElementById('expectedLength').textContent =
+            exploration.expected_length !== null ? `${exploration.expected_length.toFixed(1)} pasos` : 'puede no terminar';
+    }
 
-    const data = { nodes, edges };
+    afdNodes = new vis.DataSet(nodes);
+    const data = { nodes: afdNodes, edges: new vis.DataSet(edges) };
     const options = {
-        layout: {
+        // Con coordenadas del servidor el navegador no calcula la disposición
+        layout: positions ? { randomSeed: 0 } : {
             hierarchical: {
                 direction: 'LR',
                 sortMethod: 'directed',
@@ -552,10 +795,15 @@ function drawAFDGraph(afdInfo) {
     console.log("Creando red de Vis.js con datos:", data);
     console.log("Opciones:", options);
     try {
-        const network = new vis.Network(container, data, options);
-        console.log("Red creada exitosamente:", network);
+        if (afdNetwork) {
+            afdNetwork.destroy();
+        }
+        afdNetwork = new vis.Network(container, data, options);
+        afdNetworkVersion = afdInfo.version;
+        console.log("Red creada exitosamente:", afdNetwork);
         showMessage("Diagrama AFD cargado correctamente", "success");
     } catch (error) {
+        afdNetwork = null;
         console.error("Error al crear el gráfico AFD:", error);
         showMessage("Error al crear el diagrama AFD: " + error.message, "error");
     }
@@ -568,8 +816,8 @@ function drawAFDGraph(afdInfo) {
 document.addEventListener('DOMContentLoaded', function() {
     console.log("DOM cargado, inicializando juego...");
     
-    // Inicializar el juego cargando el estado desde Django
-    startGame();
+    // Inicializar el juego cargando el estado desde Django (WebSocket si está disponible)
+    connectGameSocket().then(startGame);
 
     // Asignar el evento al botón de enviar (submitChoice)
     const submitChoiceBtn = document.getElementById('submitChoice');